@@ -0,0 +1,309 @@
+import numpy as np
+
+from bsp2obj.mesh import *
+from bsp2obj.image import *
+
+# Largest atlas page edge, in pixels. A texture bigger than this gets a page sized to fit it
+DEFAULT_ATLAS_SIZE = 4096
+
+# Pixels of (wrapped) texture repeated around each texture in its page, so filtering at the edges
+# of a texture samples what the repeating texture would have shown rather than its neighbour
+ATLAS_PADDING = 2
+
+# UVs this close to a whole number count as lying on it when deciding which tiles a triangle covers
+TILE_EPSILON = 1e-6
+
+# Pieces with less area than this (in map units squared) are dropped, and points made by splitting
+# that are within this distance of each other are merged
+AREA_EPSILON = 1e-6
+VERTEX_EPSILON = 1e-4
+
+# Number of triangles split at once, bounding the memory used while splitting
+SPLIT_BATCH = 4096
+
+# Textures whose triangles would, on average, cover more tiles than this (small textures repeated across
+# huge faces) are left out of the atlas and keep their own repeating material rather than being split
+MAX_SPLIT_FACTOR = 64
+
+class AtlasRegion(object):
+    def __init__(self, page, x, y, width, height):
+        self.page = page
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+
+    def __repr__(self):
+        return "AtlasRegion (page: {}, x: {}, y: {}, width: {}, height: {})".format(self.page, self.x, self.y, self.width, self.height)
+
+class AtlasReport(object):
+    def __init__(self, textures, pages, excluded, trianglesBefore, trianglesAfter):
+        self.textures = textures
+        self.pages = pages
+        self.excluded = excluded
+        self.trianglesBefore = trianglesBefore
+        self.trianglesAfter = trianglesAfter
+
+    def __repr__(self):
+        return "AtlasReport (textures: {}, pages: {}, excluded: {}, triangles: {} -> {})".format(self.textures, self.pages, self.excluded, self.trianglesBefore, self.trianglesAfter)
+
+""" Packs rectangles of the given (width, height) into as few pages of `pageSize` pixels square as a
+    shelf packer manages: tallest first, left to right along shelves stacked top to bottom. This is
+    O(n log n) so it stays quick for maps with many hundreds of textures. Returns an AtlasRegion per
+    rectangle (its position excluding padding) and the (width, height) actually used on each page """
+def packShelves(sizes, pageSize=DEFAULT_ATLAS_SIZE, padding=ATLAS_PADDING):
+    if len(sizes) > 0:
+        pageSize = max(pageSize, max(max(width, height) + 2 * padding for width, height in sizes))
+
+    regions = [None] * len(sizes)
+    pages = []
+    x = y = shelfHeight = usedWidth = 0
+
+    for i in sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0])):
+        width = sizes[i][0] + 2 * padding
+        height = sizes[i][1] + 2 * padding
+
+        # Start a new shelf, and a new page once the shelves reach the bottom of this one
+        if x + width > pageSize:
+            x = 0
+            y += shelfHeight
+            shelfHeight = 0
+        if y + height > pageSize:
+            pages.append((usedWidth, y))
+            x = y = shelfHeight = usedWidth = 0
+
+        regions[i] = AtlasRegion(len(pages), x + padding, y + padding, sizes[i][0], sizes[i][1])
+        x += width
+        shelfHeight = max(shelfHeight, height)
+        usedWidth = max(usedWidth, x)
+
+    if len(sizes) > 0:
+        pages.append((usedWidth, y + shelfHeight))
+
+    return regions, pages
+
+""" Returns a texture's pixels as an (height, width, 3) array of RGB bytes """
+def rgbPixels(texture):
+    pixels = np.frombuffer(texture.pixels, np.uint8)
+    if texture.palette is not None:
+        palette = np.frombuffer(texture.palette.ljust(256 * 3, b"\x00"), np.uint8).reshape(-1, 3)
+        pixels = palette[pixels]
+
+    return pixels.reshape(texture.height, texture.width, 3)
+
+# Clips a batch of convex polygons to one side of an axis-aligned line in UV space. Polygons are padded
+# to a common number of points, each (x, y, z, u, v), with `counts` giving how many are real. `ids` holds
+# each point's vertex index (-1 for points made by clipping). `lines` holds a line per polygon and `sign`
+# is 1 to keep what's above the line or -1 to keep what's below it
+def clipPolygons(points, counts, ids, axis, lines, sign):
+    rows, size = ids.shape
+    slots = np.arange(size)
+    valid = slots[None, :] < counts[:, None]
+    following = np.take_along_axis(points, ((slots[None, :] + 1) % np.maximum(counts[:, None], 1))[:, :, None], axis=1)
+
+    distance = (points[:, :, 3 + axis] - lines[:, None]) * sign
+    followingDistance = (following[:, :, 3 + axis] - lines[:, None]) * sign
+    crossing = valid & (((distance > 0) & (followingDistance < 0)) | ((distance < 0) & (followingDistance > 0)))
+    t = distance / np.where(crossing, distance - followingDistance, 1)
+    intersections = points + (following - points) * t[:, :, None]
+    intersections[:, :, 3 + axis] = lines[:, None]
+
+    # Walking the edges in order, each keeps its first point if that's inside and adds the point
+    # where it crosses the line. Clipping adds at most one point to a convex polygon, so the
+    # surviving candidates are packed to the front of rows one point longer than before
+    candidates = np.stack((points, intersections), axis=2).reshape(rows, 2 * size, 5)
+    candidateIDs = np.stack((ids, np.full_like(ids, -1)), axis=2).reshape(rows, 2 * size)
+    keep = np.stack((valid & (distance >= 0), crossing), axis=2).reshape(rows, 2 * size)
+
+    row, column = np.nonzero(keep)
+    slot = np.cumsum(keep, axis=1)[row, column] - 1
+    clipped = np.zeros((rows, size + 1, 5))
+    clipped[row, slot] = candidates[row, column]
+    clippedIDs = np.full((rows, size + 1), -1, dtype=ids.dtype)
+    clippedIDs[row, slot] = candidateIDs[row, column]
+
+    return clipped, keep.sum(axis=1), clippedIDs
+
+# Returns the first and last-but-one whole-number tile each triangle's (n, 3, 2) UVs cover on each axis
+def tileBounds(uvs):
+    low = np.floor(uvs.min(axis=1) + TILE_EPSILON).astype(np.int64)
+    high = np.maximum(np.ceil(uvs.max(axis=1) - TILE_EPSILON).astype(np.int64), low + 1)
+    return low, high
+
+# Replaces each polygon with one copy per whole-number tile its UVs cover along `axis`, each clipped to
+# that tile. Returns the polygon every copy came from and its tile alongside the clipped polygons
+def splitAxis(polygons, counts, ids, axis):
+    valid = np.arange(polygons.shape[1])[None, :] < counts[:, None]
+    coordinates = polygons[:, :, 3 + axis]
+    low = np.floor(np.where(valid, coordinates, np.inf).min(axis=1) + TILE_EPSILON).astype(np.int64)
+    high = np.maximum(np.ceil(np.where(valid, coordinates, -np.inf).max(axis=1) - TILE_EPSILON).astype(np.int64), low + 1)
+
+    tileCounts = high - low
+    source = np.repeat(np.arange(len(polygons)), tileCounts)
+    tiles = low[source] + np.arange(len(source)) - np.repeat(np.cumsum(tileCounts) - tileCounts, tileCounts)
+    lines = tiles.astype(np.float64)
+
+    clipped, clippedCounts, clippedIDs = clipPolygons(polygons[source], counts[source], ids[source], axis, lines, 1)
+    clipped, clippedCounts, clippedIDs = clipPolygons(clipped, clippedCounts, clippedIDs, axis, lines + 1, -1)
+
+    # Tiles that only touch a polygon along an edge or at a point leave nothing behind
+    keep = clippedCounts >= 3
+    return source[keep], tiles[keep], clipped[keep], clippedCounts[keep], clippedIDs[keep]
+
+""" Cuts triangles, given as (n, 3, 5) corners of (x, y, z, u, v) with (n, 3) vertex `ids`, into pieces
+    that each lie within a single whole-number UV tile: first into columns along U, then each column along V.
+    Triangles are processed SPLIT_BATCH at a time and the pieces are fan-triangulated. Returns each new
+    triangle's parent, corners, corner ids (-1 where a corner was made by clipping) and tile """
+def splitTriangles(points, ids):
+    parents = []
+    corners = []
+    cornerIDs = []
+    cornerTiles = []
+    for start in range(0, len(points), SPLIT_BATCH):
+        batch = points[start:(start + SPLIT_BATCH)]
+        columns, tileU, polygons, counts, polygonIDs = splitAxis(batch, np.full(len(batch), 3), ids[start:(start + SPLIT_BATCH)], 0)
+        pieces, tileV, polygons, counts, polygonIDs = splitAxis(polygons, counts, polygonIDs, 1)
+
+        # Fan-triangulate each piece from its first point, keeping pieces (and their triangles) in order
+        piece, fan = np.nonzero(counts[:, None] > np.arange(2, polygons.shape[1])[None, :])
+        slots = np.column_stack((np.zeros(len(fan), np.intp), fan + 1, fan + 2))
+        pieceCorners = np.take_along_axis(polygons[piece], slots[:, :, None], axis=1)
+        pieceIDs = np.take_along_axis(polygonIDs[piece], slots, axis=1)
+
+        # Drop slivers left by points lying (almost) exactly on a tile boundary
+        U = pieceCorners[:, 1, :3] - pieceCorners[:, 0, :3]
+        V = pieceCorners[:, 2, :3] - pieceCorners[:, 0, :3]
+        keep = np.linalg.norm(np.cross(U, V), axis=1) > AREA_EPSILON
+        piece = piece[keep]
+
+        parents.append(start + columns[pieces[piece]])
+        corners.append(pieceCorners[keep])
+        cornerIDs.append(pieceIDs[keep])
+        cornerTiles.append(np.column_stack((tileU[pieces[piece]], tileV[piece])).astype(np.float64))
+
+    if len(parents) == 0:
+        return np.zeros(0, np.intp), np.zeros((0, 3, 5)), np.zeros((0, 3), np.int64), np.zeros((0, 2))
+
+    return np.concatenate(parents), np.concatenate(corners), np.concatenate(cornerIDs), np.concatenate(cornerTiles)
+
+# Pages are named atlas0, atlas1, ..., extended with underscores wherever a texture keeping its own group
+# already has that name. Names are compared ignoring case, as they also name files on disk
+def atlasPageName(page, textureNames):
+    taken = set(str(name).lower() for name in textureNames)
+    name = "atlas%i"%(page)
+    while name.lower() in taken:
+        name += "_"
+    return name
+
+""" Moves every texture in `mesh` into atlas pages of at most `pageSize` pixels, returning a new Mesh
+    with one group (and one material) per page along with an AtlasReport. A page can't repeat a texture
+    the way a standalone texture can, so triangles whose UVs span more than one repeat are split at
+    every whole-number U and V they cross, and each piece is mapped into its texture's region.
+    Textures that would need splitting beyond MAX_SPLIT_FACTOR keep their own group and material """
+def buildAtlas(mesh, pageSize=DEFAULT_ATLAS_SIZE, padding=ATLAS_PADDING):
+    names = []
+    excluded = []
+    for name, group in mesh.groups.items():
+        low, high = tileBounds(mesh.uvs[group.uvIndices])
+        if np.prod(high - low, axis=1).sum() <= MAX_SPLIT_FACTOR * len(group.vertexIndices):
+            names.append(name)
+        else:
+            excluded.append(name)
+
+    textures = [mesh.textures[name].load() for name in names]
+    regions, pageSizes = packShelves([(texture.width, texture.height) for texture in textures], pageSize, padding)
+
+    # Paint each texture into its page, surrounded by wrapped copies of its own edges
+    pages = [np.zeros((height, width, 3), np.uint8) for width, height in pageSizes]
+    for texture, region in zip(textures, regions):
+        pixels = np.pad(rgbPixels(texture), ((padding, padding), (padding, padding), (0, 0)), mode="wrap")
+        pages[region.page][(region.y - padding):(region.y + region.height + padding), (region.x - padding):(region.x + region.width + padding)] = pixels
+
+    newVertices = []
+    newVertexCount = 0
+    pageVertexIndices = [[] for page in pages]
+    pageUVs = [[] for page in pages]
+    pageNormalIndices = [[] for page in pages]
+
+    # Maps UVs local to a single repeat ([0, 1] on both axes) into the region's place on its page.
+    # Mesh UVs have v pointing up while pages are laid out from the top, hence the flips
+    def toAtlas(local, region):
+        width, height = pageSizes[region.page]
+        uvs = np.empty_like(local)
+        uvs[..., 0] = (region.x + local[..., 0] * region.width) / width
+        uvs[..., 1] = 1 - (region.y + (1 - local[..., 1]) * region.height) / height
+        return uvs
+
+    for name, texture, region in zip(names, textures, regions):
+        group = mesh.groups[name]
+        uvs = mesh.uvs[group.uvIndices]
+
+        # Triangles already within a single repeat only need their UVs moving
+        tile = np.floor(uvs.min(axis=1) + TILE_EPSILON)
+        local = uvs - tile[:, None, :]
+        inside = np.all(local <= 1 + TILE_EPSILON, axis=(1, 2))
+
+        pageVertexIndices[region.page].append(group.vertexIndices[inside].astype(np.int64))
+        pageUVs[region.page].append(toAtlas(np.clip(local[inside], 0, 1), region).reshape(-1, 2))
+        pageNormalIndices[region.page].append(group.normalIndices[inside])
+
+        # Everything else is cut into one piece per repeat it covers
+        crossing = np.flatnonzero(~inside)
+        if len(crossing) == 0:
+            continue
+
+        vertexIndices = group.vertexIndices[crossing].astype(np.int64)
+        points = np.concatenate((mesh.vertices[vertexIndices].astype(np.float64), uvs[crossing]), axis=2)
+        parents, corners, cornerIDs, cornerTiles = splitTriangles(points, vertexIndices)
+
+        # Points made by clipping are numbered -1, -2, ... across the whole mesh until they're welded below
+        made = cornerIDs < 0
+        cornerIDs[made] = -1 - (newVertexCount + np.arange(np.count_nonzero(made)))
+        newVertexCount += np.count_nonzero(made)
+        newVertices.append(corners[made][:, :3])
+
+        pageVertexIndices[region.page].append(cornerIDs)
+        pageUVs[region.page].append(toAtlas(np.clip(corners[:, :, 3:] - cornerTiles[:, None, :], 0, 1), region).reshape(-1, 2))
+        pageNormalIndices[region.page].append(group.normalIndices[crossing[parents]])
+
+    # Points made where neighbouring pieces were cut along the same line are shared
+    vertices = mesh.vertices
+    if newVertexCount > 0:
+        positions, remap = deduplicate(np.concatenate(newVertices), VERTEX_EPSILON)
+        remap = remap + len(mesh.vertices)
+        vertices = np.concatenate((mesh.vertices, positions.astype(mesh.vertices.dtype)))
+        for indices in pageVertexIndices:
+            for vertexIndices in indices:
+                made = vertexIndices < 0
+                vertexIndices[made] = remap[-1 - vertexIndices[made]]
+
+    # Every corner gets its own UV; welding can share them afterwards
+    groups = {}
+    atlasTextures = {}
+    uvs = []
+    uvCount = 0
+    for i, page in enumerate(pages):
+        name = atlasPageName(i, excluded)
+        vertexIndices = np.concatenate(pageVertexIndices[i]).astype(np.intp)
+        pageUV = np.concatenate(pageUVs[i])
+        uvIndices = np.arange(uvCount, uvCount + len(pageUV)).reshape(-1, 3)
+        uvs.append(pageUV)
+        uvCount += len(pageUV)
+
+        groups[name] = TextureGroup(vertexIndices, uvIndices, np.concatenate(pageNormalIndices[i]))
+        height, width = page.shape[:2]
+        atlasTextures[name] = Texture(page.tobytes(), width, height, name)
+
+    for name in excluded:
+        group = mesh.groups[name]
+        excludedUV = mesh.uvs[group.uvIndices].reshape(-1, 2)
+        uvIndices = np.arange(uvCount, uvCount + len(excludedUV)).reshape(-1, 3)
+        uvs.append(excludedUV)
+        uvCount += len(excludedUV)
+
+        groups[name] = TextureGroup(group.vertexIndices, uvIndices, group.normalIndices)
+        atlasTextures[name] = mesh.textures[name]
+
+    uvs = np.concatenate(uvs) if len(uvs) > 0 else np.zeros((0, 2))
+    atlas = Mesh(vertices, uvs, mesh.normals, groups, atlasTextures)
+    return atlas, AtlasReport(len(textures), len(pages), len(excluded), mesh.numTriangles(), atlas.numTriangles())
@@ -0,0 +1,178 @@
+import os, sys, time, traceback, json, tracemalloc
+
+from concurrent.futures import ProcessPoolExecutor
+
+from bsp2obj.bsp import *
+from bsp2obj.pak import *
+from bsp2obj.manifest import *
+from bsp2obj.stats import *
+
+class BatchResult(object):
+    # `changes` holds the manifest records made while converting, if running incrementally,
+    # and `stats` a Stats snapshot taken when the map was converted in a worker process
+    def __init__(self, name, outputPath, seconds, error=None, skipped=False, changes=None, stats=None):
+        self.name = name
+        self.outputPath = outputPath
+        self.seconds = seconds
+        self.error = error
+        self.skipped = skipped
+        self.changes = changes
+        self.stats = stats
+
+    def __repr__(self):
+        return "BatchResult (name: {}, seconds: {:.2f}, skipped: {}, error: {})".format(self.name, self.seconds, self.skipped, self.error)
+
+""" Converts every map in a PAK set matching a pattern, opening the archives and palette only once.
+    Options are passed straight through to BSP.saveOBJ/saveGLB. Given a Manifest, maps whose inputs
+    haven't changed since they were last converted are skipped. Decoded textures are shared between maps
+    through the default texture cache, or a cache of their own holding up to `textureCacheBytes` """
+class BatchConverter(object):
+    def __init__(self, game, paks, palette, outputPath, outputFormat="obj", manifest=None, textureCacheBytes=None, **options):
+        self.game = game
+        self.paks = paks
+        self.palette = BSP.loadPalette(palette, paks)
+        self.outputPath = outputPath
+        self.outputFormat = outputFormat
+        self.manifest = manifest
+        self.options = options
+        self.textureCacheBytes = textureCacheBytes
+        self.textureCache = newTextureCache(textureCacheBytes) if textureCacheBytes is not None else None
+
+        # The worker count doesn't change what gets written, so it doesn't invalidate earlier output
+        outputOptions = dict((key, value) for key, value in options.items() if key != "workers")
+        self.optionsHash = digest(json.dumps([outputFormat, outputOptions], sort_keys=True).encode("utf-8"))
+        self.paletteHash = digest(self.palette.pixels)
+
+    # maps/e1m1.bsp is written to <outputPath>/e1m1.obj (plus its MTL and texture folder). Given a `depth`,
+    # only that many leading folders are dropped, so with a depth of 1 maps/dm/e1m1.bsp goes to <outputPath>/dm/e1m1.obj
+    def outputPathForMap(self, name, depth=None):
+        components = name.split("/")
+        if depth is None:
+            depth = len(components) - 1
+        return os.path.join(self.outputPath, *components[depth:-1], os.path.splitext(components[-1])[0])
+
+    # Converts a single map, written to `outputFileName` or, by default, outputPathForMap(name)
+    def convert(self, name, outputFileName=None):
+        start = time.time()
+        if outputFileName is None:
+            outputFileName = self.outputPathForMap(name)
+
+        try:
+            data = self.paks.dataForEntry(name)
+            if data is None:
+                raise KeyError("Unable to find `%s` in provided PAK file(s) or filesystem" %(name))
+
+            # The map is read from lazily while it's exported, so the entry stays open until it's written
+            with data:
+                if self.manifest is not None:
+                    sourceHash = digest(data.getbuffer())
+                    if self.manifest.isUpToDate(outputFileName, sourceHash, self.paletteHash, self.optionsHash, self.paks):
+                        logger.info("`%s` is up to date"%(name))
+                        return BatchResult(name, outputFileName, time.time() - start, skipped=True)
+
+                bsp = BSP(data, self.paks, self.palette, self.game, name, self.textureCache)
+                if self.outputFormat == "glb":
+                    outputs = bsp.saveGLB(outputFileName, self.options.get("weldTolerance"), self.options.get("atlasSize"), self.options.get("simplify", False), self.options.get("vertexCache", False), self.options.get("chunkSize"), self.options.get("lightmaps", False))
+                elif self.outputFormat == "obj":
+                    outputs = bsp.saveOBJ(outputFileName, manifest=self.manifest, **self.options)
+                else:
+                    outputs = bsp.saveWith(outputFileName, exporterForFormat(self.outputFormat), self.options.get("weldTolerance"), self.options.get("atlasSize"), self.options.get("simplify", False), self.options.get("vertexCache", False), self.options.get("lightmaps", False))
+
+                if self.manifest is not None:
+                    textureSources = {}
+                    for path in bsp.externalTexturePaths():
+                        with self.paks.dataForEntry(path) as textureData:
+                            textureSources[path] = digest(textureData.getbuffer())
+                    self.manifest.recordMap(outputFileName, sourceHash, self.paletteHash, self.optionsHash, textureSources, outputs)
+        except Exception:
+            if self.manifest is not None:
+                self.manifest.discardChanges()
+            return BatchResult(name, outputFileName, time.time() - start, traceback.format_exc())
+
+        changes = self.manifest.takeChanges() if self.manifest is not None else None
+        return BatchResult(name, outputFileName, time.time() - start, changes=changes)
+
+    # Converts every entry in `names`, spreading them over `workers` processes when more than one is requested.
+    # Maps keep their folders below the one they all share, so maps of the same name never overwrite each other
+    def convertAll(self, names, workers=1):
+        depth = sharedFolderDepth(names)
+        outputFileNames = [self.outputPathForMap(name, depth) for name in names]
+
+        if workers is None or workers <= 1 or len(names) <= 1:
+            results = [self.convert(name, outputFileName) for name, outputFileName in zip(names, outputFileNames)]
+        else:
+            # Each worker maps the same archives read-only, so they share the OS page cache rather than
+            # holding private copies. Maps are already spread over processes, so unless texture workers were
+            # asked for explicitly textures are written serially.
+            # Workers start from a snapshot of the manifest and hand their records back to be merged here
+            options = dict(self.options, workers=self.options.get("workers") or 1)
+            paths = [pak.path for pak in self.paks.list]
+            initArgs = (self.game, paths, self.paks.useCache, self.palette, self.outputPath, self.outputFormat, self.manifest, self.textureCacheBytes, options, stats.enabled, stats.traceMemory)
+
+            with ProcessPoolExecutor(max_workers=workers, initializer=initWorker, initargs=initArgs) as pool:
+                results = list(pool.map(convertInWorker, names, outputFileNames))
+
+            for result in results:
+                if self.manifest is not None and result.changes is not None:
+                    self.manifest.merge(*result.changes)
+                if result.stats is not None:
+                    stats.merge(*result.stats)
+
+        if self.manifest is not None:
+            self.manifest.save()
+
+        return results
+
+# The number of leading folders every name shares, compared ignoring case as PAK lookups are
+def sharedFolderDepth(names):
+    folders = [name.lower().split("/")[:-1] for name in names]
+    if len(folders) == 0:
+        return 0
+
+    depth = 0
+    while all(len(folder) > depth and folder[depth] == folders[0][depth] for folder in folders):
+        depth += 1
+    return depth
+
+# The converter owned by each worker process of BatchConverter.convertAll
+workerConverter = None
+
+def initWorker(game, paths, useCache, palette, outputPath, outputFormat, manifest, textureCacheBytes, options, collectStats=False, traceMemory=False):
+    global workerConverter
+    if collectStats:
+        stats.enable(traceMemory)
+        if traceMemory:
+            tracemalloc.start()
+
+    paks = PAKCollection(game, paths, useCache)
+    workerConverter = BatchConverter(game, paks, palette, outputPath, outputFormat, manifest, textureCacheBytes, **options)
+
+# Each map's stats are handed back with its result, to be merged into the parent's
+def convertInWorker(name, outputFileName):
+    if not stats.enabled:
+        return workerConverter.convert(name, outputFileName)
+
+    stats.clear()
+    result = workerConverter.convert(name, outputFileName)
+    result.stats = stats.snapshot()
+    return result
+
+def printSummary(results, elapsed):
+    print("")
+    print("Converted %i map(s)"%(len(results)))
+
+    for result in results:
+        status = "ok" if result.error is None else "FAILED"
+        if result.skipped:
+            status = "up to date"
+        print("  {:<40} {:>8.2f}s  {}".format(result.name, result.seconds, status))
+
+    failures = [result for result in results if result.error is not None]
+    for result in failures:
+        print("")
+        print("`%s` failed:"%(result.name))
+        print(result.error.rstrip())
+
+    print("")
+    skipped = [result for result in results if result.skipped]
+    print("{} converted, {} up to date, {} failed in {:.2f}s".format(len(results) - len(failures) - len(skipped), len(skipped), len(failures), elapsed))
@@ -0,0 +1,309 @@
+import os, sys, json, getopt, shutil, tempfile, tracemalloc, platform
+
+import numpy as np
+
+from bsp2obj.bsp import *
+from bsp2obj.pak import *
+from bsp2obj.cache import *
+from bsp2obj.synthetic import *
+from bsp2obj.stats import *
+from bsp2obj.lightmap import *
+
+""" Times each stage of a conversion against synthetic maps, so regressions can be tracked without
+    shipping game data. Every scale is converted `repeats` times with nothing traced and the fastest
+    run reported, then once more under tracemalloc to measure each stage's peak allocation """
+
+# Stages in the order they run. Each is timed on its own
+BENCHMARK_STAGES = ["archive_open", "archive_read", "parse", "triangulate", "textures", "write"]
+BENCHMARK_FORMAT_VERSION = 1
+
+GAME_NAMES = {Game.Q1: "q1", Game.HL1: "hl1", Game.Q2: "q2", Game.DAIKATANA: "daikatana"}
+
+class BenchmarkScale(object):
+    def __init__(self, game, numFaces=1024, edgesPerFace=4, numTextures=16, textureSize=64, numEntries=0, entrySize=1024, compress=False, lightmaps=False):
+        self.game = game
+        self.numFaces = numFaces
+        self.edgesPerFace = edgesPerFace
+        self.numTextures = numTextures
+        self.textureSize = textureSize
+        self.numEntries = numEntries
+        self.entrySize = entrySize
+        self.compress = compress
+        self.lightmaps = lightmaps
+
+    # Identifies a scale across result files, so runs of the same scale can be compared
+    def key(self):
+        return "{}/faces={}/edges={}/textures={}x{}/entries={}x{}{}{}".format(GAME_NAMES[self.game], self.numFaces, self.edgesPerFace,
+            self.numTextures, self.textureSize, self.numEntries, self.entrySize, "/compressed" if self.compress else "", "/lightmaps" if self.lightmaps else "")
+
+    def toJSON(self):
+        return {"game": GAME_NAMES[self.game], "faces": self.numFaces, "edgesPerFace": self.edgesPerFace, "textures": self.numTextures,
+            "textureSize": self.textureSize, "entries": self.numEntries, "entrySize": self.entrySize, "compress": self.compress, "lightmaps": self.lightmaps}
+
+""" Converts the map in the synthetic PAK at `pakPath` once, writing into `outputFolder`, and returns the
+    number of triangles written. The texture cache is private to the run, so textures are always decoded """
+def runConversion(scale, pakPath, outputFolder, timer, outputFormat="obj", workers=1):
+    with timer.stage("archive_open"):
+        paks = PAKCollection(scale.game, [pakPath])
+
+    bspMap = None
+    try:
+        # Reads (and, for compressed Daikatana entries, decompresses) every entry in the archive
+        with timer.stage("archive_read"):
+            for name in paks.namesForExpression("*"):
+                with paks.dataForEntry(name) as data:
+                    data.getbuffer()
+
+        with timer.stage("parse"):
+            bspMap = BSPMap.fromPAKs(paks, SYNTHETIC_MAP_NAME, SYNTHETIC_PALETTE_NAME, newTextureCache())
+
+        with timer.stage("triangulate"):
+            mesh = bspMap.buildMesh(lightmaps=scale.lightmaps)
+
+        with timer.stage("textures"):
+            textures = dict((name, texture.load()) for name, texture in mesh.textures.items())
+
+        outputFileName = os.path.join(outputFolder, "synthetic")
+        with timer.stage("write"):
+            createFolderStructure(outputFileName)
+            if outputFormat == "glb":
+                with open(outputFileName + ".glb", "wb", buffering=BUFFER_SIZE) as outputFile:
+                    writeGLB(outputFile, mesh, "synthetic")
+            else:
+                with open(outputFileName + ".obj", "w", buffering=BUFFER_SIZE) as outputFile:
+                    writeOBJ(outputFile, mesh, "synthetic.mtl")
+                with open(outputFileName + ".mtl", "w", buffering=BUFFER_SIZE) as mtlFile:
+                    writeMTL(mtlFile, mesh, "synthetic")
+                texturePaths = [(outputFileName + "/" + name + ".png", texture) for name, texture in textures.items()]
+
+                # Written the way BSP.saveOBJ writes them, as a second OBJ over the same triangles
+                if mesh.lightmap is not None:
+                    lightmapped = lightmapMesh(mesh)
+                    with open(outputFileName + "_lightmap.obj", "w", buffering=BUFFER_SIZE) as outputFile:
+                        writeOBJ(outputFile, lightmapped, "synthetic_lightmap.mtl")
+                    with open(outputFileName + "_lightmap.mtl", "w", buffering=BUFFER_SIZE) as mtlFile:
+                        writeMTL(mtlFile, lightmapped, "synthetic_lightmap")
+                    texturePaths.append((outputFileName + "_lightmap/lightmap.png", mesh.lightmap))
+                saveTextures(texturePaths, workers)
+
+        return mesh.numTriangles()
+    finally:
+        if bspMap is not None:
+            bspMap.close()
+        paks.close()
+
+""" Benchmarks a single scale and returns its results as a JSON-ready dict """
+def benchmarkScale(scale, repeats=3, outputFormat="obj", workers=1, seed=0):
+    folder = tempfile.mkdtemp(prefix="bsp2obj-benchmark-")
+    try:
+        pakPath = os.path.join(folder, "synthetic.pak")
+        numEntries = writeSyntheticPAK(pakPath, scale.game, scale.numFaces, scale.edgesPerFace, scale.numTextures, scale.textureSize,
+            scale.numEntries, scale.entrySize, scale.compress, seed)
+
+        runs = []
+        for i in range(max(repeats, 1)):
+            outputFolder = os.path.join(folder, "run%i"%(i))
+            timer = Stats()
+            triangles = runConversion(scale, pakPath, outputFolder, timer, outputFormat, workers)
+            runs.append(timer.seconds)
+
+        # The traced run also collects the pipeline's own counters (bytes read, textures decoded...)
+        timer = Stats(traceMemory=True)
+        stats.clear()
+        stats.enable()
+        tracemalloc.start()
+        try:
+            runConversion(scale, pakPath, os.path.join(folder, "traced"), timer, outputFormat, workers)
+        finally:
+            tracemalloc.stop()
+            stats.disable()
+
+        stages = {}
+        for name in BENCHMARK_STAGES:
+            seconds = [run[name] for run in runs]
+            stages[name] = {"seconds": min(seconds), "meanSeconds": sum(seconds) / len(seconds), "peakBytes": timer.peakBytes[name]}
+
+        return {
+            "key": scale.key(),
+            "scale": scale.toJSON(),
+            "pakBytes": os.path.getsize(pakPath),
+            "pakEntries": numEntries,
+            "triangles": triangles,
+            "repeats": len(runs),
+            "stages": stages,
+            "counters": stats.snapshot()[3],
+            "totalSeconds": sum(stage["seconds"] for stage in stages.values())
+        }
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+# The small records parsing creates by the thousand, each built the way the parser builds it. Arguments are
+# shared constants, so only the records themselves (and any records they own) are measured
+CORE_TYPES = [
+    ("Vector3", lambda: Vector3(1.0, 2.0, 3.0)),
+    ("Edge", lambda: Edge(1, 2)),
+    ("Face", lambda: Face(1, 4, 0)),
+    ("TextureInfo", lambda: TextureInfo("tex", Vector3.swizzle(1.0, 0.0, 0.0), 0.0, Vector3.swizzle(0.0, 1.0, 0.0), 0.0, 0, 0)),
+    ("LumpHeader", lambda: LumpHeader(1024, 4096)),
+    ("PAKEntry", lambda: PAKEntry(1024, 4096, 0, False)),
+    ("IndexEntry", lambda: IndexEntry("maps/e1m1.bsp", None, None))
+]
+
+""" Measures how many bytes each of `count` instances of every core type takes up """
+def measureCoreTypes(count=100000):
+    footprints = {}
+    for name, factory in CORE_TYPES:
+        tracemalloc.start()
+        try:
+            instances = [None] * count
+            baseline, _ = tracemalloc.get_traced_memory()
+            for i in range(count):
+                instances[i] = factory()
+            size, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        footprints[name] = (size - baseline) / float(count)
+        del instances
+
+    return footprints
+
+def runBenchmarks(scales, repeats=3, outputFormat="obj", workers=1, seed=0):
+    results = []
+    for scale in scales:
+        print("Benchmarking %s"%(scale.key()))
+        results.append(benchmarkScale(scale, repeats, outputFormat, workers, seed))
+
+    return {
+        "version": BENCHMARK_FORMAT_VERSION,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "format": outputFormat,
+        "workers": workers,
+        "peakRSSBytes": peakRSS(),
+        "coreTypeBytes": measureCoreTypes(),
+        "results": results
+    }
+
+def printResults(report):
+    for result in report["results"]:
+        print("")
+        print("{} ({} triangles, {:.2f} MB PAK)".format(result["key"], result["triangles"], result["pakBytes"] / (1024.0 * 1024.0)))
+        for name in BENCHMARK_STAGES:
+            stage = result["stages"][name]
+            print("  {:<14} {:>10.2f}ms  {:>10.2f} MB peak".format(name, stage["seconds"] * 1000.0, stage["peakBytes"] / (1024.0 * 1024.0)))
+        print("  {:<14} {:>10.2f}ms".format("total", result["totalSeconds"] * 1000.0))
+
+    print("")
+    print("Bytes per instance")
+    for name, size in report["coreTypeBytes"].items():
+        print("  {:<14} {:>10.1f}".format(name, size))
+
+""" Prints each stage's time relative to an earlier report, for every scale the two have in common """
+def printComparison(baseline, report):
+    previous = dict((result["key"], result) for result in baseline["results"])
+    for result in report["results"]:
+        if result["key"] not in previous:
+            continue
+
+        print("")
+        print("%s vs baseline"%(result["key"]))
+        before = previous[result["key"]]
+        for name in BENCHMARK_STAGES + ["total"]:
+            if name == "total":
+                old, new = before["totalSeconds"], result["totalSeconds"]
+            elif name in before["stages"]:
+                old, new = before["stages"][name]["seconds"], result["stages"][name]["seconds"]
+            else:
+                continue
+            print("  {:<14} {:>10.2f}ms -> {:>10.2f}ms  {:>7.2f}x".format(name, old * 1000.0, new * 1000.0, old / max(new, 1e-9)))
+
+    # Reports from before core type sizes were measured won't have them
+    previousSizes = baseline.get("coreTypeBytes", {})
+    if len(previousSizes) > 0:
+        print("")
+        print("Bytes per instance vs baseline")
+        for name, size in report["coreTypeBytes"].items():
+            if name in previousSizes:
+                print("  {:<14} {:>10.1f} -> {:>10.1f}  {:>7.2f}x".format(name, previousSizes[name], size, previousSizes[name] / max(size, 1e-9)))
+
+def parseList(arg, type=int):
+    return [type(value) for value in arg.split(",") if len(value) > 0]
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "g:n:e:t:s:k:b:r:f:j:o:c:zL")
+
+        gameNames = dict((name, game) for game, name in GAME_NAMES.items())
+        games = list(SYNTHETIC_GAMES)
+        faceCounts = [1024, 16384]
+        edgesPerFace = 4
+        numTextures = 16
+        textureSize = 64
+        numEntries = 256
+        entrySize = 4096
+        repeats = 3
+        outputFormat = "obj"
+        workers = 1
+        outputPath = None
+        baselinePath = None
+        compress = False
+        lightmaps = False
+
+        for opt, arg in opts:
+            if opt in "-g":
+                games = []
+                for name in parseList(arg.lower(), str):
+                    if name not in gameNames:
+                        raise ValueError("Unsupported game `%s`, expected one of %s"%(name, ", ".join(GAME_NAMES.values())))
+                    games.append(gameNames[name])
+            elif opt in "-n":
+                faceCounts = parseList(arg)
+            elif opt in "-e":
+                edgesPerFace = int(arg)
+            elif opt in "-t":
+                numTextures = int(arg)
+            elif opt in "-s":
+                textureSize = int(arg)
+            elif opt in "-k":
+                numEntries = int(arg)
+            elif opt in "-b":
+                entrySize = int(arg)
+            elif opt in "-r":
+                repeats = int(arg)
+            elif opt in "-f":
+                outputFormat = arg.lower()
+            elif opt in "-j":
+                workers = int(arg)
+            elif opt in "-o":
+                outputPath = arg
+            elif opt in "-c":
+                baselinePath = arg
+            elif opt in "-z":
+                compress = True
+            elif opt in "-L":
+                lightmaps = True
+
+        if outputFormat not in ["obj", "glb"]:
+            raise ValueError("Unsupported output format `%s`, expected `obj` or `glb`"%(outputFormat))
+
+        scales = [BenchmarkScale(game, numFaces, edgesPerFace, numTextures, textureSize, numEntries, entrySize, compress, lightmaps) for game in games for numFaces in faceCounts]
+        report = runBenchmarks(scales, repeats, outputFormat, workers)
+        printResults(report)
+
+        if baselinePath is not None:
+            with open(baselinePath, "r") as baselineFile:
+                printComparison(json.load(baselineFile), report)
+
+        if outputPath is not None:
+            with open(outputPath, "w") as outputFile:
+                json.dump(report, outputFile, indent=2, sort_keys=True)
+            print("")
+            print("Results saved to `%s`"%(outputPath))
+
+    except getopt.GetoptError:
+        print("Invalid opt usage")
+
+if __name__ == "__main__":
+    main()
@@ -3,22 +3,55 @@ import os, io, struct, math
 from bsp2obj.helpers import *
 from bsp2obj.pak import *
 from bsp2obj.image import *
+from bsp2obj.mesh import *
+from bsp2obj.atlas import *
+from bsp2obj.simplify import *
+from bsp2obj.chunks import *
+from bsp2obj.lightmap import *
+from bsp2obj.obj import *
+from bsp2obj.gltf import *
+from bsp2obj.exporters import *
+from bsp2obj.stats import *
 from bsp2obj.constants import * 
 
 from PIL import Image
-
+import numpy as np
+
+# On-disk record layouts for the lumps we decode in bulk. These are identical
+# across every supported BSP version, so a lump maps directly onto an array
+VERTEX_DTYPE = np.dtype(("<f4", (3,)))
+LEDGE_DTYPE = np.dtype("<i4")
+EDGE_DTYPE = np.dtype([("vert1", "<u2"), ("vert2", "<u2")])
+FACE_DTYPE = np.dtype([
+    ("planeIndex", "<u2"),
+    ("side", "<u2"),
+    ("firstEdgeIndex", "<i4"),
+    ("numEdges", "<i2"),
+    ("texInfoID", "<i2"),
+    ("lightStyles", "u1", (4,)),
+    ("lightmapOffset", "<i4")
+])
+
+# The scalar records below use __slots__: large maps create them by the thousand, and a slotted
+# instance is a fraction of the size of one carrying a __dict__. Bulk lumps are NumPy arrays (see above)
 class Edge(object):
+    __slots__ = ("vert1", "vert2")
+
     def __init__(self, vert1, vert2):
         self.vert1 = vert1
         self.vert2 = vert2
 
 class Face(object):
+    __slots__ = ("firstEdgeIndex", "numEdges", "texInfoID")
+
     def __init__(self, firstEdgeIndex, numEdges, texInfoID):
         self.firstEdgeIndex = firstEdgeIndex
         self.numEdges = numEdges
         self.texInfoID = texInfoID
 
 class TextureInfo(object):
+    __slots__ = ("name", "uAxis", "uOffset", "vAxis", "vOffset", "texID", "animated")
+
     def __init__(self, name, uAxis, uOffset, vAxis, vOffset, texID, animated):
         self.name = name # can be None for GoldSrc BSPs
         self.uAxis = uAxis
@@ -28,13 +61,9 @@ class TextureInfo(object):
         self.texID = texID
         self.animated = animated
 
-class TextureGroup(object):
-    def __init__(self, vertexIndices, uvIndices, normalIndices):
-        self.vertexIndices = vertexIndices
-        self.uvIndices = uvIndices
-        self.normalIndices = normalIndices
-
 class LumpHeader(object):
+    __slots__ = ("offset", "length")
+
     def __init__(self, offset, length):
         self.offset = offset
         self.length = length
@@ -42,229 +71,245 @@ class LumpHeader(object):
     def __repr__(self):
         return "LumpHeader (offset: {}, length: {})".format(self.offset, self.length)
 
-class BSP(object):
-    def __init__(self, data, paks, palettePath, game):
+""" A parsed map. Only the header, the lumps needed to build the mesh and texture headers are read;
+    lighting is only read when lightmaps are asked for, and lumps such as visibility and nodes are never touched. Nothing is written anywhere:
+    buildMesh() returns the triangulated geometry as in-memory arrays, ready for an exporter """
+class BSPMap(object):
+    # `data` can be any seekable, readable source (a BufferReader over an mmap slice, a FileWindow into
+    # an archive, an open file) or a plain buffer.
+    # `palette` is either the path of the palette within the PAKs or an already loaded palette Texture.
+    # `name` identifies where the BSP came from (usually its path within the PAKs) and is used to
+    # share decoded textures between loads. Textures are decoded lazily through `textureCache`
+    def __init__(self, data, paks, palette, game, name=None, textureCache=None):
+        if not hasattr(data, "read"):
+            data = BufferReader(data)
+
         self.data = data
         self.paks = paks
         self.game = game
+        self.name = name
+        self.textureCache = textureCache
 
-        numLumps = 0
+        with stats.stage("parse"):
+            numLumps = 0
 
-        identStr, = struct.unpack("4s", data.read(4))
+            identStr, = struct.unpack("4s", data.read(4))
 
-        if game is Game.Q2 or game is Game.KINGPIN or game is Game.DAIKATANA:
-            numLumps = 19
+            if game is Game.Q2 or game is Game.KINGPIN or game is Game.DAIKATANA:
+                numLumps = 19
+            else:
+                # GoldSrc-era BSP files don't have any ident value, so we assume this is Quake
+                # In which case we need to rewind 4 bytes as we've just read the BSP version accidentally 
+                data.seek(data.tell()-4)
+                numLumps = 15
+
+            version, = struct.unpack("I", data.read(4))
+            self.version = version
+
+            logger.info("BSP version {}".format(version))
+
+            with stats.stage("palette"):
+                self.palette = BSP.loadPalette(palette, paks)
+            palettePath = self.palette.name
+
+            # Decoded textures are cached against the palette they were decoded with and the
+            # archive/entry they came from. Without a name we can't safely share textures from this BSP
+            self.paletteKey = (paks.archiveForName(palettePath), palettePath)
+            self.source = (paks.archiveForName(name), name) if name is not None else object()
+
+            # Parse this BSPs lump directory in a single read
+            lumps = []
+            for offset, length in struct.iter_unpack("II", data.read(numLumps * 8)):
+                lumps.append(LumpHeader(offset, length))
+
+            # Hexen II keeps Quake's lump layout and embedded textures
+            if game is Game.Q1 or game is Game.HL1 or game is Game.HEXEN2:
+                self.textures = self.parseTextures(lumps[2])
+                self.vertices = self.parseVertices(lumps[3])
+                self.texInfos = self.parseTextureInfo(lumps[6])
+                self.faces = self.parseFaces(lumps[7])
+                self.edges = self.parseEdges(lumps[12])
+                self.lEdges = self.parseLEdges(lumps[13])
+                self.lightingLump = lumps[8]
+            else:
+                self.vertices = self.parseVertices(lumps[2])
+                self.texInfos = self.parseTextureInfo(lumps[5])
+                self.faces = self.parseFaces(lumps[6])
+                self.edges = self.parseEdges(lumps[11])
+                self.lEdges = self.parseLEdges(lumps[12])
+                self.lightingLump = lumps[7]
+
+                # Only texture headers are read here; pixel data is decoded when first used
+                self.textures = {}
+                for texInfo in self.texInfos:
+                    if texInfo.name not in self.textures:
+                        for extension in ["wal", "tga"]:
+                            path = "textures/" + texInfo.name + "." + extension
+
+                            data = self.paks.dataForEntry(path)
+                            if data is not None:
+                                with data:
+                                    self.textures[texInfo.name] = self.externalTexture(path, extension, data)
+
+        stats.count("vertices", len(self.vertices))
+        stats.count("edges", len(self.edges))
+        stats.count("faces", len(self.faces))
+        stats.count("texinfos", len(self.texInfos))
+        stats.count("textures", len(self.textures))
+
+    # Loads the map at `name` from the PAKs or, failing that, the filesystem. The map owns what it's read
+    # from, so it should be closed (or used as a context manager) once everything has been exported
+    @classmethod
+    def fromPAKs(cls, paks, name, palette, textureCache=None):
+        data = paks.dataForEntry(name)
+        if data is None:
+            raise KeyError("Unable to find `%s` in provided PAK file(s) or filesystem" %(name))
+
+        return cls(data, paks, palette, paks.game, name, textureCache)
+
+    @staticmethod
+    def loadPalette(palette, paks):
+        if isinstance(palette, Texture):
+            return palette
+
+        texture = TextureLoader.loadFromPath(palette, paks)
+        if texture is None:
+            raise KeyError("Unable to find palette file `%s` in PAK file"%(palette))
+
+        return texture
+
+    def externalTexture(self, path, extension, data):
+        key = (self.paks.archiveForName(path), path, self.paletteKey)
+
+        if extension == "wal":
+            name, width, height = TextureLoader.headerForWAL(self.game, data)
+            loader = lambda: self.loadExternalWAL(path)
+            return LazyTexture(name, width, height, key, loader, self.textureCache, path)
         else:
-            # GoldSrc-era BSP files don't have any ident value, so we assume this is Quake
-            # In which case we need to rewind 4 bytes as we've just read the BSP version accidentally 
-            data.seek(data.tell()-4)
-            numLumps = 15
-
-        version, = struct.unpack("I", data.read(4))
-
-        print("BSP version {}".format(version))
+            width, height = TextureLoader.headerForImage(data)
+            loader = lambda: TextureLoader.loadFromPath(path, self.paks)
+            return LazyTexture(path, width, height, key, loader, self.textureCache, path)
+
+    def loadExternalWAL(self, path):
+        with self.paks.dataForEntry(path) as data:
+            return TextureLoader.loadWAL(self.game, data, self.palette)
+
+    # The BSP is read from lazily (embedded textures are only decoded when first used), so the source
+    # stays open until the map is closed. Closing it closes any file the map was read from
+    def close(self):
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    # Returns the PAK entries textures are loaded from, for textures that don't live inside the BSP itself
+    def externalTexturePaths(self):
+        textures = self.textures.values() if isinstance(self.textures, dict) else self.textures
+        return sorted(set(texture.path for texture in textures if texture.path is not None))
+
+    # Returns the texture used by the given texInfo, or None if faces using it shouldn't be exported
+    def textureForTexInfo(self, texInfoID):
+        texInfo = self.texInfos[texInfoID]
+        texture = self.textures[texInfo.name if texInfo.name is not None else texInfo.texID]
+
+        # Ignore trigger volumes as they're invisible
+        if texture.name.endswith("trigger"):
+            return None
+
+        return texture
+
+    # Passing a weldTolerance collapses UVs and normals that are within that distance of each other.
+    # Passing an atlasSize packs every texture into pages of (at most) that many pixels square.
+    # simplify merges coplanar faces (and welds their corners) before triangulating, and
+    # vertexCache reorders each group's triangles so neighbouring ones reuse vertices.
+    # lightmaps packs every face's lightmap into mesh.lightmap and adds a second set of UVs for it. Merging
+    # faces changes their lightmaps and atlasing would have to clip both sets of UVs, so it works with neither yet
+    def buildMesh(self, weldTolerance=None, atlasSize=None, simplify=False, vertexCache=False, lightmaps=False):
+        if lightmaps and (simplify or atlasSize is not None):
+            raise ValueError("Lightmaps can't be combined with simplifying or a texture atlas")
+
+        vertices, edges, lEdges, faces = self.vertices, self.edges, self.lEdges, self.faces
+
+        lightmapAtlas = None
+        if lightmaps:
+            with stats.stage("lightmaps"):
+                lightmapAtlas, report = buildLightmapAtlas(vertices, edges, lEdges, faces, self.texInfos, self.parseLighting(self.lightingLump), self.lightmapBytesPerSample())
+            logger.info("Packed {} of {} face lightmaps into a {}x{} page".format(report.lit, report.faces, report.width, report.height))
+        if simplify:
+            with stats.stage("simplify"):
+                vertices, edges, lEdges, faces, report = mergeCoplanarFaces(vertices, edges, lEdges, faces)
+            logger.info("Merged coplanar faces {} -> {}, vertices {} -> {}".format(report.facesBefore, report.facesAfter, report.verticesBefore, report.verticesAfter))
+
+        with stats.stage("triangulate"):
+            mesh = triangulate(vertices, edges, lEdges, faces, self.texInfos, self.textureForTexInfo, lightmapAtlas)
+
+        if atlasSize is not None:
+            with stats.stage("atlas"):
+                mesh, report = buildAtlas(mesh, atlasSize)
+            logger.info("Packed {} textures into {} atlas page(s) ({} left out), triangles {} -> {}".format(report.textures, report.pages, report.excluded, report.trianglesBefore, report.trianglesAfter))
+
+        if weldTolerance is not None:
+            with stats.stage("weld"):
+                mesh, report = weld(mesh, weldTolerance)
+            logger.info("Welded UVs {} -> {} ({:.1%}), normals {} -> {} ({:.1%})".format(report.uvsBefore, report.uvsAfter, 1 - report.uvsAfter / max(report.uvsBefore, 1), report.normalsBefore, report.normalsAfter, 1 - report.normalsAfter / max(report.normalsBefore, 1)))
+
+        if vertexCache:
+            before = sum(averageCacheMissRatio(group.vertexIndices) * len(group.vertexIndices) for group in mesh.groups.values())
+            with stats.stage("vertex_cache"):
+                mesh = optimizeVertexCache(mesh)
+            after = sum(averageCacheMissRatio(group.vertexIndices) * len(group.vertexIndices) for group in mesh.groups.values())
+            triangles = max(sum(len(group.vertexIndices) for group in mesh.groups.values()), 1)
+            logger.info("Vertex cache ACMR {:.3f} -> {:.3f}".format(before / triangles, after / triangles))
+
+        stats.count("triangles", mesh.numTriangles())
+        return mesh
+
+    # Reads a lump (trimmed to a whole number of records) straight into a new array of `dtype`,
+    # so it's copied exactly once whatever kind of source the BSP is being read from
+    def readLump(self, lump, dtype):
+        array = np.empty(lump.length // dtype.itemsize, dtype)
+        self.data.seek(lump.offset)
 
-        self.palette = TextureLoader.loadFromPath(palettePath, paks)
-        if self.palette is None:
-            raise KeyError("Unable to find palette file `%s` in PAK file"%(palettePath))
-
-        # Parse this BSPs lumps
-        lumps = []
-        for i in range(0, numLumps):
-            header = LumpHeader(0, 0)
-            header.offset, header.length = struct.unpack("II", data.read(8))
-            lumps.append(header)
-
-        if game is Game.Q1 or game is Game.HL1:
-            self.textures = self.parseTextures(lumps[2])
-            self.vertices = self.parseVertices(lumps[3])
-            self.texInfos = self.parseTextureInfo(lumps[6])
-            self.faces = self.parseFaces(lumps[7])
-            self.edges = self.parseEdges(lumps[12])
-            self.lEdges = self.parseLEdges(lumps[13])
-        else:
-            self.vertices = self.parseVertices(lumps[2])
-            self.texInfos = self.parseTextureInfo(lumps[5])
-            self.faces = self.parseFaces(lumps[6])
-            self.edges = self.parseEdges(lumps[11])
-            self.lEdges = self.parseLEdges(lumps[12])
-
-            self.textures = {}
-            for texInfo in self.texInfos:
-                if texInfo.name not in self.textures:
-                    for extension in ["wal", "tga"]:
-                        path = "textures/" + texInfo.name + "." + extension
-
-                        data = self.paks.dataForEntry(path)
-                        if data is not None:
-                            if extension == "wal":
-                                self.textures[texInfo.name] = TextureLoader.loadWAL(self.game, data, self.palette)
-                            else:
-                                self.textures[texInfo.name] = TextureLoader.loadFromPath(path, self.paks)
-
-    def saveOBJ(self, outputFileName):
-        faceIndices = []
-        uvs = []
-        uvIndices = []
-        normals = []
-
-        textureGroups = {}
-        for face in self.faces:
-            texInfo = self.texInfos[face.texInfoID]
-            texture = self.textures[texInfo.name if texInfo.name is not None else texInfo.texID]
-
-            # Ignore trigger volumes as they're invisible
-            if texture.name.endswith("trigger"):
-                continue
-
-            # If this is the first piece of geometry using this texture make
-            # a new texture group for it
-            if texture.name not in textureGroups:
-                textureGroups[texture.name] = TextureGroup([], [], [])
-
-            vertexIndices = []
-            e = face.firstEdgeIndex
-            uvOffset = len(uvs)
-
-            # Since we've already got a master list of vertices we need to iterate over our
-            # edge list and generate vertex indices. We'll also generate UV coordinates for
-            # each vertex as we go...
-            for i in range(0, face.numEdges):
-                if(self.lEdges[face.firstEdgeIndex + i] < 0):
-                    vertexIndices.append(self.edges[abs(self.lEdges[e])].vert1)
-                else:
-                    vertexIndices.append(self.edges[self.lEdges[e]].vert2)
-
-                # calculate UV coordinates
-                vertex = self.vertices[vertexIndices[i]]
-                u = (vertex.dot(texInfo.uAxis) + texInfo.uOffset) / texture.width
-                v = (vertex.dot(texInfo.vAxis) + texInfo.vOffset) / texture.height
-                uvs.append((u, 1-v))
-
-                e += 1
-
-            # Next we iterate over all of our vertex indices and generate triangular faces.
-            # At the same time, we generate one normal per-face. 
-            # TODO: there's a ton of normal duplication, we should index them
-            for i in range(1, len(vertexIndices)-1):
-                vA = self.vertices[vertexIndices[0]]
-                vB = self.vertices[vertexIndices[i]]
-                vC = self.vertices[vertexIndices[i+1]]
-
-                # Generate a normal for the triangular face
-                U = vB - vA
-                V = vC - vA
-                normal = U.cross(V).normalized()
-                normals.append(normal)
-
-                textureGroups[texture.name].vertexIndices.append((vertexIndices[i+1], vertexIndices[i], vertexIndices[0]))
-                textureGroups[texture.name].uvIndices.append((uvOffset+i+1, uvOffset+i, uvOffset+0))
-                textureGroups[texture.name].normalIndices.append(len(normals))
-
-        # Generate any required folders for the output path
-        outputPath = createFolderStructure(outputFileName) + outputFileName
-
-        # Generate an OBJ file for this map
-        with open(outputPath + ".obj", "w") as outputFile:
-            outputFile.write("mtllib " + outputFileName + ".mtl\n\n")
-
-            for vertex in self.vertices:
-                outputFile.write("v " + str(vertex.x) + " " + str(vertex.y) + " " + str(vertex.z) + "\n")
-
-            for normal in normals:
-                outputFile.write("v " + str(normal.x) + " " + str(normal.y) + " " + str(normal.z) + "\n")
-
-            for uv in uvs:
-                outputFile.write("vt " + str(uv[0]) + " " + str(uv[1]) + "\n")
-
-            numFaces = len(faceIndices)
-            for name, group in textureGroups.items():
-                outputFile.write("\no mesh_" + name + "\n")
-                outputFile.write("\nusemtl " + name + "\n")
-
-                for i in range(0, len(group.vertexIndices)):
-                    fA = group.vertexIndices[i][0]+1
-                    fB = group.vertexIndices[i][1]+1
-                    fC = group.vertexIndices[i][2]+1
-
-                    uvA = group.uvIndices[i][0]+1
-                    uvB = group.uvIndices[i][1]+1
-                    uvC = group.uvIndices[i][2]+1
-
-                    # All vertices in a face share a normal (flat shading)
-                    n = group.normalIndices[i]
-
-                    line = "f " + str(fA) + "/" + str(uvA) + "/" + str(n) + " " + str(fB) + "/" + str(uvB) + "/" + str(n) + " " + str(fC) + "/" + str(uvC) + "/" + str(n) + "\n"
-                    outputFile.write(line)
-
-        # Generate the MTL file to go alongside our OBJ
-        with open(outputPath + ".mtl", "w") as mtlFile:
-            for name, group in textureGroups.items():
-                mtlFile.write("\nnewmtl " + name + "\n")
-                mtlFile.write("Ka 1.000 1.000 1.000\n")
-                mtlFile.write("Kd 1.000 1.000 1.000\n")
-                mtlFile.write("Ks 0.000 0.000 0.000\n")
-                mtlFile.write("d 1.0\n")
-                mtlFile.write("illum 2\n")
-                mtlFile.write("map_Ka " + outputFileName + "/" + name + ".png\n")
-                mtlFile.write("map_Kd " + outputFileName + "/" + name + ".png\n")
-
-            mtlFile.close()
-
-        # We treat the texture list a little differently for GoldSrc versus later BSP versions.
-        if self.game is not Game.Q2 and self.game is not Game.KINGPIN and self.game is not Game.DAIKATANA:
-            for texture in self.textures:
-                texture.save(outputFileName + "/" + texture.name + ".png")
+        if hasattr(self.data, "readinto"):
+            count = self.data.readinto(array)
         else:
-            textureList = self.textures.values()
-            for texture in textureList:
-                texture.save(outputFileName + "/" + texture.name + ".png")
+            data = self.data.read(array.nbytes)
+            count = len(data)
+            array.view(np.uint8).reshape(-1)[:count] = np.frombuffer(data, np.uint8)
 
-        print("OBJ saved to `%s`"%(outputFileName))
+        if count != array.nbytes:
+            raise ValueError("Lump at offset %i runs past the end of the BSP"%(lump.offset))
 
+        return array
+
+    # Vertices are returned as an (n, 3) float32 array with the swizzle already applied
     def parseVertices(self, lump):
-        self.data.seek(lump.offset)
+        data = self.readLump(lump, VERTEX_DTYPE)
 
-        vertices = []
-        for i in range(0, lump.length//12):
-            vertex = struct.unpack("fff", self.data.read(12))
-            vertices.append(Vector3.swizzle(vertex[0], vertex[1], vertex[2]))
+        vertices = np.empty_like(data)
+        vertices[:, 0] = data[:, 0]
+        vertices[:, 1] = data[:, 2]
+        vertices[:, 2] = -data[:, 1]
 
         return vertices
 
     def parseLEdges(self, lump):
-        self.data.seek(lump.offset)
-
-        edgeList = []
-        for i in range(0, lump.length//4):
-            index, = struct.unpack("i", self.data.read(4))
-            edgeList.append(index)
-
-        return edgeList
+        return self.readLump(lump, LEDGE_DTYPE)
 
     def parseEdges(self, lump):
-        self.data.seek(lump.offset)
-
-        edges = []
-        for i in range(0, lump.length//4):
-            data = struct.unpack("HH", self.data.read(4))
-            edges.append(Edge(data[0], data[1]))
-    
-        return edges
+        return self.readLump(lump, EDGE_DTYPE)
 
     def parseFaces(self, lump):
-        self.data.seek(lump.offset)
-
-        faces = []
-        for i in range(0, lump.length//20):
-            self.data.read(4) # skip plane index
+        return self.readLump(lump, FACE_DTYPE)
 
-            data = struct.unpack("ihh", self.data.read(8))
-            faces.append(Face(data[0], data[1], data[2]))
+    def parseLighting(self, lump):
+        return self.readLump(lump, np.dtype(np.uint8))
 
-            self.data.read(8) # skip lightmap info
-        
-        return faces
+    def lightmapBytesPerSample(self):
+        return lightmapBytesPerSample(self.game)
 
     def parseTextureInfo(self, lump):
         self.data.seek(lump.offset)
@@ -273,8 +318,12 @@ class BSP(object):
         if self.game is Game.Q2 or self.game is Game.KINGPIN or self.game is Game.DAIKATANA:
             length = 76
 
+        # Read the whole lump at once and unpack records from it
+        count = lump.length//length
+        records = self.data.read(count * length)
+
         texInfos = []
-        for i in range(0, lump.length//length):
+        for i in range(0, count):
             name = None
 
             # GoldSrc BSP files didn't contain texture names as part of the texInfo lump
@@ -282,11 +331,11 @@ class BSP(object):
             # versions of the engine made it possible to store texture data outside of BSP files
             # it became necessary to pack texInfo with texture names for external look-up
             if self.game is Game.Q2 or self.game is Game.KINGPIN or self.game is Game.DAIKATANA:
-                data = struct.unpack("ffffffffII32sI", self.data.read(length))
+                data = struct.unpack_from("ffffffffII32sI", records, i * length)
                 name = c_char_p(data[10]).value
                 name = bytesToString(name)
             else:
-                data = struct.unpack("ffffffffII", self.data.read(length))
+                data = struct.unpack_from("ffffffffII", records, i * length)
 
             uAxis = Vector3.swizzle(data[0], data[1], data[2])
             uOffset = data[3]
@@ -306,15 +355,125 @@ class BSP(object):
         self.data.seek(lump.offset)
 
         numTextures, = struct.unpack("I", self.data.read(4))
-        offsets = []
-
-        for i in range (0, numTextures):
-            textureOffset, = struct.unpack("I", self.data.read(4))
-            offsets.append(textureOffset)
+        offsets = struct.unpack("%iI"%(numTextures), self.data.read(4 * numTextures))
 
         textures = []
         for i in range(0, numTextures):
-            self.data.seek(lump.offset + offsets[i])
-            textures.append(TextureLoader.loadWAL(self.game, self.data, self.palette))
-
-        return textures
\ No newline at end of file
+            offset = lump.offset + offsets[i]
+            self.data.seek(offset)
+            name, width, height = TextureLoader.headerForWAL(self.game, self.data)
+
+            key = (self.source, offset, self.paletteKey)
+            loader = lambda offset=offset: self.loadEmbeddedTexture(offset)
+            textures.append(LazyTexture(name, width, height, key, loader, self.textureCache))
+
+        return textures
+
+    def loadEmbeddedTexture(self, offset):
+        self.data.seek(offset)
+        return TextureLoader.loadWAL(self.game, self.data, self.palette)
+
+""" A BSPMap that can also write itself straight to disk """
+class BSP(BSPMap):
+    # Floats are written with `precision` decimal places. Textures are written as `textureFormat`
+    # (see TEXTURE_FORMATS) by `workers` processes, all cores by default. When given a Manifest,
+    # textures whose content has already been written are reused rather than re-encoded.
+    # Passing a chunkSize writes one OBJ per grid cell instead (see saveChunks), all sharing the MTL and textures.
+    # Lightmaps are written unchunked to `<output>_lightmap.obj`, with their own MTL and texture folder.
+    # Returns the paths of every file making up the output
+    def saveOBJ(self, outputFileName, weldTolerance=None, precision=6, textureFormat="png", workers=None, compressLevel=DEFAULT_PNG_COMPRESS_LEVEL, manifest=None, atlasSize=None, simplify=False, vertexCache=False, chunkSize=None, lightmaps=False):
+        mesh = self.buildMesh(weldTolerance, atlasSize, simplify, vertexCache, lightmaps)
+        exporter = OBJExporter(precision, textureFormat, compressLevel)
+
+        # Generate any required folders for the output path. The OBJ, MTL and texture folder
+        # sit side by side, so they refer to each other by their base name
+        createFolderStructure(outputFileName)
+        baseName = os.path.basename(outputFileName)
+
+        # Generate an OBJ file for this map (or each chunk of it), and the MTL file to go alongside it
+        with stats.stage("write_mesh"):
+            if chunkSize is None:
+                with open(outputFileName + ".obj", "w", buffering=BUFFER_SIZE) as outputFile:
+                    exporter.write(mesh, outputFile, baseName + ".mtl")
+                outputs = [outputFileName + ".obj"]
+            else:
+                outputs = self.saveChunks(outputFileName, mesh, chunkSize, "obj", lambda outputFile, chunk: exporter.write(chunk.mesh, outputFile, baseName + ".mtl"))
+
+            with open(outputFileName + ".mtl", "w", buffering=BUFFER_SIZE) as mtlFile:
+                exporter.writeMaterials(mesh, mtlFile, baseName)
+            outputs = outputs + [outputFileName + ".mtl"]
+
+            lightmapped = None
+            if mesh.lightmap is not None:
+                lightmapped = lightmapMesh(mesh)
+                with open(outputFileName + "_lightmap.obj", "w", buffering=BUFFER_SIZE) as outputFile:
+                    exporter.write(lightmapped, outputFile, baseName + "_lightmap.mtl")
+                with open(outputFileName + "_lightmap.mtl", "w", buffering=BUFFER_SIZE) as mtlFile:
+                    exporter.writeMaterials(lightmapped, mtlFile, baseName + "_lightmap")
+                outputs = outputs + [outputFileName + "_lightmap.obj", outputFileName + "_lightmap.mtl"]
+
+        # Only textures that are actually referenced by the mesh get decoded and written. Unlike
+        # OBJExporter.export, which encodes them one at a time, they're spread over worker processes here
+        textures = exporter.texturePaths(mesh, outputFileName)
+        if lightmapped is not None:
+            textures = textures + exporter.texturePaths(lightmapped, outputFileName + "_lightmap")
+        outputs = outputs + [path for path, texture in textures]
+        if manifest is not None:
+            textures = manifest.reuseTextures(textures, textureFormat, compressLevel)
+        saveTextures(textures, workers, compressLevel)
+
+        logger.info("OBJ saved to `%s`"%(outputFileName))
+        return outputs
+
+    # Writes a single binary glTF file with textures embedded, built from the same mesh as saveOBJ.
+    # Passing a chunkSize writes one GLB per grid cell instead, each embedding the textures it uses
+    def saveGLB(self, outputFileName, weldTolerance=None, atlasSize=None, simplify=False, vertexCache=False, chunkSize=None, lightmaps=False):
+        mesh = self.buildMesh(weldTolerance, atlasSize, simplify, vertexCache, lightmaps)
+        exporter = GLBExporter()
+
+        createFolderStructure(outputFileName)
+        if chunkSize is not None:
+            with stats.stage("write_mesh"):
+                outputs = self.saveChunks(outputFileName, mesh, chunkSize, "glb", lambda outputFile, chunk: exporter.write(chunk.mesh, outputFile, chunk.name()))
+            logger.info("GLB saved to `%s`"%(outputFileName))
+            return outputs
+
+        with stats.stage("write_mesh"):
+            with open(outputFileName + ".glb", "wb", buffering=BUFFER_SIZE) as outputFile:
+                exporter.write(mesh, outputFile, os.path.basename(outputFileName))
+
+        logger.info("GLB saved to `%s`"%(outputFileName))
+        return [outputFileName + ".glb"]
+
+    # Writes the mesh with any exporter (see exporters.py), such as one added with registerExporter.
+    # Returns the paths of every file written
+    def saveWith(self, outputFileName, exporter, weldTolerance=None, atlasSize=None, simplify=False, vertexCache=False, lightmaps=False):
+        mesh = self.buildMesh(weldTolerance, atlasSize, simplify, vertexCache, lightmaps)
+
+        folderPath = os.path.dirname(outputFileName)
+        with stats.stage("write_mesh"):
+            names = exporter.export(mesh, os.path.basename(outputFileName), FolderOutput(folderPath))
+
+        logger.info("%s saved to `%s`"%(exporter.extension.upper(), outputFileName))
+        return [os.path.join(folderPath, name) for name in names]
+
+    # Splits `mesh` into a grid of `chunkSize` cells and calls `writer` with each chunk's file, which is
+    # named `<output>_<chunk name>.<extension>`, then writes `<output>.json` indexing them.
+    # Returns the paths of every file written
+    def saveChunks(self, outputFileName, mesh, chunkSize, extension, writer):
+        with stats.stage("chunking"):
+            chunks = splitMesh(mesh, chunkSize)
+        stats.count("chunks", len(chunks))
+        baseName = os.path.basename(outputFileName)
+        fileNames = [baseName + "_" + chunk.name() + "." + extension for chunk in chunks]
+        folderPath = os.path.dirname(outputFileName)
+
+        for chunk, fileName in zip(chunks, fileNames):
+            with open(os.path.join(folderPath, fileName), "wb" if extension == "glb" else "w", buffering=BUFFER_SIZE) as outputFile:
+                writer(outputFile, chunk)
+
+        with open(outputFileName + ".json", "w") as indexFile:
+            writeChunkIndex(indexFile, chunks, fileNames, chunkSize, extension)
+
+        logger.info("Split into {} chunk(s) of {:g} units".format(len(chunks), chunkSize))
+        return [os.path.join(folderPath, fileName) for fileName in fileNames] + [outputFileName + ".json"]
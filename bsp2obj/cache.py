@@ -0,0 +1,73 @@
+import threading
+
+from collections import OrderedDict
+
+""" A least-recently-used cache bounded by the total size of its values rather than their count.
+    `sizeOf` is used to measure each value as it's inserted """
+class LRUCache(object):
+    def __init__(self, maxBytes, sizeOf=len):
+        self.maxBytes = maxBytes
+        self.sizeOf = sizeOf
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    # Returns the cached value for `key`, calling `loader` to produce (and cache) it on a miss
+    def get(self, key, loader):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+
+            self.misses += 1
+
+        value = loader()
+        self.put(key, value)
+        return value
+
+    # Returns the cached value for `key`, or None if it isn't cached
+    def lookup(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+    def put(self, key, value):
+        size = self.sizeOf(value)
+
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.sizes.pop(key)
+                del self.entries[key]
+
+            # Values bigger than the whole cache are handed back but never stored
+            if size > self.maxBytes:
+                return
+
+            self.entries[key] = value
+            self.sizes[key] = size
+            self.size += size
+
+            while self.size > self.maxBytes:
+                evictedKey, _ = self.entries.popitem(last=False)
+                self.size -= self.sizes.pop(evictedKey)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.sizes.clear()
+            self.size = 0
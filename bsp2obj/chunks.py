@@ -0,0 +1,109 @@
+import json
+
+import numpy as np
+
+from bsp2obj.mesh import *
+
+# Edge length (in map units) of the cubic cells a chunked export is split into
+DEFAULT_CHUNK_SIZE = 1024
+
+CHUNK_INDEX_VERSION = 1
+
+class Chunk(object):
+    def __init__(self, cell, mesh):
+        self.cell = cell # (x, y, z) grid cell
+        self.mesh = mesh
+
+        used = np.unique(np.concatenate([group.vertexIndices.ravel() for group in mesh.groups.values()]))
+        self.minimum = mesh.vertices[used].min(axis=0)
+        self.maximum = mesh.vertices[used].max(axis=0)
+
+    def name(self):
+        return "chunk_%i_%i_%i"%self.cell
+
+    def __repr__(self):
+        return "Chunk {} ({} triangles)".format(self.cell, self.mesh.numTriangles())
+
+""" Builds a Mesh holding just the `selection` of triangles in each group (group name -> triangle indices),
+    with the vertices, UVs and normals they use compacted to the front and renumbered """
+def subMesh(mesh, selections):
+    vertexIndices = [mesh.groups[name].vertexIndices[selection] for name, selection in selections.items()]
+    uvIndices = [mesh.groups[name].uvIndices[selection] for name, selection in selections.items()]
+    normalIndices = [mesh.groups[name].normalIndices[selection] for name, selection in selections.items()]
+
+    vertexIDs, vertexRemap = np.unique(np.concatenate([indices.ravel() for indices in vertexIndices]), return_inverse=True)
+    uvIDs, uvRemap = np.unique(np.concatenate([indices.ravel() for indices in uvIndices]), return_inverse=True)
+    normalIDs, normalRemap = np.unique(np.concatenate(normalIndices), return_inverse=True)
+
+    groups = {}
+    textures = {}
+    triangle = 0
+    for name, vertices, uvs, normals in zip(selections, vertexIndices, uvIndices, normalIndices):
+        count = len(vertices)
+        groups[name] = TextureGroup(vertexRemap[3 * triangle:3 * (triangle + count)].reshape(-1, 3), uvRemap[3 * triangle:3 * (triangle + count)].reshape(-1, 3), normalRemap[triangle:triangle + count])
+        if name in mesh.textures:
+            textures[name] = mesh.textures[name]
+        triangle += count
+
+    lightmapUVs = mesh.lightmapUVs[uvIDs] if mesh.lightmapUVs is not None else None
+    return Mesh(mesh.vertices[vertexIDs], mesh.uvs[uvIDs], mesh.normals[normalIDs], groups, textures, lightmapUVs, mesh.lightmap)
+
+""" Splits a Mesh into a uniform grid of `chunkSize` cubes, placing each triangle in the cell holding its
+    centroid so no triangle is ever cut. Returns a Chunk per non-empty cell, ordered by cell """
+def splitMesh(mesh, chunkSize=DEFAULT_CHUNK_SIZE):
+    if chunkSize <= 0:
+        raise ValueError("Chunk size must be positive, got %s"%(chunkSize))
+
+    names = list(mesh.groups.keys())
+    if len(names) == 0:
+        return []
+
+    triangleGroup = np.concatenate([np.full(len(mesh.groups[name].vertexIndices), i, dtype=np.intp) for i, name in enumerate(names)])
+    triangleLocal = np.concatenate([np.arange(len(mesh.groups[name].vertexIndices)) for name in names])
+    centroids = mesh.vertices[np.concatenate([mesh.groups[name].vertexIndices for name in names])].astype(np.float64).mean(axis=1)
+    cells = np.floor(centroids / chunkSize).astype(np.int64)
+
+    # Sort triangles by cell (then group, then original order) so each chunk is one contiguous run
+    order = np.lexsort((triangleLocal, triangleGroup, cells[:, 2], cells[:, 1], cells[:, 0]))
+    cells = cells[order]
+    triangleGroup = triangleGroup[order]
+    triangleLocal = triangleLocal[order]
+
+    boundaries = np.flatnonzero(np.any(cells[1:] != cells[:-1], axis=1)) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(cells)]))
+
+    chunks = []
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        selections = {}
+        groupIDs = triangleGroup[start:end]
+        groupBounds = np.flatnonzero(np.diff(groupIDs)) + 1
+        for run in np.split(np.arange(start, end), groupBounds):
+            selections[names[triangleGroup[run[0]]]] = triangleLocal[run]
+
+        chunks.append(Chunk(tuple(cells[start].tolist()), subMesh(mesh, selections)))
+
+    return chunks
+
+""" Writes the JSON index describing a chunked export: the grid size and, for every chunk, the file
+    it was written to, its cell, its bounding box (in map units), its triangle count and the textures it uses.
+    `fileNames` holds each chunk's file name relative to the index """
+def writeChunkIndex(outputFile, chunks, fileNames, chunkSize, outputFormat):
+    entries = []
+    for chunk, fileName in zip(chunks, fileNames):
+        entries.append({
+            "name": chunk.name(),
+            "file": fileName,
+            "cell": list(chunk.cell),
+            "min": chunk.minimum.tolist(),
+            "max": chunk.maximum.tolist(),
+            "triangles": chunk.mesh.numTriangles(),
+            "textures": list(chunk.mesh.groups.keys())
+        })
+
+    document = {"version": CHUNK_INDEX_VERSION, "format": outputFormat, "chunkSize": chunkSize, "chunks": entries}
+    if len(chunks) > 0:
+        document["min"] = np.min([chunk.minimum for chunk in chunks], axis=0).tolist()
+        document["max"] = np.max([chunk.maximum for chunk in chunks], axis=0).tolist()
+
+    json.dump(document, outputFile, indent=1)
@@ -2,26 +2,115 @@
 
 from bsp2obj.bsp import *
 from bsp2obj.pak import *
-import os, getopt, sys, traceback
+from bsp2obj.batch import *
+from bsp2obj.stats import *
+from bsp2obj.service import *
+import os, getopt, sys, traceback, time, json, cProfile, tracemalloc, logging
 
 def main():
+    # The library reports progress through the `bsp2obj` logger; on the command line it's shown as plain output
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "g:o:p:m:c:l:e:w:d:f:t:j:z:b:ika:sru:L", ["stats=", "profile=", "trace-memory", "serve=", "result-cache=", "texture-cache-mb=", "texture-jobs=", "map-jobs=", "threads="])
+    except getopt.GetoptError:
+        print("Invalid opt usage")
+        return
+
+    statsPath = None
+    profilePath = None
+    traceMemory = False
+    for opt, arg in opts:
+        if opt == "--stats":
+            statsPath = arg
+        elif opt == "--profile":
+            profilePath = arg
+        elif opt == "--trace-memory":
+            traceMemory = True
+
+    # --stats times every stage of the conversion and writes the timings and counters as JSON,
+    # while --profile records a cProfile dump of the whole run (see the pstats module)
+    if statsPath is not None:
+        stats.enable(traceMemory)
+        if traceMemory:
+            tracemalloc.start()
+
+    profiler = cProfile.Profile() if profilePath is not None else None
+    if profiler is not None:
+        profiler.enable()
+
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "g:o:p:m:c:l:e:")
+        convert(opts)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profilePath)
+            print("Profile saved to `%s`"%(profilePath))
+
+        if statsPath is not None:
+            print(stats)
+            with open(statsPath, "w") as statsFile:
+                json.dump(stats.toJSON(), statsFile, indent=2, sort_keys=True)
+            print("Stats saved to `%s`"%(statsPath))
 
+def convert(opts):
+    try:
         pakPaths = []
         palettePath = None
         bspPath = None
+        batchPattern = None
         outputPath = "output"
         pakDumpPattern = None
         pakExportPattern = None
+        weldTolerance = None
+        precision = 6
+        outputFormat = "obj"
+        textureFormat = "png"
+        # Three separate pools can run: processes writing textures (all cores by default), processes converting
+        # maps (batch mode and the service) and threads exporting PAK entries (eight by default). Each has its
+        # own flag; -j is a shorthand for whichever pool the current mode is driven by
+        jobs = None
+        textureJobs = None
+        mapJobs = None
+        threads = None
+        compressLevel = DEFAULT_PNG_COMPRESS_LEVEL
+        incremental = False
+        useCache = False
+        atlasSize = None
+        simplify = False
+        vertexCache = False
+        lightmaps = False
+        chunkSize = None
+        serveAddress = None
+        resultCacheBytes = DEFAULT_RESULT_CACHE_BYTES
+        textureCacheBytes = None
 
         game = None
 
         for opt, arg in opts:
-            if opt in "-p":
+            if opt == "--serve":
+                serveAddress = arg
+            elif opt == "--result-cache":
+                resultCacheBytes = int(float(arg) * 1024 * 1024)
+            elif opt == "--texture-cache-mb":
+                textureCacheBytes = int(float(arg) * 1024 * 1024)
+            elif opt == "--texture-jobs":
+                textureJobs = int(arg)
+            elif opt == "--map-jobs":
+                mapJobs = int(arg)
+            elif opt == "--threads":
+                threads = int(arg)
+            elif opt.startswith("--"):
+                continue
+            elif opt in "-p":
                 pakPaths.append(arg)
             elif opt in "-m":
                 bspPath = arg
+            elif opt in "-b":
+                batchPattern = arg
             elif opt in "-c":
                 palettePath = arg
             elif opt in "-o":
@@ -32,37 +121,115 @@ def main():
                 pakExportPattern = arg
             elif opt in "-g":
                 game = gameFromStr(arg)
+            elif opt in "-w":
+                weldTolerance = float(arg)
+            elif opt in "-d":
+                precision = int(arg)
+            elif opt in "-f":
+                outputFormat = arg.lower()
+            elif opt in "-t":
+                textureFormat = arg.lower()
+            elif opt in "-j":
+                jobs = int(arg)
+            elif opt in "-z":
+                compressLevel = int(arg)
+            elif opt in "-i":
+                incremental = True
+            elif opt in "-k":
+                useCache = True
+            elif opt in "-a":
+                atlasSize = int(arg)
+            elif opt in "-s":
+                simplify = True
+            elif opt in "-r":
+                vertexCache = True
+            elif opt in "-u":
+                chunkSize = float(arg)
+            elif opt in "-L":
+                lightmaps = True
 
         if game is None:
             raise ValueError("Failed to specify a valid game")
 
-        paks = PAKCollection(game, pakPaths)
+        if weldTolerance is not None and not weldTolerance > 0:
+            raise ValueError("Weld tolerance (-w) must be positive, got %s"%(weldTolerance))
+
+        paks = PAKCollection(game, pakPaths, useCache)
 
         if pakDumpPattern is not None:
-            paks.dumpContents(pakDumpPattern)
-            os._exit(1)
+            for name in paks.dumpContents(pakDumpPattern):
+                print(name)
+            return
 
         if pakExportPattern is not None:
-            paks.exportContents(pakExportPattern)
-            os._exit(1)
+            print(paks.exportContents(pakExportPattern, threads if threads is not None else jobs))
+            return
+
+        # Serve conversions over HTTP until interrupted, keeping the PAKs and palette loaded
+        if serveAddress is not None:
+            if palettePath is None:
+                raise ValueError("Failed to provide a palette filepath")
 
-        if bspPath is None:
+            host, separator, port = serveAddress.rpartition(":")
+            serve(game, paks, palettePath, host or "127.0.0.1", int(port), mapJobs if mapJobs is not None else jobs, resultCacheBytes, textureCacheBytes)
+            return
+
+        if bspPath is None and batchPattern is None:
             raise ValueError("Failed to provide a BSP filepath")
 
         if palettePath is None:
             raise ValueError("Failed to provide a palette filepath")
 
-        # Check all of our PAK files for the given BSP path 
-        # If we can't find it there, try the filesystem before giving up
-        data = paks.dataForEntry(bspPath)
-        if data is not None:
-            bsp = BSP(data, paks, palettePath, game)
-            bsp.saveOBJ(outputPath)
-        else:
-            raise KeyError("Unable to find `%s` in provided PAK file(s) or filesystem" %(bspPath))
+        if outputFormat not in EXPORTERS:
+            raise ValueError("Unsupported output format `%s`, expected one of %s"%(outputFormat, ", ".join(sorted(EXPORTERS))))
 
-    except getopt.GetoptError:
-        print("Invalid opt usage")
+        if textureFormat not in TEXTURE_FORMATS:
+            raise ValueError("Unsupported texture format `%s`, expected one of %s"%(textureFormat, ", ".join(TEXTURE_FORMATS)))
+
+        if lightmaps and (simplify or atlasSize is not None):
+            raise ValueError("Lightmaps (-L) can't be combined with -s or -a")
+
+        # Incremental runs keep a manifest next to the output and skip maps whose inputs haven't changed
+        manifest = None
+        if incremental:
+            manifest = Manifest.load(outputPath if batchPattern is not None else os.path.dirname(outputPath))
+
+        # In batch mode every matching map is written into the output folder, with -j (or --map-jobs)
+        # controlling how many maps are converted at once. Unless --texture-jobs says otherwise, each
+        # map's textures are written serially when maps are converted in parallel
+        if batchPattern is not None:
+            names = paks.namesMatching(batchPattern)
+            if len(names) == 0:
+                raise KeyError("No PAK entries match `%s`"%(batchPattern))
+
+            start = time.time()
+            converter = BatchConverter(game, paks, palettePath, outputPath, outputFormat, manifest, textureCacheBytes, weldTolerance=weldTolerance, precision=precision, textureFormat=textureFormat, workers=textureJobs, compressLevel=compressLevel, atlasSize=atlasSize, simplify=simplify, vertexCache=vertexCache, chunkSize=chunkSize, lightmaps=lightmaps)
+            results = converter.convertAll(names, mapJobs if mapJobs is not None else jobs)
+            printSummary(results, time.time() - start)
+            return
+
+        # A single map is driven by its texture writing
+        if textureJobs is None:
+            textureJobs = jobs
+
+        if manifest is not None:
+            converter = BatchConverter(game, paks, palettePath, outputPath, outputFormat, manifest, textureCacheBytes, weldTolerance=weldTolerance, precision=precision, textureFormat=textureFormat, workers=textureJobs, compressLevel=compressLevel, atlasSize=atlasSize, simplify=simplify, vertexCache=vertexCache, chunkSize=chunkSize, lightmaps=lightmaps)
+            result = converter.convert(bspPath, outputPath)
+            manifest.save()
+            if result.error is not None:
+                print(result.error.rstrip())
+            return
+
+        # Check all of our PAK files for the given BSP path
+        # If we can't find it there, try the filesystem before giving up
+        textureCache = newTextureCache(textureCacheBytes) if textureCacheBytes is not None else None
+        with BSP.fromPAKs(paks, bspPath, palettePath, textureCache) as bsp:
+            if outputFormat == "glb":
+                bsp.saveGLB(outputPath, weldTolerance, atlasSize, simplify, vertexCache, chunkSize, lightmaps)
+            elif outputFormat == "obj":
+                bsp.saveOBJ(outputPath, weldTolerance, precision, textureFormat, textureJobs, compressLevel, atlasSize=atlasSize, simplify=simplify, vertexCache=vertexCache, chunkSize=chunkSize, lightmaps=lightmaps)
+            else:
+                bsp.saveWith(outputPath, exporterForFormat(outputFormat), weldTolerance, atlasSize, simplify, vertexCache, lightmaps)
 
     except Exception as e:
         exception_list = traceback.format_stack()
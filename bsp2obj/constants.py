@@ -6,4 +6,8 @@ class Game(Enum):
     HL1 = 3
     DAIKATANA = 4
     HEXEN2 = 5
-    KINGPIN = 6
\ No newline at end of file
+    KINGPIN = 6
+
+# Texture formats we can write alongside an OBJ. TGA is uncompressed and by far the cheapest to encode
+TEXTURE_FORMATS = ["png", "tga"]
+DEFAULT_PNG_COMPRESS_LEVEL = 6
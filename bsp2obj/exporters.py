@@ -0,0 +1,125 @@
+import io, os
+
+from bsp2obj.constants import *
+from bsp2obj.obj import *
+from bsp2obj.gltf import *
+from bsp2obj.lightmap import *
+
+""" Exporters turn a Mesh into files. Each can write its main file to any file-like object (text or
+    binary, on disk or in memory), or write every file it produces through an output: anything with
+    an open(name) method returning a writable binary file, such as a FolderOutput or MemoryOutput """
+
+""" Writes outputs to files under `path`, creating folders as needed """
+class FolderOutput(object):
+    def __init__(self, path):
+        self.path = path
+
+    def open(self, name):
+        path = os.path.join(self.path, name)
+        folderPath = os.path.dirname(path)
+        if len(folderPath) > 0:
+            os.makedirs(folderPath, exist_ok=True)
+
+        return open(path, "wb", buffering=BUFFER_SIZE)
+
+""" Keeps outputs in memory. `files` maps each name to its contents once the file has been closed """
+class MemoryOutput(object):
+    def __init__(self):
+        self.files = {}
+
+    def open(self, name):
+        return MemoryFile(self.files, name)
+
+class MemoryFile(io.BytesIO):
+    def __init__(self, files, name):
+        io.BytesIO.__init__(self)
+        self.files = files
+        self.name = name
+
+    def close(self):
+        if not self.closed:
+            self.files[self.name] = self.getvalue()
+        io.BytesIO.close(self)
+
+# Runs `writer` with a text stream over `outputFile`. Binary files are wrapped (and detached
+# from afterwards, so they're left open), text files are used as they are
+def writeText(outputFile, writer):
+    if isinstance(outputFile, io.TextIOBase):
+        writer(outputFile)
+        return
+
+    textFile = io.TextIOWrapper(outputFile, encoding="utf-8", newline="\n")
+    try:
+        writer(textFile)
+    finally:
+        textFile.flush()
+        textFile.detach()
+
+""" Writes an OBJ, the MTL it references and a folder of textures. OBJ has room for a single set of UVs,
+    so a mesh with lightmaps also gets a second OBJ of the same triangles mapped onto the lightmap """
+class OBJExporter(object):
+    extension = "obj"
+
+    # Floats are written with `precision` decimal places. Textures are written as `textureFormat` (see TEXTURE_FORMATS)
+    def __init__(self, precision=6, textureFormat="png", compressLevel=DEFAULT_PNG_COMPRESS_LEVEL):
+        if textureFormat not in TEXTURE_FORMATS:
+            raise ValueError("Unsupported texture format `%s`, expected one of %s"%(textureFormat, ", ".join(TEXTURE_FORMATS)))
+
+        self.precision = precision
+        self.textureFormat = textureFormat
+        self.compressLevel = compressLevel
+
+    def write(self, mesh, outputFile, mtlFileName):
+        writeText(outputFile, lambda textFile: writeOBJ(textFile, mesh, mtlFileName, self.precision))
+
+    # Materials point at `<textureFolder>/<texture name>.<textureFormat>`
+    def writeMaterials(self, mesh, outputFile, textureFolder):
+        writeText(outputFile, lambda textFile: writeMTL(textFile, mesh, textureFolder, self.textureFormat))
+
+    def texturePaths(self, mesh, textureFolder):
+        return [(textureFolder + "/" + name + "." + self.textureFormat, texture) for name, texture in mesh.textures.items()]
+
+    # Writes `<baseName>.obj`, `<baseName>.mtl` and `<baseName>/<texture>` through `output`, returning their names.
+    # Lightmaps are written the same way under `<baseName>_lightmap`
+    def export(self, mesh, baseName, output):
+        with output.open(baseName + ".obj") as outputFile:
+            self.write(mesh, outputFile, os.path.basename(baseName) + ".mtl")
+
+        with output.open(baseName + ".mtl") as outputFile:
+            self.writeMaterials(mesh, outputFile, os.path.basename(baseName))
+
+        names = [baseName + ".obj", baseName + ".mtl"]
+        for name, texture in self.texturePaths(mesh, baseName):
+            with output.open(name) as outputFile:
+                outputFile.write(texture.encode(self.textureFormat.upper(), self.compressLevel))
+            names.append(name)
+
+        if mesh.lightmap is not None:
+            names += self.export(lightmapMesh(mesh), baseName + "_lightmap", output)
+
+        return names
+
+""" Writes a single binary glTF file with every texture embedded """
+class GLBExporter(object):
+    extension = "glb"
+
+    def write(self, mesh, outputFile, name):
+        writeGLB(outputFile, mesh, name)
+
+    def export(self, mesh, baseName, output):
+        with output.open(baseName + ".glb") as outputFile:
+            self.write(mesh, outputFile, os.path.basename(baseName))
+
+        return [baseName + ".glb"]
+
+# Output formats by name, as given to -f
+EXPORTERS = {"obj": OBJExporter, "glb": GLBExporter}
+
+def registerExporter(name, exporterClass):
+    EXPORTERS[name] = exporterClass
+
+def exporterForFormat(name, **options):
+    if name not in EXPORTERS:
+        raise ValueError("Unsupported output format `%s`, expected one of %s"%(name, ", ".join(sorted(EXPORTERS))))
+
+    return EXPORTERS[name](**options)
@@ -0,0 +1,53 @@
+import os, time
+
+from concurrent.futures import ThreadPoolExecutor
+
+EXPORT_CHUNK_SIZE = 1 << 20
+DEFAULT_EXPORT_WORKERS = 8
+
+class ExportReport(object):
+    def __init__(self, files, bytesWritten, seconds):
+        self.files = files
+        self.bytesWritten = bytesWritten
+        self.seconds = seconds
+
+    def megabytesPerSecond(self):
+        return (self.bytesWritten / (1024.0 * 1024.0)) / max(self.seconds, 1e-9)
+
+    def __repr__(self):
+        return "Exported {} file(s), {:.2f} MB in {:.2f}s ({:.2f} MB/s)".format(self.files, self.bytesWritten / (1024.0 * 1024.0), self.seconds, self.megabytesPerSecond())
+
+# Streams a single entry to `path` chunk by chunk, returning the number of bytes written
+def exportEntry(path, source, entry, chunkSize=EXPORT_CHUNK_SIZE):
+    # A loose file exported onto itself would be truncated before it could be read
+    if entry.path is not None and os.path.exists(path) and os.path.samefile(path, entry.path):
+        return 0
+
+    folderPath = os.path.dirname(path)
+    if len(folderPath) > 0:
+        os.makedirs(folderPath, exist_ok=True)
+
+    bytesWritten = 0
+    with open(path, "wb") as output:
+        for chunk in source.chunksForEntry(entry, chunkSize):
+            output.write(chunk)
+            bytesWritten += len(chunk)
+
+    return bytesWritten
+
+""" Writes out a list of (path, source, entry) triples, where `source` is anything with a
+    chunksForEntry() method (a PAK or PAKFolder). Exporting is I/O-bound, so files are written from a pool
+    of `workers` threads; each holds at most one chunk (plus a small decompression window) at a time, so
+    memory stays bounded however large the archives are """
+def exportEntries(entries, workers=None, chunkSize=EXPORT_CHUNK_SIZE):
+    if workers is None:
+        workers = DEFAULT_EXPORT_WORKERS
+
+    start = time.time()
+    if workers <= 1 or len(entries) <= 1:
+        sizes = [exportEntry(path, source, entry, chunkSize) for path, source, entry in entries]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            sizes = list(pool.map(lambda item: exportEntry(item[0], item[1], item[2], chunkSize), entries))
+
+    return ExportReport(len(entries), sum(sizes), time.time() - start)
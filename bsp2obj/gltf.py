@@ -0,0 +1,192 @@
+import json, struct
+
+import numpy as np
+
+GLB_MAGIC = 0x46546C67 # "glTF"
+GLB_VERSION = 2
+CHUNK_JSON = 0x4E4F534A # "JSON"
+CHUNK_BIN = 0x004E4942 # "BIN\0"
+
+# glTF reuses the OpenGL enums
+GL_ARRAY_BUFFER = 34962
+GL_ELEMENT_ARRAY_BUFFER = 34963
+GL_FLOAT = 5126
+GL_UNSIGNED_INT = 5125
+GL_TRIANGLES = 4
+GL_REPEAT = 10497
+GL_CLAMP_TO_EDGE = 33071
+GL_LINEAR = 9729
+GL_LINEAR_MIPMAP_LINEAR = 9987
+
+# Each vertex is stored interleaved as position (3 floats), normal (3 floats), uv (2 floats)
+GLTF_VERTEX_DTYPE = np.dtype([("position", "<f4", (3,)), ("normal", "<f4", (3,)), ("uv", "<f4", (2,))])
+
+# Meshes with lightmaps carry a second uv for them, written as TEXCOORD_1
+GLTF_LIGHTMAPPED_VERTEX_DTYPE = np.dtype([("position", "<f4", (3,)), ("normal", "<f4", (3,)), ("uv", "<f4", (2,)), ("lightmapUV", "<f4", (2,))])
+
+""" Accumulates binary blobs into a single 4-byte aligned GLB buffer """
+class BufferBuilder(object):
+    def __init__(self):
+        self.chunks = []
+        self.length = 0
+        self.bufferViews = []
+
+    def addView(self, data, target=None, byteStride=None):
+        padding = (4 - self.length % 4) % 4
+        if padding > 0:
+            self.chunks.append(b"\x00" * padding)
+            self.length += padding
+
+        view = {"buffer": 0, "byteOffset": self.length, "byteLength": len(data)}
+        if target is not None:
+            view["target"] = target
+        if byteStride is not None:
+            view["byteStride"] = byteStride
+
+        self.chunks.append(data)
+        self.length += len(data)
+        self.bufferViews.append(view)
+        return len(self.bufferViews) - 1
+
+    def getvalue(self):
+        return b"".join(self.chunks)
+
+""" Collapses each group's (vertex, uv, normal) corner references into unique glTF vertices.
+    Returns the interleaved vertex array and the triangle indices into it """
+def interleave(mesh, group):
+    corners = np.stack((group.vertexIndices.ravel(), group.uvIndices.ravel(), np.repeat(group.normalIndices, 3)), axis=1)
+    unique, indices = np.unique(corners, axis=0, return_inverse=True)
+
+    vertices = np.empty(len(unique), dtype=GLTF_VERTEX_DTYPE if mesh.lightmapUVs is None else GLTF_LIGHTMAPPED_VERTEX_DTYPE)
+    vertices["position"] = mesh.vertices[unique[:, 0]]
+    vertices["normal"] = mesh.normals[unique[:, 2]]
+
+    # glTF puts the UV origin in the top-left corner, OBJ in the bottom-left
+    uvs = mesh.uvs[unique[:, 1]]
+    vertices["uv"][:, 0] = uvs[:, 0]
+    vertices["uv"][:, 1] = 1 - uvs[:, 1]
+
+    if mesh.lightmapUVs is not None:
+        lightmapUVs = mesh.lightmapUVs[unique[:, 1]]
+        vertices["lightmapUV"][:, 0] = lightmapUVs[:, 0]
+        vertices["lightmapUV"][:, 1] = 1 - lightmapUVs[:, 1]
+
+    return vertices, indices.ravel().astype("<u4")
+
+""" Writes a Mesh as binary glTF 2.0, with one primitive (and material) per texture group
+    and each group's texture embedded as a PNG. A mesh's lightmap is embedded once and referenced from
+    every material's extras as {"lightmap": {"index", "texCoord": 1}}, since glTF has no slot for one """
+def writeGLB(outputFile, mesh, name="map"):
+    buffer = BufferBuilder()
+    accessors = []
+    primitives = []
+    materials = []
+    textures = []
+    images = []
+
+    groupVertices = []
+    groupIndices = []
+    for groupName, group in mesh.groups.items():
+        vertices, indices = interleave(mesh, group)
+        groupVertices.append(vertices)
+        groupIndices.append(indices)
+
+    vertexType = GLTF_VERTEX_DTYPE
+    vertexAttributes = [("POSITION", "position", "VEC3"), ("NORMAL", "normal", "VEC3"), ("TEXCOORD_0", "uv", "VEC2")]
+    if mesh.lightmapUVs is not None:
+        vertexType = GLTF_LIGHTMAPPED_VERTEX_DTYPE
+        vertexAttributes.append(("TEXCOORD_1", "lightmapUV", "VEC2"))
+
+    # All vertices live in one interleaved view and all indices in another;
+    # each primitive's accessors simply point at its slice
+    if len(groupVertices) > 0:
+        vertexView = buffer.addView(np.concatenate(groupVertices).tobytes(), GL_ARRAY_BUFFER, vertexType.itemsize)
+        indexView = buffer.addView(np.concatenate(groupIndices).tobytes(), GL_ELEMENT_ARRAY_BUFFER)
+
+    # The lightmap is clamped rather than repeated, so it uses the second sampler
+    lightmapTexture = None
+    if mesh.lightmap is not None and len(groupVertices) > 0:
+        images.append({"name": "lightmap", "mimeType": "image/png", "bufferView": buffer.addView(mesh.lightmap.encode("PNG"))})
+        textures.append({"sampler": 1, "source": len(images) - 1})
+        lightmapTexture = len(textures) - 1
+
+    vertexOffset = 0
+    indexOffset = 0
+    for (groupName, group), vertices, indices in zip(mesh.groups.items(), groupVertices, groupIndices):
+        attributes = {}
+        for attribute, field, accessorType in vertexAttributes:
+            accessor = {
+                "bufferView": vertexView,
+                "byteOffset": vertexOffset * vertexType.itemsize + vertexType.fields[field][1],
+                "componentType": GL_FLOAT,
+                "count": len(vertices),
+                "type": accessorType
+            }
+
+            # Positions are required to carry their bounds
+            if attribute == "POSITION":
+                accessor["min"] = vertices["position"].min(axis=0).tolist()
+                accessor["max"] = vertices["position"].max(axis=0).tolist()
+
+            attributes[attribute] = len(accessors)
+            accessors.append(accessor)
+
+        accessors.append({
+            "bufferView": indexView,
+            "byteOffset": indexOffset * 4,
+            "componentType": GL_UNSIGNED_INT,
+            "count": len(indices),
+            "type": "SCALAR"
+        })
+
+        material = {"name": groupName, "pbrMetallicRoughness": {"metallicFactor": 0.0, "roughnessFactor": 1.0}}
+        texture = mesh.textures.get(groupName)
+        if texture is not None:
+            images.append({"name": groupName, "mimeType": "image/png", "bufferView": buffer.addView(texture.encode("PNG"))})
+            textures.append({"sampler": 0, "source": len(images) - 1})
+            material["pbrMetallicRoughness"]["baseColorTexture"] = {"index": len(textures) - 1}
+        if lightmapTexture is not None:
+            material["extras"] = {"lightmap": {"index": lightmapTexture, "texCoord": 1}}
+
+        materials.append(material)
+        primitives.append({"attributes": attributes, "indices": len(accessors) - 1, "material": len(materials) - 1, "mode": GL_TRIANGLES})
+
+        vertexOffset += len(vertices)
+        indexOffset += len(indices)
+
+    binary = buffer.getvalue()
+    document = {
+        "asset": {"version": "2.0", "generator": "bsp2obj"},
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": [{"name": name}]
+    }
+
+    # glTF doesn't allow empty meshes or buffers, so a map with no visible geometry is just an empty node
+    if len(primitives) > 0:
+        document["nodes"][0]["mesh"] = 0
+        document["meshes"] = [{"name": name, "primitives": primitives}]
+        document["materials"] = materials
+        document["samplers"] = [{"magFilter": GL_LINEAR, "minFilter": GL_LINEAR_MIPMAP_LINEAR, "wrapS": GL_REPEAT, "wrapT": GL_REPEAT}]
+        if lightmapTexture is not None:
+            document["samplers"].append({"magFilter": GL_LINEAR, "minFilter": GL_LINEAR, "wrapS": GL_CLAMP_TO_EDGE, "wrapT": GL_CLAMP_TO_EDGE})
+        document["accessors"] = accessors
+        document["bufferViews"] = buffer.bufferViews
+        document["buffers"] = [{"byteLength": len(binary)}]
+
+    if len(textures) > 0:
+        document["textures"] = textures
+        document["images"] = images
+
+    # Both chunks must be padded to a 4-byte boundary; JSON with spaces, binary with zeroes
+    jsonChunk = json.dumps(document, separators=(",", ":")).encode("utf-8")
+    jsonChunk += b" " * ((4 - len(jsonChunk) % 4) % 4)
+    binary += b"\x00" * ((4 - len(binary) % 4) % 4)
+
+    totalLength = 12 + 8 + len(jsonChunk) + (8 + len(binary) if len(binary) > 0 else 0)
+    outputFile.write(struct.pack("<III", GLB_MAGIC, GLB_VERSION, totalLength))
+    outputFile.write(struct.pack("<II", len(jsonChunk), CHUNK_JSON))
+    outputFile.write(jsonChunk)
+    if len(binary) > 0:
+        outputFile.write(struct.pack("<II", len(binary), CHUNK_BIN))
+        outputFile.write(binary)
@@ -1,4 +1,7 @@
-import math, struct, os
+import math, struct, os, logging
+
+# Progress messages. The library never prints; the command-line tool shows these on stdout
+logger = logging.getLogger("bsp2obj")
 
 """ Converts a byte string representation to a string type (where appropriate) """
 def bytesToString(bytes, encoding="ascii"):
@@ -16,8 +19,149 @@ def createFolderStructure(path):
             
     return outputPath
 
+""" A read-only, seekable file-like view over a buffer (bytes, mmap or memoryview).
+    Slicing the underlying memoryview never copies; only the bytes handed back by read() are copied """
+class BufferReader(object):
+    def __init__(self, buffer):
+        self.buffer = memoryview(buffer)
+        self.position = 0
+
+    def read(self, size=-1):
+        start = self.position
+        end = len(self.buffer) if size is None or size < 0 else min(start + size, len(self.buffer))
+        self.position = max(start, end)
+        return self.buffer[start:end].tobytes()
+
+    # Copies straight from the underlying buffer into `target` (e.g. a numpy array)
+    def readinto(self, target):
+        target = memoryview(target).cast("B")
+        start = self.position
+        end = min(start + len(target), len(self.buffer))
+        count = max(end - start, 0)
+        target[:count] = self.buffer[start:(start + count)]
+        self.position = start + count
+        return count
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += len(self.buffer)
+
+        if offset < 0:
+            raise ValueError("Negative seek position %i"%(offset))
+
+        self.position = offset
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def getbuffer(self):
+        return self.buffer
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        self.buffer = memoryview(b"")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+""" A read-only, seekable file-like over `size` bytes of an open file starting at `offset`. Positions are
+    relative to the start of the window, and nothing is read until asked for, so a large file (or an entry
+    within one) can be parsed in place without first copying it into memory. Windows made with open() own
+    their file and close it when they're closed """
+class FileWindow(object):
+    def __init__(self, file, offset=0, size=None):
+        if size is None:
+            size = os.fstat(file.fileno()).st_size - offset
+
+        self.file = file
+        self.offset = offset
+        self.size = size
+        self.position = 0
+        self.ownsFile = False
+
+    @staticmethod
+    def open(path, offset=0, size=None):
+        file = open(path, "rb")
+        try:
+            window = FileWindow(file, offset, size)
+        except:
+            file.close()
+            raise
+
+        window.ownsFile = True
+        return window
+
+    def close(self):
+        if self.ownsFile:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def read(self, size=-1):
+        start = min(self.position, self.size)
+        end = self.size if size is None or size < 0 else min(start + size, self.size)
+        self.file.seek(self.offset + start)
+        data = self.file.read(end - start)
+        self.position = start + len(data)
+        return data
+
+    def readinto(self, target):
+        target = memoryview(target).cast("B")
+        start = min(self.position, self.size)
+        count = min(len(target), self.size - start)
+        self.file.seek(self.offset + start)
+        count = self.file.readinto(target[:count])
+        self.position = start + count
+        return count
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.size
+
+        if offset < 0:
+            raise ValueError("Negative seek position %i"%(offset))
+
+        self.position = offset
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    # Unlike BufferReader this has to read (and copy) the whole window
+    def getbuffer(self):
+        position = self.position
+        self.seek(0)
+        buffer = memoryview(self.read())
+        self.position = position
+        return buffer
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
 """ A barebones Vector3 implementation """
 class Vector3(object):
+    __slots__ = ("x", "y", "z")
+
     def __init__(self, x, y, z):
         self.x = x
         self.y = y
@@ -1,7 +1,11 @@
 import io, struct, os, sys
 
+from concurrent.futures import ProcessPoolExecutor
+
 from bsp2obj.constants import * 
 from bsp2obj.helpers import * 
+from bsp2obj.cache import *
+from bsp2obj.stats import *
 from PIL import Image
 from ctypes import *
 
@@ -11,18 +15,14 @@ class TextureLoader(object):
     def fromByteBuffer(data):
         img = Image.open(data).convert("RGB")
         width, height = img.size
-        return Texture(list(img.getdata()), width, height, "")
+        return Texture(img.tobytes(), width, height, "")
 
     @staticmethod
     def fromLMP(data):
         buffer = data.getbuffer()
 
-        pixels = []
-        for i in range(0, len(buffer), 3):
-            r, g, b = struct.unpack("BBB", buffer[i+0:i+3])
-            pixels.append((r, g, b))
-            
-        return Texture(pixels, 0, 0, "")
+        # An LMP palette is nothing but packed RGB triplets
+        return Texture(bytes(buffer[:len(buffer) - len(buffer) % 3]), 0, 0, "")
 
     @staticmethod
     def loadFromPath(path, paks):
@@ -32,14 +32,37 @@ class TextureLoader(object):
         if data is None:
             return None
 
-        if path.endswith(".lmp"):
-            texture = TextureLoader.fromLMP(data)
-            texture.name = path
-            return texture
+        with data:
+            if path.endswith(".lmp"):
+                texture = TextureLoader.fromLMP(data)
+            else:
+                texture = TextureLoader.fromByteBuffer(data)
+
+        texture.name = path
+        return texture
+
+    # Reads just the name and dimensions of the WAL/miptex at the current position, leaving the position untouched
+    @staticmethod
+    def headerForWAL(game, data):
+        baseOffset = data.tell()
+
+        if game is Game.Q2:
+            name, width, height = struct.unpack("32sII", data.read(40))
+        elif game is Game.DAIKATANA:
+            version, name, padding, width, height = struct.unpack("c32s3sII", data.read(44))
         else:
-            texture = TextureLoader.fromByteBuffer(data)
-            texture.name = path
-            return texture
+            name, width, height = struct.unpack("16sII", data.read(24))
+
+        data.seek(baseOffset)
+
+        name = c_char_p(name).value # null-terminate string
+        return bytesToString(name), width, height
+
+    # Reads the dimensions of an image in any format Pillow understands without decoding it
+    @staticmethod
+    def headerForImage(data):
+        with Image.open(data) as img:
+            return img.size
 
     @staticmethod
     def loadWAL(game, data, palette):
@@ -86,34 +109,137 @@ class TextureLoader(object):
         # Skip to the correct byte offset for mip level 1
         data.seek(baseOffset + offset1)
 
-        # Grab the raw pixel data
+        # Grab the raw pixel data. Each byte is an index into the palette, so we
+        # keep the indices as-is and let the palette be applied when encoding
         numPixels = width * height
-        pixels = []
-        for p in range(0, numPixels):
-            index, = struct.unpack("B", data.read(1))
-            if index >= len(palette.pixels):
-                raise KeyError("Color index %i larger than palette size of %i"%(index, len(palette.pixels)))
-                
-            pixels.append(palette.pixels[index])
+        pixels = data.read(numPixels)
+        colors = palette.pixels[:256*3]
+
+        numColors = len(colors) // 3
+        if numColors < 256 and len(pixels) > 0:
+            index = max(pixels)
+            if index >= numColors:
+                raise KeyError("Color index %i larger than palette size of %i"%(index, numColors))
 
-        return Texture(pixels, width, height, name)
+        return Texture(pixels, width, height, name, colors)
 
 class Texture(object):
-    def __init__(self, pixels, width, height, name=None):
+    # `pixels` holds packed RGB bytes or, when a `palette` of packed RGB bytes is
+    # provided, one palette index per pixel
+    def __init__(self, pixels, width, height, name=None, palette=None):
         self.pixels = pixels 
         self.width = width 
         self.height = height
         self.name = name
+        self.palette = palette
+
+    # Memory held by this texture's pixel (and palette) data
+    def nbytes(self):
+        return len(self.pixels) + (len(self.palette) if self.palette is not None else 0)
 
-    def save(self, path):
+    def load(self):
+        return self
+
+    # The image format is picked from the path's extension. `compressLevel` (0-9) only applies to PNGs
+    def save(self, path, compressLevel=DEFAULT_PNG_COMPRESS_LEVEL):
         # Because texture names (and by extension the paths we write to)
         # can contain directories, i.e: 'e1u1/flat1_1' in the case of Quake 2,
-        # we need to make sure the directories in the path are recursively created before writing
+        # we need to make sure the directories in the path are recursively created before writing.
+        # Several processes may be doing this at once, so an existing folder isn't an error
         folderPath = os.path.dirname(path)
         if len(folderPath) > 0:
-            if not os.path.exists(folderPath):
-                os.makedirs(folderPath)
+            os.makedirs(folderPath, exist_ok=True)
+
+        if path.lower().endswith(".png"):
+            self.image().save(path, compress_level=compressLevel)
+        else:
+            self.image().save(path)
+
+    def image(self):
+        if self.palette is None:
+            return Image.frombytes("RGB", (self.width, self.height), self.pixels)
+
+        img = Image.frombytes("P", (self.width, self.height), self.pixels)
+        img.putpalette(self.palette.ljust(256*3, b"\x00"))
+        return img
+
+    # Returns this texture encoded as PNG (or any format Pillow can write) bytes
+    def encode(self, format="PNG", compressLevel=DEFAULT_PNG_COMPRESS_LEVEL):
+        output = io.BytesIO()
+        if format.upper() == "PNG":
+            self.image().save(output, format=format, compress_level=compressLevel)
+        else:
+            self.image().save(output, format=format)
+        return output.getvalue()
+
+def saveTexture(path, texture, compressLevel):
+    texture.save(path, compressLevel)
+
+""" Writes a list of (path, texture) pairs. Encoding is CPU-bound and every texture is independent,
+    so they're spread across `workers` processes (all cores by default, serially if 1) """
+def saveTextures(textures, workers=None, compressLevel=DEFAULT_PNG_COMPRESS_LEVEL):
+    stats.count("textures_written", len(textures))
+
+    with stats.stage("write_textures"):
+        # Decode in this process; only plain Texture objects (bytes) are sent to the workers
+        paths = [path for path, texture in textures]
+        textures = [texture.load() for path, texture in textures]
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = min(workers, len(textures))
+
+        if workers <= 1:
+            for path, texture in zip(paths, textures):
+                saveTexture(path, texture, compressLevel)
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunksize = max(1, len(textures) // (workers * 4))
+            for result in pool.map(saveTexture, paths, textures, [compressLevel] * len(textures), chunksize=chunksize):
+                pass
+
+# Decoded textures shared by every BSP, keyed by (archive, entry path, palette)
+DEFAULT_TEXTURE_CACHE_BYTES = 256 * 1024 * 1024
+
+# A cache of decoded textures holding up to `maxBytes` of pixels, for BSPs that shouldn't share the default one
+def newTextureCache(maxBytes=DEFAULT_TEXTURE_CACHE_BYTES):
+    return LRUCache(maxBytes, lambda texture: texture.nbytes())
+
+textureCache = newTextureCache()
+
+""" A texture whose name and dimensions are known up front but whose pixels are only decoded,
+    through a shared LRUCache, the first time something needs them """
+class LazyTexture(object):
+    # `path` is the PAK entry the texture is decoded from, or None for textures embedded in a BSP
+    def __init__(self, name, width, height, key, loader, cache=None, path=None):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.key = key
+        self.loader = loader
+        self.cache = cache if cache is not None else textureCache
+        self.path = path
+
+    def load(self):
+        if stats.enabled:
+            stats.count("texture_cache_hits" if self.key in self.cache else "texture_cache_misses")
+
+        return self.cache.get(self.key, self.decode)
+
+    def decode(self):
+        with stats.stage("texture_decode"):
+            texture = self.loader()
+
+        stats.count("textures_decoded")
+        stats.count("texture_bytes_decoded", texture.nbytes())
+        return texture
+
+    def save(self, path, compressLevel=DEFAULT_PNG_COMPRESS_LEVEL):
+        self.load().save(path, compressLevel)
+
+    def image(self):
+        return self.load().image()
 
-        img = Image.new("RGB", (self.width, self.height))
-        img.putdata(self.pixels)
-        img.save(path)
+    def encode(self, format="PNG", compressLevel=DEFAULT_PNG_COMPRESS_LEVEL):
+        return self.load().encode(format, compressLevel)
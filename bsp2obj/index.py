@@ -0,0 +1,118 @@
+import re, fnmatch
+
+GLOB_CHARACTERS = re.compile(r"[*?\[]")
+
+class IndexNode(object):
+    __slots__ = ("children", "files")
+
+    def __init__(self):
+        self.children = {} # lower-cased folder name -> IndexNode
+        self.files = {} # lower-cased full name -> IndexEntry
+
+class IndexEntry(object):
+    __slots__ = ("name", "source", "entry")
+
+    def __init__(self, name, source, entry):
+        self.name = name # name as stored in the archive
+        self.source = source # the PAK (or PAKFolder) the entry lives in
+        self.entry = entry
+
+""" A single directory merged from every archive in a collection. Sources added later override
+    entries of the same name from earlier ones (pak0 -> pak1 -> ...), lookups are case-insensitive
+    and names are also kept in a prefix tree so folder and glob queries only visit matching folders """
+class DirectoryIndex(object):
+    def __init__(self):
+        self.entries = {} # lower-cased name -> IndexEntry
+        self.root = IndexNode()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return name.lower() in self.entries
+
+    def add(self, name, source, entry):
+        key = name.lower()
+        indexEntry = IndexEntry(name, source, entry)
+
+        # Overriding an entry keeps its place in the tree and swaps in the newer source
+        self.entries[key] = indexEntry
+        self.nodeForFolder(key.split("/")[:-1], True).files[key] = indexEntry
+
+    def addDirectory(self, source):
+        for name, entry in source.directory.items():
+            self.add(name, source, entry)
+
+    def lookup(self, name):
+        return self.entries.get(name.lower())
+
+    def nodeForFolder(self, components, create=False):
+        node = self.root
+        for component in components:
+            child = node.children.get(component)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[component] = IndexNode()
+            node = child
+        return node
+
+    # Yields every IndexEntry at or below `node`
+    def walk(self, node):
+        nodes = [node]
+        while len(nodes) > 0:
+            node = nodes.pop()
+            for indexEntry in node.files.values():
+                yield indexEntry
+            nodes.extend(node.children.values())
+
+    # Names of the entries directly inside `folder` (e.g. `textures/e1u1`)
+    def listFolder(self, folder):
+        node = self.nodeForFolder([component for component in folder.lower().split("/") if len(component) > 0])
+        if node is None:
+            return []
+        return sorted(indexEntry.name for indexEntry in node.files.values())
+
+    # Every entry name matching a glob such as `textures/e1u1/*`. Like a shell, the pattern is matched a folder
+    # at a time, so `*` and `?` never match a `/`, while a `**` component matches any number of folders.
+    # Only the folders the pattern can reach are visited
+    def glob(self, pattern):
+        components = []
+        for component in pattern.lower().split("/"):
+            if component == "**" or not GLOB_CHARACTERS.search(component):
+                components.append(component)
+            else:
+                components.append(re.compile(fnmatch.translate(component)))
+
+        return sorted(set(indexEntry.name for indexEntry in self.matchComponents(self.root, components)))
+
+    # Yields the IndexEntries below `node` whose remaining path matches `components`, each either a literal
+    # name, `**` or a compiled regular expression
+    def matchComponents(self, node, components):
+        component, rest = components[0], components[1:]
+        if component == "**":
+            if len(rest) == 0:
+                yield from self.walk(node)
+                return
+
+            yield from self.matchComponents(node, rest)
+            for child in node.children.values():
+                yield from self.matchComponents(child, components)
+        elif len(rest) == 0:
+            for key, indexEntry in node.files.items():
+                name = key.rsplit("/", 1)[-1]
+                if name == component if isinstance(component, str) else component.match(name):
+                    yield indexEntry
+        elif isinstance(component, str):
+            child = node.children.get(component)
+            if child is not None:
+                yield from self.matchComponents(child, rest)
+        else:
+            for name, child in node.children.items():
+                if component.match(name):
+                    yield from self.matchComponents(child, rest)
+
+    # Every entry name in which `pattern` (a regular expression) can be found
+    def search(self, pattern):
+        regex = re.compile(pattern)
+        return sorted(indexEntry.name for indexEntry in self.entries.values() if regex.search(indexEntry.name))
@@ -0,0 +1,175 @@
+import math
+
+import numpy as np
+
+from bsp2obj.mesh import *
+from bsp2obj.image import *
+from bsp2obj.simplify import *
+from bsp2obj.constants import *
+
+# Map units covered by each lightmap sample (luxel) along both texture axes
+LIGHTMAP_SCALE = 16
+
+# Luxels of each lightmap's own edge repeated around it in the atlas, so filtering doesn't pick up its neighbours
+LIGHTMAP_PADDING = 1
+
+# Faces carry four light styles; only the lightmap for the first is read. 255 marks a style as unused
+NO_LIGHT_STYLE = 255
+
+# Faces without a lightmap of their own (sky, liquids) are drawn fully lit, so they're all mapped onto a
+# single luxel of this brightness
+FULLBRIGHT = 255
+
+class LightmapReport(object):
+    def __init__(self, faces, lit, width, height):
+        self.faces = faces
+        self.lit = lit
+        self.width = width
+        self.height = height
+
+    def __repr__(self):
+        return "LightmapReport (faces: {}, lit: {}, size: {}x{})".format(self.faces, self.lit, self.width, self.height)
+
+""" Every face's lightmap packed into a single page, and where each one ended up """
+class LightmapAtlas(object):
+    def __init__(self, texture, mins, positions, lit):
+        self.texture = texture
+        self.mins = mins # (n, 2) each face's lightmap origin, in luxels along its texture axes
+        self.positions = positions # (n, 2) pixel position of each face's lightmap (inside its padding) on the page
+        self.lit = lit # (n,) whether each face has a lightmap; the rest point at a fullbright luxel
+
+    # Lightmap UVs for corners of the given faces at texture coordinates `s`, `t` (in map units, before
+    # dividing by the texture size). Like mesh UVs, v points up while the page is laid out from the top
+    def uvs(self, faceIndices, s, t):
+        x = self.positions[faceIndices, 0] + 0.5
+        y = self.positions[faceIndices, 1] + 0.5
+        lit = self.lit[faceIndices]
+        x[lit] += s[lit] / LIGHTMAP_SCALE - self.mins[faceIndices[lit], 0]
+        y[lit] += t[lit] / LIGHTMAP_SCALE - self.mins[faceIndices[lit], 1]
+
+        uvs = np.empty((len(faceIndices), 2))
+        uvs[:, 0] = x / self.texture.width
+        uvs[:, 1] = 1 - y / self.texture.height
+        return uvs
+
+# Quake and Hexen II store a single brightness per luxel; GoldSrc and the Quake II engines store RGB
+def lightmapBytesPerSample(game):
+    return 1 if game is Game.Q1 or game is Game.HEXEN2 else 3
+
+# Returns (n, 4) arrays holding each texInfo's U and V axis, with its offset as the fourth component
+def texInfoAxes(texInfos):
+    uAxis = np.array([(texInfo.uAxis.x, texInfo.uAxis.y, texInfo.uAxis.z, texInfo.uOffset) for texInfo in texInfos], dtype=np.float64).reshape(-1, 4)
+    vAxis = np.array([(texInfo.vAxis.x, texInfo.vAxis.y, texInfo.vAxis.z, texInfo.vOffset) for texInfo in texInfos], dtype=np.float64).reshape(-1, 4)
+    return uAxis, vAxis
+
+""" Works out every face's lightmap the way the engines do: the face is projected onto its texture axes
+    (see texInfoAxes), and the bounds snapped outwards to whole luxels. Returns each face's origin and size in luxels """
+def lightmapExtents(vertices, edges, lEdges, faces, uAxis, vAxis):
+    corners, counts = faceCorners(edges, lEdges, faces)
+
+    cornerTexInfo = np.repeat(faces["texInfoID"].astype(np.intp), counts)
+    points = vertices[corners].astype(np.float64)
+    s = np.einsum("ij,ij->i", points, uAxis[cornerTexInfo, :3]) + uAxis[cornerTexInfo, 3]
+    t = np.einsum("ij,ij->i", points, vAxis[cornerTexInfo, :3]) + vAxis[cornerTexInfo, 3]
+
+    # Each face's corners are contiguous, so the bounds reduce over runs
+    mins = np.zeros((len(faces), 2), dtype=np.int64)
+    sizes = np.zeros((len(faces), 2), dtype=np.int64)
+    hasCorners = counts > 0
+    starts = (np.cumsum(counts) - counts)[hasCorners]
+    for axis, values in enumerate([s, t]):
+        if len(starts) == 0:
+            break
+        low = np.floor(np.minimum.reduceat(values, starts) / LIGHTMAP_SCALE).astype(np.int64)
+        high = np.ceil(np.maximum.reduceat(values, starts) / LIGHTMAP_SCALE).astype(np.int64)
+        mins[hasCorners, axis] = low
+        sizes[hasCorners, axis] = high - low + 1
+
+    return mins, sizes
+
+""" Packs rectangles onto one page with a shelf packer: tallest first, left to right along shelves stacked
+    top to bottom. The page is as wide as the smallest power of two whose square could hold every rectangle,
+    and as tall as the shelves need. Each shelf is found with a single search over the running widths, so
+    this stays fast for tens of thousands of rectangles. Returns each rectangle's position and the page size """
+def packLightmaps(widths, heights):
+    if len(widths) == 0:
+        return np.zeros((0, 2), dtype=np.int64), 0, 0
+
+    order = np.lexsort((-widths, -heights))
+    sortedWidths = widths[order]
+    sortedHeights = heights[order]
+
+    area = int((sortedWidths * sortedHeights).sum())
+    pageWidth = max(int(sortedWidths.max()), 1 << int(math.ceil(math.log(max(math.sqrt(area), 1), 2))))
+
+    running = np.concatenate(([0], np.cumsum(sortedWidths)))
+    shelfStarts = []
+    start = 0
+    while start < len(order):
+        shelfStarts.append(start)
+        start = max(start + 1, int(np.searchsorted(running, running[start] + pageWidth, side="right")) - 1)
+
+    shelfStarts = np.array(shelfStarts)
+    shelf = np.repeat(np.arange(len(shelfStarts)), np.diff(np.append(shelfStarts, len(order))))
+    shelfHeights = sortedHeights[shelfStarts]
+    shelfY = np.cumsum(shelfHeights) - shelfHeights
+
+    positions = np.empty((len(order), 2), dtype=np.int64)
+    positions[order, 0] = running[:-1] - running[shelfStarts][shelf]
+    positions[order, 1] = shelfY[shelf]
+    return positions, pageWidth, int(shelfY[-1] + shelfHeights[-1])
+
+""" Decodes the lighting lump (`bytesPerSample` 1 for Quake's grayscale, 3 for RGB) and packs the style 0
+    lightmap of every face into a LightmapAtlas, each surrounded by a copy of its own edge """
+def buildLightmapAtlas(vertices, edges, lEdges, faces, texInfos, lighting, bytesPerSample, padding=LIGHTMAP_PADDING):
+    uAxis, vAxis = texInfoAxes(texInfos)
+    mins, sizes = lightmapExtents(vertices, edges, lEdges, faces, uAxis, vAxis)
+    offsets = faces["lightmapOffset"].astype(np.int64)
+    numSamples = sizes[:, 0] * sizes[:, 1]
+    lit = (faces["lightStyles"][:, 0] != NO_LIGHT_STYLE) & (offsets >= 0) & (numSamples > 0) & (offsets + numSamples * bytesPerSample <= len(lighting))
+
+    # Every lit face gets a block, plus one shared fullbright luxel at the end for everything else
+    litFaces = np.flatnonzero(lit)
+    blockSizes = np.concatenate((sizes[litFaces], [[1, 1]]))
+    blockOffsets = np.concatenate((offsets[litFaces], [len(lighting)]))
+    samples = np.concatenate((lighting, np.full(bytesPerSample, FULLBRIGHT, dtype=np.uint8)))
+
+    paddedWidths = blockSizes[:, 0] + 2 * padding
+    paddedHeights = blockSizes[:, 1] + 2 * padding
+    blockPositions, width, height = packLightmaps(paddedWidths, paddedHeights)
+
+    # Paint every padded pixel at once. Padding pixels read the nearest luxel on the lightmap's edge
+    area = paddedWidths * paddedHeights
+    block = np.repeat(np.arange(len(blockSizes)), area)
+    local = np.arange(len(block)) - (np.cumsum(area) - area)[block]
+    px = local % paddedWidths[block]
+    py = local // paddedWidths[block]
+    sx = np.clip(px - padding, 0, blockSizes[block, 0] - 1)
+    sy = np.clip(py - padding, 0, blockSizes[block, 1] - 1)
+    sample = blockOffsets[block] + (sy * blockSizes[block, 0] + sx) * bytesPerSample
+
+    page = np.zeros((height, width, 3), dtype=np.uint8)
+    if bytesPerSample == 1:
+        colors = samples[sample][:, None]
+    else:
+        colors = samples[sample[:, None] + np.arange(3)]
+    page[blockPositions[block, 1] + py, blockPositions[block, 0] + px] = colors
+
+    positions = np.empty((len(faces), 2), dtype=np.int64)
+    positions[:] = blockPositions[-1] + padding
+    positions[litFaces] = blockPositions[:-1] + padding
+
+    texture = Texture(page.tobytes(), width, height, "lightmap")
+    return LightmapAtlas(texture, mins, positions, lit), LightmapReport(len(faces), len(litFaces), width, height)
+
+""" A Mesh of the same triangles mapped with their lightmap UVs instead, all in one group textured with the
+    lightmap page. Formats without a second UV channel (OBJ) write this alongside the main mesh """
+def lightmapMesh(mesh):
+    groups = list(mesh.groups.values())
+    if len(groups) > 0:
+        group = TextureGroup(np.concatenate([group.vertexIndices for group in groups]), np.concatenate([group.uvIndices for group in groups]), np.concatenate([group.normalIndices for group in groups]))
+        groups = {"lightmap": group}
+    else:
+        groups = {}
+
+    return Mesh(mesh.vertices, mesh.lightmapUVs, mesh.normals, groups, {"lightmap": mesh.lightmap})
@@ -0,0 +1,142 @@
+import hashlib, json, os, shutil
+
+MANIFEST_FILENAME = "bsp2obj-manifest.json"
+MANIFEST_VERSION = 2
+
+""" Hashes any number of byte buffers (bytes, memoryview, mmap slices) together """
+def digest(*buffers):
+    h = hashlib.blake2b(digest_size=16)
+    for buffer in buffers:
+        h.update(buffer)
+    return h.hexdigest()
+
+# Maps and textures are keyed by absolute, normalized paths, so `out/e1m1`, `./out/e1m1` and the same
+# folder reached from another working directory all find the same record
+def manifestKey(path):
+    return os.path.normpath(os.path.abspath(path))
+
+""" Records content hashes for everything that went into (and came out of) each converted map,
+    so unchanged maps can be skipped and identical textures encoded only once """
+class Manifest(object):
+    def __init__(self, path, maps=None, textures=None):
+        self.path = path
+        self.maps = maps if maps is not None else {} # manifestKey of the output file name -> map record
+        self.textures = textures if textures is not None else {} # manifestKey of the written texture path -> content hash
+        self.pathsByHash = {}
+        self.changedMaps = {}
+        self.changedTextures = {}
+        for texturePath, textureHash in self.textures.items():
+            self.pathsByHash[textureHash] = texturePath
+
+    # Loads the manifest kept in `folder`, or returns an empty one if there isn't one (or it's unreadable)
+    @staticmethod
+    def load(folder):
+        path = os.path.join(folder, MANIFEST_FILENAME)
+        try:
+            with open(path, "r") as f:
+                contents = json.load(f)
+            if contents.get("version") == MANIFEST_VERSION:
+                return Manifest(path, contents["maps"], contents["textures"])
+        except (OSError, ValueError, KeyError):
+            pass
+
+        return Manifest(path)
+
+    def save(self):
+        folderPath = os.path.dirname(self.path)
+        if len(folderPath) > 0:
+            os.makedirs(folderPath, exist_ok=True)
+
+        # Write to a temporary file first so an interrupted run never leaves a truncated manifest
+        temporaryPath = self.path + ".tmp"
+        with open(temporaryPath, "w") as f:
+            json.dump({"version": MANIFEST_VERSION, "maps": self.maps, "textures": self.textures}, f, indent=1, sort_keys=True)
+        os.replace(temporaryPath, self.path)
+
+    # A map is up to date if its source, palette and options are unchanged, every file it produced
+    # still exists and every external texture it used still hashes the same in `paks`
+    def isUpToDate(self, outputFileName, sourceHash, paletteHash, optionsHash, paks):
+        record = self.maps.get(manifestKey(outputFileName))
+        if record is None:
+            return False
+
+        if record["source"] != sourceHash or record["palette"] != paletteHash or record["options"] != optionsHash:
+            return False
+
+        for path in record["outputs"]:
+            if not os.path.exists(path):
+                return False
+
+        for path, textureHash in record["textures"].items():
+            data = paks.dataForEntry(path)
+            if data is None:
+                return False
+            with data:
+                if digest(data.getbuffer()) != textureHash:
+                    return False
+
+        return True
+
+    def recordMap(self, outputFileName, sourceHash, paletteHash, optionsHash, textureSources, outputs):
+        key = manifestKey(outputFileName)
+        self.maps[key] = self.changedMaps[key] = {
+            "source": sourceHash,
+            "palette": paletteHash,
+            "options": optionsHash,
+            "textures": textureSources,
+            "outputs": outputs
+        }
+
+    def recordTexture(self, path, textureHash):
+        path = manifestKey(path)
+        self.textures[path] = self.changedTextures[path] = textureHash
+        self.pathsByHash[textureHash] = path
+
+    # Returns (and forgets) the map and texture records made since the last call
+    def takeChanges(self):
+        changes = (self.changedMaps, self.changedTextures)
+        self.changedMaps = {}
+        self.changedTextures = {}
+        return changes
+
+    # Forgets the records made since the last takeChanges(), e.g. because the conversion making them failed
+    def discardChanges(self):
+        changedMaps, changedTextures = self.takeChanges()
+        for outputFileName in changedMaps:
+            self.maps.pop(outputFileName, None)
+        for path, textureHash in changedTextures.items():
+            self.textures.pop(path, None)
+            if self.pathsByHash.get(textureHash) == path:
+                del self.pathsByHash[textureHash]
+
+    # Takes a list of (path, texture) pairs about to be written and returns only those that actually
+    # need encoding. Textures already on disk with the same content are skipped, and textures whose
+    # content was written elsewhere (typically by another map) are copied rather than re-encoded
+    def reuseTextures(self, textures, textureFormat, compressLevel):
+        pending = []
+        for path, texture in textures:
+            loaded = texture.load()
+            textureHash = digest(loaded.pixels, loaded.palette or b"", ("%ix%i %s %i"%(loaded.width, loaded.height, textureFormat, compressLevel)).encode("ascii"))
+
+            key = manifestKey(path)
+            if self.textures.get(key) == textureHash and os.path.exists(path):
+                continue
+
+            existingPath = self.pathsByHash.get(textureHash)
+            if existingPath is not None and existingPath != key and os.path.exists(existingPath):
+                folderPath = os.path.dirname(path)
+                if len(folderPath) > 0:
+                    os.makedirs(folderPath, exist_ok=True)
+                shutil.copyfile(existingPath, path)
+            else:
+                pending.append((path, texture))
+
+            self.recordTexture(path, textureHash)
+
+        return pending
+
+    # Folds in the records produced by another Manifest (e.g. one owned by a worker process)
+    def merge(self, maps, textures):
+        self.maps.update(maps)
+        for path, textureHash in textures.items():
+            self.recordTexture(path, textureHash)
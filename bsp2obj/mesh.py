@@ -0,0 +1,200 @@
+import numpy as np
+
+# Triangles with less area than this (in map units squared) are dropped
+DEGENERATE_AREA = 1e-6
+
+class TextureGroup(object):
+    def __init__(self, vertexIndices, uvIndices, normalIndices):
+        self.vertexIndices = vertexIndices
+        self.uvIndices = uvIndices
+        self.normalIndices = normalIndices
+
+""" Triangulated geometry ready to be handed to a writer. Every index buffer is 0-based """
+class Mesh(object):
+    def __init__(self, vertices, uvs, normals, groups, textures=None, lightmapUVs=None, lightmap=None):
+        self.vertices = vertices # (n, 3) positions
+        self.uvs = uvs # (n, 2) texture coordinates, one per face corner
+        self.normals = normals # (n, 3) flat normals, one per triangle
+        self.groups = groups # texture name -> TextureGroup
+        self.textures = textures if textures is not None else {} # texture name -> Texture
+        self.lightmapUVs = lightmapUVs # (n, 2) lightmap coordinates alongside uvs (indexed by uvIndices too), or None
+        self.lightmap = lightmap # Texture every lightmap UV points into, or None
+
+    def numTriangles(self):
+        return sum(len(group.vertexIndices) for group in self.groups.values())
+
+""" Fan-triangulates every face in one pass. `faceTextures` maps a texInfo ID to the texture it uses,
+    or None if faces using that texInfo should be skipped. UVs and flat normals are generated alongside,
+    and lightmap UVs too when given a LightmapAtlas for the faces. Triangles with (next to) no area, or that
+    use the same vertex twice, are left out: they draw nothing and have no normal """
+def triangulate(vertices, edges, lEdges, faces, texInfos, faceTextures, lightmaps=None):
+    texInfoIDs = faces["texInfoID"].astype(np.intp)
+
+    # Resolve each texInfo referenced by a face to a texture group (in order of first use)
+    # and to the axes we need to generate UVs
+    groupNames = []
+    groupIDs = {}
+    groupTextures = {}
+    texGroup = np.full(len(texInfos), -1, dtype=np.intp)
+    uAxis = np.zeros((len(texInfos), 4))
+    vAxis = np.zeros((len(texInfos), 4))
+    size = np.ones((len(texInfos), 2))
+    usedTexInfos, firstUse = np.unique(texInfoIDs, return_index=True)
+    for texInfoID in usedTexInfos[np.argsort(firstUse)].tolist():
+        texture = faceTextures(texInfoID)
+        if texture is None:
+            continue
+
+        if texture.name not in groupIDs:
+            groupIDs[texture.name] = len(groupNames)
+            groupNames.append(texture.name)
+            groupTextures[texture.name] = texture
+
+        texInfo = texInfos[texInfoID]
+        texGroup[texInfoID] = groupIDs[texture.name]
+        uAxis[texInfoID] = (texInfo.uAxis.x, texInfo.uAxis.y, texInfo.uAxis.z, texInfo.uOffset)
+        vAxis[texInfoID] = (texInfo.vAxis.x, texInfo.vAxis.y, texInfo.vAxis.z, texInfo.vOffset)
+        size[texInfoID] = (texture.width, texture.height)
+
+    faceGroup = texGroup[texInfoIDs]
+    keep = faceGroup >= 0
+    faceGroup = faceGroup[keep]
+    faceTexInfo = texInfoIDs[keep]
+    firstEdge = faces["firstEdgeIndex"][keep].astype(np.intp)
+    numEdges = np.maximum(faces["numEdges"][keep].astype(np.intp), 0)
+
+    # Expand faces into corners. Each corner walks the ledge list and picks the
+    # appropriate end of the referenced edge, depending on the ledge's sign
+    cornerStart = np.cumsum(numEdges) - numEdges
+    cornerFace = np.repeat(np.arange(len(numEdges)), numEdges)
+    cornerLocal = np.arange(len(cornerFace)) - cornerStart[cornerFace]
+    lEdge = lEdges[firstEdge[cornerFace] + cornerLocal]
+    edgeIndex = np.abs(lEdge)
+    cornerVertex = np.where(lEdge < 0, edges["vert1"][edgeIndex], edges["vert2"][edgeIndex]).astype(np.intp)
+
+    # calculate UV coordinates for every corner at once
+    points = vertices[cornerVertex].astype(np.float64)
+    cornerTexInfo = faceTexInfo[cornerFace]
+    u = uAxis[cornerTexInfo]
+    v = vAxis[cornerTexInfo]
+    uvs = np.empty((len(cornerVertex), 2))
+    s = points[:, 0] * u[:, 0] + points[:, 1] * u[:, 1] + points[:, 2] * u[:, 2] + u[:, 3]
+    t = points[:, 0] * v[:, 0] + points[:, 1] * v[:, 1] + points[:, 2] * v[:, 2] + v[:, 3]
+    uvs[:, 0] = s / size[cornerTexInfo, 0]
+    uvs[:, 1] = 1 - t / size[cornerTexInfo, 1]
+
+    lightmapUVs = None
+    if lightmaps is not None:
+        lightmapUVs = lightmaps.uvs(np.flatnonzero(keep)[cornerFace], s, t)
+
+    # A face with n corners becomes n-2 triangles fanning out from its first corner
+    numTriangles = np.maximum(numEdges - 2, 0)
+    triangleFace = np.repeat(np.arange(len(numEdges)), numTriangles)
+    fan = np.arange(len(triangleFace)) - (np.cumsum(numTriangles) - numTriangles)[triangleFace] + 1
+    cornerA = cornerStart[triangleFace]
+    cornerB = cornerA + fan
+    cornerC = cornerB + 1
+
+    # Generate a flat normal for each triangle. Its length before normalising is twice the triangle's area
+    pA = points[cornerA]
+    U = points[cornerB] - pA
+    V = points[cornerC] - pA
+    normals = np.empty_like(U)
+    normals[:, 0] = U[:, 1] * V[:, 2] - U[:, 2] * V[:, 1]
+    normals[:, 1] = U[:, 2] * V[:, 0] - U[:, 0] * V[:, 2]
+    normals[:, 2] = U[:, 0] * V[:, 1] - U[:, 1] * V[:, 0]
+    length = np.sqrt(normals[:, 0] * normals[:, 0] + normals[:, 1] * normals[:, 1] + normals[:, 2] * normals[:, 2])
+
+    vertexA, vertexB, vertexC = cornerVertex[cornerA], cornerVertex[cornerB], cornerVertex[cornerC]
+    keepTriangle = (length / 2 > DEGENERATE_AREA) & (vertexA != vertexB) & (vertexB != vertexC) & (vertexA != vertexC)
+    triangleFace, cornerA, cornerB, cornerC = triangleFace[keepTriangle], cornerA[keepTriangle], cornerB[keepTriangle], cornerC[keepTriangle]
+    normals = normals[keepTriangle] / length[keepTriangle, None]
+
+    # Triangles are wound C, B, A and then bucketed by texture group, preserving face order
+    cornerIndices = np.column_stack((cornerC, cornerB, cornerA))
+    vertexIndices = cornerVertex[cornerIndices]
+    normalIndices = np.arange(len(triangleFace))
+
+    triangleGroup = faceGroup[triangleFace]
+    order = np.argsort(triangleGroup, kind="stable")
+    bounds = np.searchsorted(triangleGroup[order], np.arange(len(groupNames) + 1))
+
+    groups = {}
+    textures = {}
+    for i, name in enumerate(groupNames):
+        selection = order[bounds[i]:bounds[i+1]]
+        if len(selection) > 0:
+            groups[name] = TextureGroup(vertexIndices[selection], cornerIndices[selection], normalIndices[selection])
+            textures[name] = groupTextures[name]
+
+    return Mesh(vertices, uvs, normals, groups, textures, lightmapUVs, lightmaps.texture if lightmaps is not None else None)
+
+class WeldReport(object):
+    def __init__(self, uvsBefore, uvsAfter, normalsBefore, normalsAfter):
+        self.uvsBefore = uvsBefore
+        self.uvsAfter = uvsAfter
+        self.normalsBefore = normalsBefore
+        self.normalsAfter = normalsAfter
+
+    def __repr__(self):
+        return "WeldReport (uvs: {} -> {}, normals: {} -> {})".format(self.uvsBefore, self.uvsAfter, self.normalsBefore, self.normalsAfter)
+
+""" Snaps each row to a grid of the given tolerance and collapses rows landing in the same cell, looking
+    each cell up in a hash index. Returns the surviving rows (first occurrence of each cell, in order of
+    appearance) and a remap from old to new indices """
+def deduplicate(values, tolerance):
+    # A tolerance of zero would turn every value into inf or nan, all landing in the same cell
+    if not tolerance > 0:
+        raise ValueError("Weld tolerance must be positive, got %s"%(tolerance))
+
+    if len(values) == 0:
+        return values, np.zeros(0, dtype=np.intp)
+
+    quantized = np.ascontiguousarray(np.round(values / tolerance).astype(np.int64)).reshape(len(values), -1)
+    remap = np.fromiter(hashedIndices(cellKeys(quantized)), dtype=np.intp, count=len(values))
+
+    # New indices are handed out in order, so a row survives wherever it's the first to reach a new one
+    first = np.empty(len(remap), dtype=bool)
+    first[0] = True
+    first[1:] = remap[1:] > np.maximum.accumulate(remap)[:-1]
+
+    return values[first], remap
+
+# One hashable key per row of `quantized`. Columns are offset to start at zero and packed together into a
+# single integer when they fit in 63 bits, otherwise each row's bytes are used
+def cellKeys(quantized):
+    low = quantized.min(axis=0)
+    bits = [int(span).bit_length() for span in quantized.max(axis=0) - low]
+    if sum(bits) > 63:
+        data = quantized.tobytes()
+        rowSize = quantized.itemsize * quantized.shape[1]
+        return (data[i:i + rowSize] for i in range(0, len(data), rowSize))
+
+    keys = np.zeros(len(quantized), dtype=np.int64)
+    for column, width in enumerate(bits):
+        keys = (keys << width) | (quantized[:, column] - low[column])
+    return keys.tolist()
+
+# Maps each key to the index of the first equal key seen, numbering distinct keys from zero
+def hashedIndices(keys):
+    index = {}
+    for key in keys:
+        yield index.setdefault(key, len(index))
+
+""" Welds near-identical UVs and normals so that faces share `vt`/`vn` records """
+def weld(mesh, tolerance=1e-5):
+    lightmapUVs = None
+    if mesh.lightmapUVs is not None:
+        # Lightmap UVs share uvIndices, so a UV is only welded where its lightmap UV matches too
+        combined, uvRemap = deduplicate(np.hstack((mesh.uvs, mesh.lightmapUVs)), tolerance)
+        uvs, lightmapUVs = combined[:, :2], combined[:, 2:]
+    else:
+        uvs, uvRemap = deduplicate(mesh.uvs, tolerance)
+    normals, normalRemap = deduplicate(mesh.normals, tolerance)
+
+    groups = {}
+    for name, group in mesh.groups.items():
+        groups[name] = TextureGroup(group.vertexIndices, uvRemap[group.uvIndices], normalRemap[group.normalIndices])
+
+    report = WeldReport(len(mesh.uvs), len(uvs), len(mesh.normals), len(normals))
+    return Mesh(mesh.vertices, uvs, normals, groups, mesh.textures, lightmapUVs, mesh.lightmap), report
@@ -0,0 +1,52 @@
+import numpy as np
+
+# Number of rows formatted per string operation. Large enough to amortise the
+# interpreter overhead, small enough that a chunk's text stays a few MB
+CHUNK_ROWS = 65536
+
+# Size of the buffer sitting between us and the output file
+BUFFER_SIZE = 1 << 20
+
+""" Formats every row of `values` with the same printf-style template and writes them out in large blocks """
+def writeRows(outputFile, template, values):
+    values = np.asarray(values)
+    if len(values) == 0:
+        return
+
+    values = values.reshape(len(values), -1)
+    for start in range(0, len(values), CHUNK_ROWS):
+        chunk = values[start:start + CHUNK_ROWS]
+        outputFile.write((template * len(chunk)) % tuple(chunk.ravel().tolist()))
+
+""" Writes a Mesh as OBJ text, referencing materials in `mtlFileName`. Floats are written with `precision` decimal places """
+def writeOBJ(outputFile, mesh, mtlFileName, precision=6):
+    outputFile.write("mtllib " + mtlFileName + "\n\n")
+
+    number = " %.{}f".format(precision)
+    writeRows(outputFile, "v" + number * 3 + "\n", mesh.vertices)
+    writeRows(outputFile, "vn" + number * 3 + "\n", mesh.normals)
+    writeRows(outputFile, "vt" + number * 2 + "\n", mesh.uvs)
+
+    for name, group in mesh.groups.items():
+        outputFile.write("\no mesh_" + name + "\n")
+        outputFile.write("\nusemtl " + name + "\n")
+
+        # OBJ indices are 1-based. All vertices in a face share a normal (flat shading)
+        normalIndices = group.normalIndices + 1
+        faces = np.empty((len(group.vertexIndices), 9), dtype=np.int64)
+        faces[:, 0::3] = group.vertexIndices + 1
+        faces[:, 1::3] = group.uvIndices + 1
+        faces[:, 2::3] = normalIndices[:, None]
+        writeRows(outputFile, "f %d/%d/%d %d/%d/%d %d/%d/%d\n", faces)
+
+""" Writes a material per texture group, each pointing at `<textureFolder>/<name>.<textureFormat>` """
+def writeMTL(mtlFile, mesh, textureFolder, textureFormat="png"):
+    for name in mesh.groups:
+        mtlFile.write("\nnewmtl " + name + "\n"
+            "Ka 1.000 1.000 1.000\n"
+            "Kd 1.000 1.000 1.000\n"
+            "Ks 0.000 0.000 0.000\n"
+            "d 1.0\n"
+            "illum 2\n"
+            "map_Ka " + textureFolder + "/" + name + "." + textureFormat + "\n"
+            "map_Kd " + textureFolder + "/" + name + "." + textureFormat + "\n")
@@ -1,142 +1,320 @@
-import struct, re, os, sys, io
+import struct, os, sys, io, mmap
 
 from ctypes import *
 from bsp2obj.helpers import *
 from bsp2obj.constants import *
+from bsp2obj.index import *
+from bsp2obj.pakcache import *
+from bsp2obj.extract import *
+from bsp2obj.stats import *
 
 class PAKCollection(object):
-    def __init__(self, game, paths):
+    # Archives are merged in order, so entries in later paths override those in earlier ones
+    # (pak0 -> pak1 -> ...). A folder can be given in place of an archive to overlay loose files.
+    # `useCache` keeps each archive's parsed directory in a sidecar file for faster startup
+    def __init__(self, game, paths, useCache=False):
         self.game = game
         self.list = []
+        self.index = DirectoryIndex()
+        self.useCache = useCache
 
-        for path in paths:
-            path = os.path.join(sys.path[0], path)
-            with open(path, "rb") as f:
-                data = io.BytesIO(f.read())
-                pak = PAK(game, data)
+        with stats.stage("archive_open"):
+            for path in paths:
+                path = os.path.join(sys.path[0], path)
+                pak = PAKFolder(path) if os.path.isdir(path) else PAK.open(game, path, useCache)
                 self.list.append(pak)
+                self.index.addDirectory(pak)
+                stats.count("archives")
 
-    # Look for the given object in our PAK collection and,
-    # failing that lookup, check the filesystem
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        for pak in self.list:
+            pak.close()
+        self.list = []
+
+    # Look for the given object in our PAK collection (including any overlaid folders)
+    # and, failing that lookup, check the filesystem
     def dataForEntry(self, name):
         pak, entry = self.entryForName(name)
         if pak is not None:
-            pak.data.seek(entry.offset)
-            size = entry.compressedSize if entry.isCompressed else entry.size
-            data = pak.data.read(size)
-
-            if entry.isCompressed:
-                return self.decompressData(data)
-
-            return io.BytesIO(data)
+            stats.count("entries_read")
+            stats.count("bytes_read", entry.size)
+            return pak.readerForEntry(entry)
         else:
+            # Read the file in place rather than copying it into memory up front
             try:
-                with open(name, "rb") as f:
-                    return io.BytesIO(f.read())
+                window = FileWindow.open(name)
             except:
                 return None
 
+            stats.count("files_read")
+            stats.count("bytes_read", window.size)
+            return window
+
         return None
 
-    # Based on https://gist.github.com/DanielGibson/a53c74b10ddd0a1f3d6ab42909d5b7e1
-    def decompressData(self, input):
-        input = io.BytesIO(input)
-        output = io.BytesIO()
-        endian = 'big'
-
-        while input.tell() < len(input.getbuffer()):
-            x = int.from_bytes(input.read(1), endian)
-            if x < 64:
-                output.write(input.read(x+1))
-            elif x < 128: # run-length encoded zeroes
-                for p in range(0, x-62):
-                    output.write(b'\x00')
-            elif x < 192:
-                byte = input.read(1)
-                for p in range(0, x-126):
-                    output.write(byte)
-            elif x < 254:
-                offset = int.from_bytes(input.read(1), endian)
-                prevOffset = output.tell()
-                output.seek(prevOffset - (offset+2))
-                uncompressedData = output.read(x-190)
-                output.seek(prevOffset)
-                output.write(uncompressedData)
-            elif x == 255:
-                break
-
-        output.seek(0)
-        return output
+    # Identifies where `name` would be loaded from: the path of the PAK containing it,
+    # or None if it would come straight from the filesystem
+    def archiveForName(self, name):
+        pak, entry = self.entryForName(name)
+        return pak.path if pak is not None else None
+
+    # Decompresses a Daikatana entry's stored bytes (`size` being its uncompressed size, if known) into a
+    # BufferReader. Entries read through dataForEntry are already decompressed
+    def decompressData(self, input, size=0):
+        return BufferReader(decompress(input, size))
+
+    # Returns the sorted names of every entry matching a glob (`maps/*.bsp`, or `**/*.bsp` for every folder),
+    # or a regular expression when the pattern is prefixed with `re:`
+    def namesMatching(self, pattern):
+        if pattern.startswith("re:"):
+            return self.index.search(pattern[3:])
+
+        return self.index.glob(pattern)
+
+    # Names for -l/-e, which take a regular expression (`*` meaning everything)
+    def namesForExpression(self, pattern):
+        if pattern == "*":
+            return sorted(indexEntry.name for indexEntry in self.index.entries.values())
+
+        return self.index.search(pattern)
 
+    # Returns the names of the entries matching `pattern`, for listing
     def dumpContents(self, pattern):
-        for pak in self.list:
-            pak.dumpContents(pattern)
+        logger.info("Dumping PAK contents matching `%s`"%(pattern))
+        return self.namesForExpression(pattern)
 
-    def exportContents(self, pattern):
-        for pak in self.list:
-            pak.exportContents(pattern)
+    # Only the winning copy of each overridden entry is exported, decompressed if need be.
+    # `workers` sets how many files are written concurrently. Returns an ExportReport
+    def exportContents(self, pattern, workers=None):
+        logger.info("Exporting PAK contents matching `%s`"%(pattern))
+        entries = []
+        for name in self.namesForExpression(pattern):
+            indexEntry = self.index.lookup(name)
+            entries.append((name, indexEntry.source, indexEntry.entry))
 
+        return exportEntries(entries, workers)
+
+    # Case-insensitive, and independent of the number of archives in the collection
     def entryForName(self, name):
-        for pak in self.list:
-            if name in pak.directory:
-                return pak, pak.directory[name]
+        indexEntry = self.index.lookup(name)
+        if indexEntry is None:
+            return None, None
+
+        return indexEntry.source, indexEntry.entry
+
+# Back-references in Daikatana's compressed entries reach at most 255+2 bytes behind the write position
+DECOMPRESSION_WINDOW = 257
+
+""" Decodes a Daikatana LZ/RLE-compressed entry, yielding the output in pieces. When `chunkSize` is given,
+    output is yielded roughly every `chunkSize` bytes and only a small window is kept in memory; otherwise
+    everything is decoded into a single bytearray preallocated to `size` bytes and yielded once at the end.
+    Based on https://gist.github.com/DanielGibson/a53c74b10ddd0a1f3d6ab42909d5b7e1 """
+def decompressChunks(data, size=0, chunkSize=None):
+    data = memoryview(data)
+    output = bytearray(0 if chunkSize is not None else size)
+    position = 0
+    i = 0
+
+    # Invariant: nothing at or beyond `position` has been written yet, so any of the
+    # preallocated buffer that lies there is still zeroed
+    while i < len(data):
+        x = data[i]
+        i += 1
+
+        if x < 64: # literal bytes
+            literal = data[i:i+x+1]
+            output[position:position+len(literal)] = literal
+            i += len(literal)
+            position += len(literal)
+        elif x < 128: # run-length encoded zeroes
+            count = x - 62
+            if position + count > len(output):
+                output.extend(bytes(position + count - len(output)))
+            position += count
+        elif x < 192: # run of a single repeated byte
+            count = x - 126
+            output[position:position+count] = data[i:i+1].tobytes() * count
+            i += 1
+            position += count
+        elif x < 254: # copy of earlier output
+            count = x - 190
+            offset = data[i] + 2
+            i += 1
+
+            start = position - offset
+            if start < 0:
+                raise ValueError("Back-reference %i bytes before the start of the output"%(-start))
+
+            # When the source overlaps what we're writing the earlier bytes repeat, LZ77-style
+            if offset >= count:
+                output[position:position+count] = output[start:start+count]
+            else:
+                output[position:position+count] = (output[start:position] * (count // offset + 1))[:count]
+            position += count
+        elif x == 255:
+            break
+
+        if chunkSize is not None and position >= chunkSize + DECOMPRESSION_WINDOW:
+            flushed = position - DECOMPRESSION_WINDOW
+            yield bytes(output[:flushed])
+            del output[:flushed]
+            position = DECOMPRESSION_WINDOW
 
-        return None, None
+    if position < len(output):
+        del output[position:]
+
+    yield output
+
+""" Decodes a whole Daikatana-compressed entry into a bytearray of (ideally) `size` bytes """
+def decompress(data, size=0):
+    chunks = list(decompressChunks(data, size))
+    return chunks[0] if len(chunks) == 1 else bytearray(b"").join(chunks)
 
 class PAKEntry(object):
-    def __init__(self, offset, size, compressedSize=0, isCompressed=False):
+    __slots__ = ("offset", "size", "compressedSize", "isCompressed", "path")
+
+    # `path` is only set for loose files overlaid from a folder
+    def __init__(self, offset, size, compressedSize=0, isCompressed=False, path=None):
         self.offset = offset
         self.size = size
         self.compressedSize = compressedSize
         self.isCompressed = isCompressed
+        self.path = path
 
 class PAK(object):
-    def __init__(self, game, data):
+    # `data` can be any object supporting the buffer protocol (bytes, mmap, memoryview).
+    # Only the directory is parsed here; file contents are sliced out on demand. With `useCache`
+    # the parsed directory is kept in a sidecar file next to the archive (see pakcache.py)
+    def __init__(self, game, data, path=None, useCache=False):
         self.game = game
-        self.data = data
+        self.path = path
+        self.mapping = data if isinstance(data, mmap.mmap) else None
+        self.data = memoryview(data)
 
-        header, = struct.unpack("4s", data.read(4))
+        header, = struct.unpack_from("4s", self.data, 0)
         header = bytesToString(header)
 
         if(header != "PACK"):
             raise ValueError("Expected PACK header, found " + header)
-            
-        # Get the offset and size of the PAK directory list
-        offset, size = struct.unpack('ii', data.read(8))
-        data.seek(offset)
 
         FILE_INDEX_SIZE_BYTES = 64
         if game is Game.DAIKATANA:
             FILE_INDEX_SIZE_BYTES = 72
 
-        self.directory = {}
-        for i in range(0, size // FILE_INDEX_SIZE_BYTES):
-            if game is Game.DAIKATANA:
-                filename, offset, size, compressedSize, isCompressed = struct.unpack("56siiii", data.read(FILE_INDEX_SIZE_BYTES))
+        if not useCache or path is None:
+            self.directory = self.parseDirectory(FILE_INDEX_SIZE_BYTES)
+            return
+
+        cachePath = cachePathForArchive(path)
+        signature = archiveSignature(path, self.data)
+        cached = loadDirectory(cachePath, signature, FILE_INDEX_SIZE_BYTES)
+        if cached is not None:
+            names, records = cached
+            self.directory = {name: PAKEntry(*record) for name, record in zip(names, records)}
+        else:
+            self.directory = self.parseDirectory(FILE_INDEX_SIZE_BYTES)
+            saveDirectory(cachePath, signature, FILE_INDEX_SIZE_BYTES, self.directory)
+
+    def parseDirectory(self, recordSize):
+        # Get the offset and size of the PAK directory list
+        offset, size = struct.unpack_from('ii', self.data, 4)
+
+        directory = {}
+        for i in range(0, size // recordSize):
+            recordOffset = offset + i * recordSize
+            if self.game is Game.DAIKATANA:
+                filename, entryOffset, entrySize, compressedSize, isCompressed = struct.unpack_from("56siiii", self.data, recordOffset)
                 filename = c_char_p(filename).value # null-terminate string
                 filename = bytesToString(filename)
-                self.directory[filename] = PAKEntry(offset, size, compressedSize, isCompressed)
+                directory[filename] = PAKEntry(entryOffset, entrySize, compressedSize, isCompressed)
             else:
-                filename, offset, size = struct.unpack("56sii", data.read(FILE_INDEX_SIZE_BYTES))
+                filename, entryOffset, entrySize = struct.unpack_from("56sii", self.data, recordOffset)
                 filename = c_char_p(filename).value # null-terminate string
                 filename = bytesToString(filename)
-                self.directory[filename] = PAKEntry(offset, size, 0, False)
+                directory[filename] = PAKEntry(entryOffset, entrySize, 0, False)
 
-    def dumpContents(self, pattern):
-        print("Dumping PAK contents matching `%s`"%(pattern))
-        for filename in self.directory:
-            if pattern is "*" or re.search(pattern, filename):
-                print(filename)
-
-    def exportContents(self, pattern):
-        print("Exporting PAK contents matching `%s`"%(pattern))
-        for filename in self.directory:
-            if pattern is "*" or re.search(pattern, filename):
-                index = self.directory[filename]
-                buffer = self.data.getbuffer()
-
-                createFolderStructure(filename)
-                with open(filename, "wb") as output:
-                    output.write(buffer[index.offset:(index.offset + index.size)])
-                
+        return directory
+
+    # Memory-map the PAK at the given path. Pages are only faulted in
+    # as entries are touched, so resident memory tracks what we actually read
+    @staticmethod
+    def open(game, path, useCache=False):
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise ValueError("Expected PACK header, found an empty file at `%s`"%(path))
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return PAK(game, mapping, path, useCache)
+
+    def close(self):
+        try:
+            self.data.release()
+            if self.mapping is not None:
+                self.mapping.close()
+        except BufferError:
+            # Views handed out by dataForEntry are still alive; the
+            # mapping will be unmapped once they're garbage collected
+            pass
+
+    # Returns a seekable reader over the entry's contents: a view straight into the mapped archive
+    # rather than a copy, unless the entry is compressed and has to be decoded first
+    def readerForEntry(self, entry):
+        data = self.viewForEntry(entry)
+        if entry.isCompressed:
+            with stats.stage("decompress"):
+                return BufferReader(decompress(data, entry.size))
+
+        return BufferReader(data)
+
+    # Returns a zero-copy slice of the archive containing the (possibly compressed) entry
+    def viewForEntry(self, entry):
+        size = entry.compressedSize if entry.isCompressed else entry.size
+        return self.data[entry.offset:(entry.offset + size)]
+
+    # Yields the entry's (decompressed) contents roughly `chunkSize` bytes at a time
+    def chunksForEntry(self, entry, chunkSize=EXPORT_CHUNK_SIZE):
+        data = self.viewForEntry(entry)
+        if entry.isCompressed:
+            for chunk in decompressChunks(data, entry.size, chunkSize):
+                yield chunk
+        else:
+            for offset in range(0, len(data), chunkSize):
+                yield data[offset:(offset + chunkSize)]
+
+""" Loose files under a folder, presented like a PAK so they can be overlaid on a collection.
+    The folder is walked once up front; entry names are relative to it using `/` separators """
+class PAKFolder(object):
+    def __init__(self, path):
+        self.path = path
+        self.directory = {}
+
+        for folderPath, folderNames, fileNames in os.walk(path):
+            folderNames.sort()
+            for fileName in sorted(fileNames):
+                filePath = os.path.join(folderPath, fileName)
+                name = os.path.relpath(filePath, path).replace(os.sep, "/")
+                self.directory[name] = PAKEntry(0, os.path.getsize(filePath), path=filePath)
+
+    def close(self):
+        pass
+
+    def readerForEntry(self, entry):
+        return FileWindow.open(entry.path)
+
+    def viewForEntry(self, entry):
+        with open(entry.path, "rb") as f:
+            return memoryview(f.read())
+
+    def chunksForEntry(self, entry, chunkSize=EXPORT_CHUNK_SIZE):
+        with open(entry.path, "rb") as f:
+            chunk = f.read(chunkSize)
+            while len(chunk) > 0:
+                yield chunk
+                chunk = f.read(chunkSize)
 
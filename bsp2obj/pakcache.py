@@ -0,0 +1,80 @@
+import os, struct, hashlib
+
+import numpy as np
+
+DIRECTORY_CACHE_EXTENSION = ".dircache"
+DIRECTORY_CACHE_MAGIC = b"PKDC"
+DIRECTORY_CACHE_VERSION = 1
+
+# magic, version, record size, archive size, archive mtime (ns), header hash, entry count, name table length
+DIRECTORY_CACHE_HEADER = struct.Struct("<4sIIqq16sII")
+DIRECTORY_CACHE_ENTRY_DTYPE = np.dtype([
+    ("offset", "<i4"),
+    ("size", "<i4"),
+    ("compressedSize", "<i4"),
+    ("isCompressed", "<i4")
+])
+
+""" Identifies the state of an archive on disk: its size and modification time plus a hash of its
+    12 byte header (which records where the directory lives and how big it is) """
+def archiveSignature(path, data):
+    stat = os.stat(path)
+    headerHash = hashlib.blake2b(bytes(data[0:12]), digest_size=16).digest()
+    return (stat.st_size, stat.st_mtime_ns, headerHash)
+
+def cachePathForArchive(path):
+    return path + DIRECTORY_CACHE_EXTENSION
+
+""" Loads a directory previously written by saveDirectory, returning a list of names and a matching list
+    of (offset, size, compressedSize, isCompressed) tuples, or None if the cache is missing, unreadable
+    or was written for a different version of the archive """
+def loadDirectory(cachePath, signature, recordSize):
+    try:
+        with open(cachePath, "rb") as f:
+            contents = f.read()
+    except OSError:
+        return None
+
+    if len(contents) < DIRECTORY_CACHE_HEADER.size:
+        return None
+
+    magic, version, cachedRecordSize, size, mtime, headerHash, count, namesLength = DIRECTORY_CACHE_HEADER.unpack_from(contents, 0)
+    if magic != DIRECTORY_CACHE_MAGIC or version != DIRECTORY_CACHE_VERSION or cachedRecordSize != recordSize:
+        return None
+    if (size, mtime, headerHash) != signature:
+        return None
+
+    entriesOffset = DIRECTORY_CACHE_HEADER.size + namesLength
+    if len(contents) != entriesOffset + count * DIRECTORY_CACHE_ENTRY_DTYPE.itemsize:
+        return None
+
+    names = contents[DIRECTORY_CACHE_HEADER.size:entriesOffset].decode("utf-8").split("\0") if count > 0 else []
+    if len(names) != count:
+        return None
+
+    return names, np.frombuffer(contents, DIRECTORY_CACHE_ENTRY_DTYPE, count, entriesOffset).tolist()
+
+""" Writes a parsed directory (a dict of name -> PAKEntry) next to its archive. The names are stored as
+    a single NUL-separated table followed by a packed array of entry records, so loading it back is one
+    read and a couple of buffer views. Failing to write (e.g. on a read-only mount) is not an error """
+def saveDirectory(cachePath, signature, recordSize, directory):
+    names = "\0".join(directory.keys()).encode("utf-8")
+
+    records = np.array([(entry.offset, entry.size, entry.compressedSize, entry.isCompressed) for entry in directory.values()], DIRECTORY_CACHE_ENTRY_DTYPE)
+
+    size, mtime, headerHash = signature
+    header = DIRECTORY_CACHE_HEADER.pack(DIRECTORY_CACHE_MAGIC, DIRECTORY_CACHE_VERSION, recordSize, size, mtime, headerHash, len(directory), len(names))
+
+    # Write to a temporary file first so concurrent runs never see a half-written cache
+    temporaryPath = "%s.%i.tmp"%(cachePath, os.getpid())
+    try:
+        with open(temporaryPath, "wb") as f:
+            f.write(header)
+            f.write(names)
+            f.write(records.tobytes())
+        os.replace(temporaryPath, cachePath)
+    except OSError:
+        try:
+            os.remove(temporaryPath)
+        except OSError:
+            pass
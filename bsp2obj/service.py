@@ -0,0 +1,286 @@
+import asyncio, io, json, os, time, zipfile, traceback, multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from bsp2obj.bsp import *
+from bsp2obj.pak import *
+from bsp2obj.cache import *
+
+""" An asyncio HTTP service that converts maps on demand. The archives and palette are opened once and
+    kept open, conversions run in a pool of worker processes (each with its own copy of the archives
+    mapped read-only), identical requests that arrive while a conversion is running share its result,
+    and finished results are kept in a byte-bounded LRU cache.
+
+    GET /maps                    JSON list of the maps in the archives
+    GET /convert/<map>?<options> The converted map. Options are format (glb, obj or any registered
+                                 exporter), weld, atlas, simplify, reorder, lightmaps, precision
+                                 and textures.
+                                 A format that writes several files is returned as a zip
+    GET /stats                   JSON request, conversion and cache counters """
+
+DEFAULT_RESULT_CACHE_BYTES = 256 * 1024 * 1024
+MAX_REQUEST_LINE = 8192
+MAX_HEADERS = 100
+
+CONTENT_TYPES = {"glb": "model/gltf-binary", "obj": "text/plain; charset=utf-8", "zip": "application/zip", "json": "application/json"}
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+""" The options a conversion was requested with. Requests with equal keys produce identical output,
+    so they share a conversion and a cache entry """
+class ConversionRequest(object):
+    def __init__(self, name, outputFormat="glb", weldTolerance=None, atlasSize=None, simplify=False, vertexCache=False, precision=6, textureFormat="png", lightmaps=False):
+        self.name = name
+        self.outputFormat = outputFormat
+        self.weldTolerance = weldTolerance
+        self.atlasSize = atlasSize
+        self.simplify = simplify
+        self.vertexCache = vertexCache
+        self.precision = precision
+        self.textureFormat = textureFormat
+        self.lightmaps = lightmaps
+
+    # Parses the options of a /convert request, raising HTTPError(400) for anything malformed
+    @staticmethod
+    def fromQuery(name, query):
+        options = dict((key, values[-1]) for key, values in parse_qs(query).items())
+        try:
+            request = ConversionRequest(name,
+                options.get("format", "glb").lower(),
+                float(options["weld"]) if "weld" in options else None,
+                int(options["atlas"]) if "atlas" in options else None,
+                options.get("simplify", "0") not in ["0", "false", ""],
+                options.get("reorder", "0") not in ["0", "false", ""],
+                int(options.get("precision", 6)),
+                options.get("textures", "png").lower(),
+                options.get("lightmaps", "0") not in ["0", "false", ""])
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+
+        if request.outputFormat not in EXPORTERS:
+            raise HTTPError(400, "Unsupported output format `%s`, expected one of %s"%(request.outputFormat, ", ".join(sorted(EXPORTERS))))
+        if request.textureFormat not in TEXTURE_FORMATS:
+            raise HTTPError(400, "Unsupported texture format `%s`, expected one of %s"%(request.textureFormat, ", ".join(TEXTURE_FORMATS)))
+        if request.weldTolerance is not None and not request.weldTolerance > 0:
+            raise HTTPError(400, "Weld tolerance must be positive, got %s"%(request.weldTolerance))
+        if request.lightmaps and (request.simplify or request.atlasSize is not None):
+            raise HTTPError(400, "Lightmaps can't be combined with simplify or atlas")
+
+        return request
+
+    def key(self):
+        return (self.name.lower(), self.outputFormat, self.weldTolerance, self.atlasSize, self.simplify, self.vertexCache, self.precision, self.textureFormat, self.lightmaps)
+
+    def exporter(self):
+        if self.outputFormat == "obj":
+            return OBJExporter(self.precision, self.textureFormat)
+        return exporterForFormat(self.outputFormat)
+
+class ConversionResult(object):
+    def __init__(self, data, contentType, seconds):
+        self.data = data
+        self.contentType = contentType
+        self.seconds = seconds
+
+""" Converts a map into a single response body: the exporter's only file, or a zip of all of them """
+def convertToBytes(paks, palette, request, textureCache=None):
+    start = time.time()
+    with BSPMap.fromPAKs(paks, request.name, palette, textureCache) as bspMap:
+        mesh = bspMap.buildMesh(request.weldTolerance, request.atlasSize, request.simplify, request.vertexCache, request.lightmaps)
+
+        baseName = os.path.splitext(os.path.basename(request.name))[0]
+        output = MemoryOutput()
+        names = request.exporter().export(mesh, baseName, output)
+    if len(names) == 1:
+        extension = os.path.splitext(names[0])[1][1:]
+        return ConversionResult(output.files[names[0]], CONTENT_TYPES.get(extension, "application/octet-stream"), time.time() - start)
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as zipFile:
+        for name in names:
+            zipFile.writestr(name, output.files[name])
+    return ConversionResult(archive.getvalue(), CONTENT_TYPES["zip"], time.time() - start)
+
+# The archives and palette opened by each of the service's worker processes
+workerPAKs = None
+workerPalette = None
+workerTextureCache = None
+
+def initServiceWorker(game, paths, useCache, palette, textureCacheBytes=None):
+    global workerPAKs, workerPalette, workerTextureCache
+    workerPAKs = PAKCollection(game, paths, useCache)
+    workerPalette = palette
+    workerTextureCache = newTextureCache(textureCacheBytes) if textureCacheBytes is not None else None
+
+def convertInServiceWorker(request):
+    return convertToBytes(workerPAKs, workerPalette, request, workerTextureCache)
+
+class ConversionService(object):
+    # `workers` processes convert maps (all cores by default). Finished results are kept until they
+    # take up more than `cacheBytes`. Each worker keeps up to `textureCacheBytes` of decoded textures
+    def __init__(self, game, paks, palette, workers=None, cacheBytes=DEFAULT_RESULT_CACHE_BYTES, textureCacheBytes=None):
+        self.game = game
+        self.paks = paks
+        self.palette = BSP.loadPalette(palette, paks)
+        self.results = LRUCache(cacheBytes, lambda result: len(result.data))
+        self.inFlight = {}
+        self.requests = 0
+        self.conversions = 0
+        self.coalesced = 0
+        self.failures = 0
+
+        # Workers are started as they're needed, by which point connections are open. Forked workers would
+        # inherit those sockets and hold them open after we close them, so they're spawned fresh instead
+        paths = [pak.path for pak in paks.list]
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=initServiceWorker, initargs=(game, paths, paks.useCache, self.palette, textureCacheBytes))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    # Returns the ConversionResult for `request`, from the cache, from a conversion already running
+    # for an identical request, or from a new conversion
+    async def convert(self, request):
+        self.requests += 1
+
+        # Only maps in the archives are served; unlike the command line we never fall back to the filesystem,
+        # and other entries (palettes, textures...) are turned away here rather than failing in a worker
+        if not request.name.lower().endswith(".bsp") or self.paks.entryForName(request.name)[0] is None:
+            raise HTTPError(404, "No map named `%s`"%(request.name))
+
+        key = request.key()
+        result = self.results.lookup(key)
+        if result is not None:
+            return result
+
+        future = self.inFlight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            future = asyncio.get_running_loop().run_in_executor(self.executor, convertInServiceWorker, request)
+            self.inFlight[key] = future
+            self.conversions += 1
+            future.add_done_callback(lambda future: self.finished(key, future))
+
+        # A requester going away mustn't cancel a conversion others may be waiting on
+        return await asyncio.shield(future)
+
+    def finished(self, key, future):
+        del self.inFlight[key]
+        if future.cancelled():
+            return
+
+        if future.exception() is not None:
+            self.failures += 1
+        else:
+            self.results.put(key, future.result())
+
+    def mapNames(self):
+        return self.paks.namesMatching("**/*.bsp")
+
+    def statsJSON(self):
+        return {
+            "requests": self.requests,
+            "conversions": self.conversions,
+            "coalesced": self.coalesced,
+            "failures": self.failures,
+            "inFlight": len(self.inFlight),
+            "cachedResults": len(self.results),
+            "cachedBytes": self.results.size,
+            "cacheHits": self.results.hits,
+            "cacheMisses": self.results.misses
+        }
+
+    # Starts serving on `host`:`port` (port 0 picks a free one) and returns the asyncio Server
+    async def start(self, host="127.0.0.1", port=8080):
+        return await asyncio.start_server(self.handleConnection, host, port)
+
+    async def handleConnection(self, reader, writer):
+        try:
+            try:
+                path = await readRequest(reader)
+                status, contentType, body = 200, CONTENT_TYPES["json"], None
+
+                url = urlsplit(path)
+                if url.path == "/maps":
+                    body = json.dumps(self.mapNames()).encode("utf-8")
+                elif url.path == "/stats":
+                    body = json.dumps(self.statsJSON(), sort_keys=True).encode("utf-8")
+                elif url.path.startswith("/convert/"):
+                    request = ConversionRequest.fromQuery(unquote(url.path[len("/convert/"):]), url.query)
+                    result = await self.convert(request)
+                    contentType, body = result.contentType, result.data
+                else:
+                    raise HTTPError(404, "Unknown path `%s`"%(url.path))
+            except HTTPError as e:
+                status, contentType, body = e.status, "text/plain; charset=utf-8", (str(e) + "\n").encode("utf-8")
+            except Exception:
+                logger.error(traceback.format_exc().rstrip())
+                status, contentType, body = 500, "text/plain; charset=utf-8", b"Conversion failed\n"
+
+            writer.write(responseHeader(status, contentType, len(body)))
+            writer.write(body)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+STATUS_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+# Reads an HTTP request's head and returns the path it asks for. Only GET is supported, and any body is ignored
+async def readRequest(reader):
+    line = await readLine(reader, "Request line too long")
+    if len(line) == 0:
+        raise asyncio.IncompleteReadError(line, None)
+    if len(line) > MAX_REQUEST_LINE:
+        raise HTTPError(400, "Request line too long")
+
+    parts = line.decode("latin-1").split()
+    if len(parts) != 3:
+        raise HTTPError(400, "Malformed request line")
+
+    for i in range(MAX_HEADERS + 1):
+        header = await readLine(reader, "Header too long")
+        if header in [b"\r\n", b"\n", b""]:
+            break
+    else:
+        raise HTTPError(400, "Too many headers")
+
+    method, path, version = parts
+    if method != "GET":
+        raise HTTPError(405, "Only GET is supported")
+
+    return path
+
+# Lines longer than the stream's buffer limit make readline raise rather than return them, so they're
+# rejected with a 400 like any other over-long line
+async def readLine(reader, message):
+    try:
+        return await reader.readline()
+    except (ValueError, asyncio.LimitOverrunError):
+        raise HTTPError(400, message)
+
+def responseHeader(status, contentType, length):
+    return ("HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: close\r\n\r\n".format(status, STATUS_REASONS[status], contentType, length)).encode("latin-1")
+
+""" Serves conversions on `host`:`port` until interrupted """
+def serve(game, paks, palette, host="127.0.0.1", port=8080, workers=None, cacheBytes=DEFAULT_RESULT_CACHE_BYTES, textureCacheBytes=None):
+    service = ConversionService(game, paks, palette, workers, cacheBytes, textureCacheBytes)
+
+    async def run():
+        server = await service.start(host, port)
+        for socket in server.sockets:
+            logger.info("Serving on http://%s:%i"%(socket.getsockname()[:2]))
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
@@ -0,0 +1,319 @@
+import math
+
+import numpy as np
+
+from bsp2obj.mesh import *
+
+# Vertices closer together than this (in map units) are treated as the same vertex
+DEFAULT_VERTEX_WELD_TOLERANCE = 1e-3
+
+# How far (as the sine of the angle between them) two edges can bend and still count as a straight line
+COLLINEAR_EPSILON = 1e-5
+
+# Largest difference in plane normal (1 - cosine) and distance (map units) between two faces treated as coplanar.
+# Faces are grouped by their plane index already; this guards against BSPs whose plane indices can't be trusted
+COPLANAR_NORMAL_EPSILON = 1e-6
+COPLANAR_DISTANCE_EPSILON = 1e-2
+
+# Number of vertices the post-transform cache is assumed to hold when ordering triangles
+DEFAULT_VERTEX_CACHE_SIZE = 16
+
+class SimplifyReport(object):
+    def __init__(self, verticesBefore, verticesAfter, facesBefore, facesAfter):
+        self.verticesBefore = verticesBefore
+        self.verticesAfter = verticesAfter
+        self.facesBefore = facesBefore
+        self.facesAfter = facesAfter
+
+    def __repr__(self):
+        return "SimplifyReport (vertices: {} -> {}, faces: {} -> {})".format(self.verticesBefore, self.verticesAfter, self.facesBefore, self.facesAfter)
+
+# Returns the vertex index of every face corner, face after face in winding order, along with how many corners each face has
+def faceCorners(edges, lEdges, faces):
+    firstEdge = faces["firstEdgeIndex"].astype(np.intp)
+    counts = np.maximum(faces["numEdges"].astype(np.intp), 0)
+
+    cornerStart = np.cumsum(counts) - counts
+    cornerFace = np.repeat(np.arange(len(faces)), counts)
+    lEdge = lEdges[firstEdge[cornerFace] + np.arange(len(cornerFace)) - cornerStart[cornerFace]]
+    edgeIndex = np.abs(lEdge)
+    corners = np.where(lEdge < 0, edges["vert1"][edgeIndex], edges["vert2"][edgeIndex]).astype(np.intp)
+
+    return corners, counts
+
+# Index of the corner following each one round its face
+def followingCorners(counts):
+    start = np.cumsum(counts) - counts
+    following = np.arange(counts.sum()) + 1
+    following[start[counts > 0] + counts[counts > 0] - 1] = start[counts > 0]
+    return following
+
+# Turn made at `vertex` walking prev -> vertex -> next, measured along `normal`:
+# positive for a convex corner, about zero for a straight one and negative for a reflex one.
+# Called once per candidate corner, so it works on plain tuples rather than numpy arrays
+def turn(positions, normal, previous, vertex, following):
+    px, py, pz = positions[previous]
+    vx, vy, vz = positions[vertex]
+    fx, fy, fz = positions[following]
+    ax, ay, az = vx - px, vy - py, vz - pz
+    bx, by, bz = fx - vx, fy - vy, fz - vz
+    scale = math.sqrt((ax * ax + ay * ay + az * az) * (bx * bx + by * by + bz * bz))
+    if scale == 0:
+        return 0.0
+    return ((ay * bz - az * by) * normal[0] + (az * bx - ax * bz) * normal[1] + (ax * by - ay * bx) * normal[2]) / scale
+
+# Joins two convex polygons along the run of edges they share around a -> b (b -> a in `other`), returning
+# None if the result wouldn't be convex. Corners inside the run are dropped (as long as no other face uses
+# them) and straight corners left where the polygons meet are removed if nothing else uses them
+def tryMerge(polygon, other, a, b, positions, normal, uses):
+    if a not in polygon or b not in other:
+        return None
+
+    n = len(polygon)
+    m = len(other)
+    start = polygon.index(a)
+    otherEnd = other.index(b)
+    if polygon[(start + 1) % n] != b or other[(otherEnd + 1) % m] != a:
+        return None
+
+    # Grow the shared run in both directions; polygon[start..start + length] is other[otherEnd..otherStart] reversed
+    length = 1
+    otherStart = (otherEnd + 1) % m
+    while length < min(n, m) - 1 and polygon[(start + length + 1) % n] == other[(otherEnd - 1) % m]:
+        length += 1
+        otherEnd = (otherEnd - 1) % m
+    while length < min(n, m) - 1 and polygon[(start - 1) % n] == other[(otherStart + 1) % m]:
+        start = (start - 1) % n
+        otherStart = (otherStart + 1) % m
+        length += 1
+
+    inner = [polygon[(start + i) % n] for i in range(1, length)]
+    if any(uses[vertex] != 2 for vertex in inner):
+        return None
+
+    # polygon from the end of the run round to its start, then the rest of other
+    merged = [polygon[(start + length + i) % n] for i in range(n - length + 1)]
+    merged += [other[(otherStart + 1 + i) % m] for i in range(m - length - 1)]
+    if len(set(merged)) != len(merged):
+        return None
+
+    # Only the corners where the polygons meet can have become reflex
+    joints = [0, n - length]
+    turns = []
+    for i in joints:
+        t = turn(positions, normal, merged[i - 1], merged[i], merged[(i + 1) % len(merged)])
+        if t < -COLLINEAR_EPSILON:
+            return None
+        turns.append(t)
+
+    for vertex in inner:
+        uses[vertex] = 0
+    for i in joints:
+        uses[merged[i]] -= 1
+    for i, t in sorted(zip(joints, turns), reverse=True):
+        if abs(t) <= COLLINEAR_EPSILON and uses[merged[i]] == 1 and len(merged) > 3:
+            uses[merged[i]] -= 1
+            del merged[i]
+
+    return merged
+
+# Returns the unit normal (via Newell's method, which copes with straight corners) and plane distance
+# of every face, with a zero normal for faces that have no area
+def facePlanes(corners, counts, positions):
+    owner = np.repeat(np.arange(len(counts)), counts)
+    points = positions[corners]
+
+    normals = np.zeros((len(counts), 3))
+    centres = np.zeros((len(counts), 3))
+    np.add.at(normals, owner, np.cross(points, points[followingCorners(counts)]))
+    np.add.at(centres, owner, points)
+
+    lengths = np.sqrt(np.einsum("ij,ij->i", normals, normals))
+    normals /= np.where(lengths > 0, lengths, 1)[:, None]
+    centres /= np.maximum(counts, 1)[:, None]
+    return normals, np.einsum("ij,ij->i", normals, centres)
+
+# Greedily merges a set of polygons sharing a plane until no more pairs can be joined. `origins`
+# holds a value per polygon (e.g. its face index); each result carries the smallest of those merged into it.
+# `planes` holds each polygon's (normal, distance), with None for those without area
+def mergePolygons(polygons, origins, planes, positions, uses):
+    polygons = list(polygons)
+    origins = list(origins)
+    planes = list(planes)
+
+    owners = {}
+    for i, polygon in enumerate(polygons):
+        for k in range(len(polygon)):
+            owners[(polygon[k], polygon[(k + 1) % len(polygon)])] = i
+
+    # A polygon keeps absorbing neighbours until none fit, so one pass is enough
+    for i in range(len(polygons)):
+        if polygons[i] is None or planes[i] is None:
+            continue
+        k = 0
+        while k < len(polygons[i]):
+            polygon = polygons[i]
+            a = polygon[k]
+            b = polygon[(k + 1) % len(polygon)]
+            j = owners.get((b, a))
+            if j is not None and j != i and polygons[j] is not None and planes[j] is not None:
+                normal, distance = planes[i]
+                otherNormal = planes[j][0]
+                cosine = normal[0] * otherNormal[0] + normal[1] * otherNormal[1] + normal[2] * otherNormal[2]
+                coplanar = 1 - cosine <= COPLANAR_NORMAL_EPSILON and abs(distance - planes[j][1]) <= COPLANAR_DISTANCE_EPSILON
+                result = tryMerge(polygon, polygons[j], a, b, positions, normal, uses) if coplanar else None
+                if result is not None:
+                    polygons[i] = result
+                    polygons[j] = None
+                    origins[i] = min(origins[i], origins[j])
+                    for n in range(len(result)):
+                        owners[(result[n], result[(n + 1) % len(result)])] = i
+                    k = 0
+                    continue
+            k += 1
+
+    origins = [origin for origin, polygon in zip(origins, polygons) if polygon is not None]
+    polygons = [polygon for polygon in polygons if polygon is not None]
+
+    return list(zip(origins, polygons))
+
+""" Welds vertices within `tolerance` of each other and merges neighbouring convex faces that share a plane
+    (and side) and a texInfo, so they also share a texture and UV mapping, wherever the result stays convex.
+    Returns new vertices, edges, ledges and faces laid out like the BSP lumps, ready for triangulate() """
+def mergeCoplanarFaces(vertices, edges, lEdges, faces, tolerance=DEFAULT_VERTEX_WELD_TOLERANCE):
+    vertices, remap = deduplicate(vertices, tolerance)
+    positions = vertices.astype(np.float64)
+
+    # Welding can collapse neighbouring corners onto each other, so repeats round each face are dropped
+    corners, counts = faceCorners(edges, lEdges, faces)
+    corners = remap[corners]
+    keep = corners != corners[followingCorners(counts)]
+    corners = corners[keep]
+    counts = np.bincount(np.repeat(np.arange(len(faces)), counts)[keep], minlength=len(faces))
+
+    uses = np.bincount(corners, minlength=len(vertices)).tolist()
+    normals, distances = facePlanes(corners, counts, positions)
+    planes = [(tuple(normal), distance) if any(normal) else None for normal, distance in zip(normals.tolist(), distances.tolist())]
+    polygons = [polygon.tolist() for polygon in np.split(corners, np.cumsum(counts)[:-1])]
+    positions = positions.tolist()
+
+    groups = {}
+    for i, face in enumerate(faces[["planeIndex", "side", "texInfoID"]].tolist()):
+        if len(polygons[i]) >= 3:
+            groups.setdefault(face, []).append(i)
+
+    # Merged faces take the place (and the other fields) of the first face that went into them
+    merged = []
+    for members in groups.values():
+        if len(members) == 1:
+            merged.append((members[0], polygons[members[0]]))
+            continue
+
+        merged.extend(mergePolygons([polygons[i] for i in members], members, [planes[i] for i in members], positions, uses))
+    merged.sort(key=lambda item: item[0])
+
+    counts = np.array([len(polygon) for face, polygon in merged], dtype=np.intp)
+    corners = np.array([vertex for face, polygon in merged for vertex in polygon], dtype=edges["vert1"].dtype)
+
+    # Each corner gets an edge of its own starting and ending at that corner
+    newEdges = np.empty(len(corners), dtype=edges.dtype)
+    newEdges["vert1"] = corners
+    newEdges["vert2"] = corners
+    newLEdges = np.arange(len(corners), dtype=lEdges.dtype)
+
+    newFaces = faces[[face for face, polygon in merged]].copy()
+    newFaces["firstEdgeIndex"] = np.cumsum(counts) - counts
+    newFaces["numEdges"] = counts
+
+    return vertices, newEdges, newLEdges, newFaces, SimplifyReport(len(remap), len(vertices), len(faces), len(newFaces))
+
+""" Returns the average number of vertex cache misses per triangle for an index list,
+    simulating a FIFO cache of `cacheSize` vertices """
+def averageCacheMissRatio(vertexIndices, cacheSize=DEFAULT_VERTEX_CACHE_SIZE):
+    if len(vertexIndices) == 0:
+        return 0.0
+
+    cache = {}
+    time = 0
+    misses = 0
+    for vertex in vertexIndices.ravel().tolist():
+        if vertex not in cache or time - cache[vertex] >= cacheSize:
+            cache[vertex] = time
+            time += 1
+            misses += 1
+
+    return misses / float(len(vertexIndices))
+
+""" Orders triangles for the post-transform vertex cache using Tipsify (Sander, Nehab and Barczak,
+    "Fast Triangle Reordering for Vertex Locality and Reduced Overdraw", 2007), returning the new order """
+def tipsify(vertexIndices, cacheSize=DEFAULT_VERTEX_CACHE_SIZE):
+    numTriangles = len(vertexIndices)
+    if numTriangles == 0:
+        return np.zeros(0, dtype=np.intp)
+
+    # Vertices are renumbered densely so per-vertex state can live in flat lists
+    vertexIDs, triangles = np.unique(vertexIndices, return_inverse=True)
+    triangles = triangles.reshape(-1, 3).tolist()
+    numVertices = len(vertexIDs)
+
+    adjacency = [[] for i in range(numVertices)]
+    for t, triangle in enumerate(triangles):
+        for vertex in triangle:
+            adjacency[vertex].append(t)
+
+    live = [len(adjacent) for adjacent in adjacency]
+    cacheTime = [0] * numVertices
+    emitted = [False] * numTriangles
+    deadEnds = []
+    order = []
+    time = cacheSize + 1
+    cursor = 0
+    fanning = 0
+
+    while fanning >= 0:
+        candidates = set()
+        for t in adjacency[fanning]:
+            if emitted[t]:
+                continue
+            emitted[t] = True
+            order.append(t)
+            for vertex in triangles[t]:
+                deadEnds.append(vertex)
+                candidates.add(vertex)
+                live[vertex] -= 1
+                if time - cacheTime[vertex] > cacheSize:
+                    cacheTime[vertex] = time
+                    time += 1
+
+        # Prefer the candidate that will still be in the cache once its remaining triangles are emitted
+        fanning = -1
+        best = -1
+        for vertex in candidates:
+            if live[vertex] > 0:
+                priority = 0
+                if time - cacheTime[vertex] + 2 * live[vertex] <= cacheSize:
+                    priority = time - cacheTime[vertex]
+                if priority > best:
+                    best = priority
+                    fanning = vertex
+
+        # Otherwise back up to a recently used vertex that still has triangles, or the next one in order
+        while fanning < 0 and len(deadEnds) > 0:
+            vertex = deadEnds.pop()
+            if live[vertex] > 0:
+                fanning = vertex
+        while fanning < 0 and cursor < numVertices:
+            if live[cursor] > 0:
+                fanning = cursor
+            cursor += 1
+
+    return np.array(order, dtype=np.intp)
+
+""" Reorders each group's triangles for better post-transform vertex cache use. Winding is untouched """
+def optimizeVertexCache(mesh, cacheSize=DEFAULT_VERTEX_CACHE_SIZE):
+    groups = {}
+    for name, group in mesh.groups.items():
+        order = tipsify(group.vertexIndices, cacheSize)
+        groups[name] = TextureGroup(group.vertexIndices[order], group.uvIndices[order], group.normalIndices[order])
+
+    return Mesh(mesh.vertices, mesh.uvs, mesh.normals, groups, mesh.textures, mesh.lightmapUVs, mesh.lightmap)
@@ -0,0 +1,139 @@
+import sys, time, threading, tracemalloc, contextlib
+
+""" Timers and counters for each stage of a conversion. Stages can nest and be entered any number of
+    times; each accumulates its total time and number of calls. Counters are plain named totals
+    (bytes read, faces, triangles, textures decoded...). When disabled everything is a no-op """
+class Stats(object):
+    # `traceMemory` records the peak memory allocated within each stage with tracemalloc, which is
+    # accurate but slows everything down considerably
+    def __init__(self, enabled=True, traceMemory=False):
+        self.enabled = enabled
+        self.traceMemory = traceMemory
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.seconds = {}
+            self.calls = {}
+            self.peakBytes = {}
+            self.counters = {}
+
+    def enable(self, traceMemory=False):
+        self.enabled = True
+        self.traceMemory = traceMemory
+
+    def disable(self):
+        self.enabled = False
+        self.traceMemory = False
+
+    def count(self, name, amount=1):
+        if not self.enabled:
+            return
+
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def stage(self, name):
+        if not self.enabled:
+            return NULL_STAGE
+
+        return self.timedStage(name)
+
+    # Stages open on the calling thread, outermost first, as [name, peak, baseline] frames
+    def openStages(self):
+        if not hasattr(self.local, "stages"):
+            self.local.stages = []
+        return self.local.stages
+
+    @contextlib.contextmanager
+    def timedStage(self, name):
+        stages = self.openStages()
+        tracing = self.traceMemory and tracemalloc.is_tracing()
+        if tracing:
+            # Resetting the peak would hide it from enclosing stages, so fold it into them first
+            current, peak = tracemalloc.get_traced_memory()
+            for frame in stages:
+                frame[1] = max(frame[1], peak)
+            tracemalloc.reset_peak()
+
+        frame = [name, 0, current if tracing else 0]
+        stages.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            stages.pop()
+
+            if tracing:
+                _, peak = tracemalloc.get_traced_memory()
+                for openFrame in stages:
+                    openFrame[1] = max(openFrame[1], peak)
+                frame[1] = max(frame[1], peak)
+
+            with self.lock:
+                self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+                self.calls[name] = self.calls.get(name, 0) + 1
+                if tracing:
+                    self.peakBytes[name] = max(self.peakBytes.get(name, 0), frame[1] - frame[2])
+
+    # A plain copy of everything recorded, which can be pickled or merged into another Stats
+    def snapshot(self):
+        with self.lock:
+            return (dict(self.seconds), dict(self.calls), dict(self.peakBytes), dict(self.counters))
+
+    def merge(self, seconds, calls, peakBytes, counters):
+        with self.lock:
+            for name, value in seconds.items():
+                self.seconds[name] = self.seconds.get(name, 0.0) + value
+            for name, value in calls.items():
+                self.calls[name] = self.calls.get(name, 0) + value
+            for name, value in peakBytes.items():
+                self.peakBytes[name] = max(self.peakBytes.get(name, 0), value)
+            for name, value in counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def toJSON(self):
+        seconds, calls, peakBytes, counters = self.snapshot()
+        stages = {}
+        for name in seconds:
+            stages[name] = {"seconds": seconds[name], "calls": calls[name]}
+            if name in peakBytes:
+                stages[name]["peakBytes"] = peakBytes[name]
+
+        return {"stages": stages, "counters": counters, "peakRSSBytes": peakRSS()}
+
+    def __repr__(self):
+        seconds, calls, peakBytes, counters = self.snapshot()
+        lines = ["Stage                        Time    Calls"]
+        for name in sorted(seconds, key=lambda name: -seconds[name]):
+            line = "  {:<20} {:>10.2f}ms {:>8}".format(name, seconds[name] * 1000.0, calls[name])
+            if name in peakBytes:
+                line += "  {:>10.2f} MB peak".format(peakBytes[name] / (1024.0 * 1024.0))
+            lines.append(line)
+
+        for name in sorted(counters):
+            lines.append("  {:<20} {:>10}".format(name, counters[name]))
+
+        rss = peakRSS()
+        if rss is not None:
+            lines.append("  {:<20} {:>10.2f} MB".format("peak RSS", rss / (1024.0 * 1024.0)))
+        return "\n".join(lines)
+
+NULL_STAGE = contextlib.nullcontext()
+
+# Peak resident set size of this process so far, in bytes, or None where it can't be measured
+def peakRSS():
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    maxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return maxRSS if sys.platform == "darwin" else maxRSS * 1024
+
+# Shared by every stage of the pipeline. Disabled unless asked for (see --stats), so it costs next to nothing
+stats = Stats(enabled=False)
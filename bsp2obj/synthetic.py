@@ -0,0 +1,253 @@
+import math, struct
+
+import numpy as np
+
+from bsp2obj.constants import *
+from bsp2obj.lightmap import *
+
+""" Generators for synthetic BSP and PAK files, so conversion can be benchmarked (and exercised)
+    without shipping game data. Maps are a heightfield of faces laid out on a grid, textured
+    at random, lit at random, and packed into a PAK alongside a palette, their textures and filler entries """
+
+SYNTHETIC_GAMES = [Game.Q1, Game.HL1, Game.Q2, Game.DAIKATANA]
+SYNTHETIC_MAP_NAME = "maps/synthetic.bsp"
+SYNTHETIC_PALETTE_NAME = "gfx/palette.lmp"
+
+# Edge length (in map units) of a grid cell, and the heights a grid corner can sit at
+SYNTHETIC_CELL_SIZE = 32
+SYNTHETIC_HEIGHTS = [0.0, 0.0, 16.0]
+
+# One face in this many has no lightmap, like sky and liquids in a real map
+SYNTHETIC_UNLIT_EVERY = 16
+
+# Corner indices are stored as unsigned shorts, as in the real format
+MAX_SYNTHETIC_VERTICES = 65536
+
+SYNTHETIC_FACE_DTYPE = np.dtype([
+    ("planeIndex", "<u2"),
+    ("side", "<u2"),
+    ("firstEdgeIndex", "<i4"),
+    ("numEdges", "<i2"),
+    ("texInfoID", "<i2"),
+    ("lightStyles", "u1", (4,)),
+    ("lightmapOffset", "<i4")
+])
+
+def isQ2Format(game):
+    return game is Game.Q2 or game is Game.KINGPIN or game is Game.DAIKATANA
+
+def syntheticPalette():
+    index = np.arange(256 * 3)
+    return ((index // 3 * 7 + index % 3 * 31) % 256).astype(np.uint8).tobytes()
+
+def syntheticTextureName(game, i):
+    return ("e1u1/tex%i" if isQ2Format(game) else "tex%i")%(i)
+
+# Random palette indices for a texture and its three mip levels
+def syntheticMipLevels(width, height, rng):
+    return rng.integers(0, 256, width * height + (width // 2) * (height // 2) + (width // 4) * (height // 4) + (width // 8) * (height // 8), dtype=np.uint8).tobytes()
+
+def mipOffsets(headerSize, width, height):
+    offsets = [headerSize]
+    for level in range(1, 4):
+        offsets.append(offsets[-1] + (width >> (level - 1)) * (height >> (level - 1)))
+    return offsets
+
+# A miptex as embedded in Quake and Half-Life BSPs. Half-Life's carry their own palette after the last mip
+def syntheticMipTex(game, name, width, height, rng):
+    data = struct.pack("16sII4I", name.encode("ascii"), width, height, *mipOffsets(40, width, height)) + syntheticMipLevels(width, height, rng)
+    if game is Game.HL1:
+        data += struct.pack("<H", 256) + syntheticPalette() + b"\x00\x00"
+    return data
+
+# A standalone WAL as stored in Quake 2 and Daikatana PAKs
+def syntheticWAL(game, name, width, height, rng):
+    if game is Game.DAIKATANA:
+        offsets = mipOffsets(892, width, height) + [0] * 5
+        header = struct.pack("c32s3sIIIIIIIIIII32sII768sI", b"\x03", name.encode("ascii"), b"", width, height, *offsets, b"", 0, 0, syntheticPalette(), 0)
+    else:
+        header = struct.pack("32sII4I32sIII", name.encode("ascii"), width, height, *mipOffsets(100, width, height), b"", 0, 0, 0)
+    return header + syntheticMipLevels(width, height, rng)
+
+""" Builds the vertices, edges, ledges and faces of a grid of `numFaces` faces. Each face has `edgesPerFace`
+    sides (an even number, at least 4): its top and bottom are split into equal segments shared with the
+    neighbouring faces, like the edges of a real BSP. Returns arrays laid out exactly like the lumps """
+def syntheticGeometry(numFaces, edgesPerFace=4, numTextures=1, rng=None):
+    if edgesPerFace < 4 or edgesPerFace % 2 != 0:
+        raise ValueError("Faces need an even number of edges, at least 4, got %i"%(edgesPerFace))
+
+    rng = rng if rng is not None else np.random.default_rng(0)
+    width = max(1, int(math.ceil(math.sqrt(numFaces))))
+    height = max(1, int(math.ceil(numFaces / float(width))))
+    segments = (edgesPerFace - 2) // 2
+
+    # Grid corners first, then the points splitting each horizontal grid line (i, j) -> (i + 1, j)
+    numCorners = (width + 1) * (height + 1)
+    numVertices = numCorners + width * (height + 1) * (segments - 1)
+    if numVertices > MAX_SYNTHETIC_VERTICES:
+        raise ValueError("%i faces with %i edges need %i vertices, more than a BSP can index"%(numFaces, edgesPerFace, numVertices))
+
+    heights = rng.choice(SYNTHETIC_HEIGHTS, numCorners)
+    cornerX, cornerY = np.meshgrid(np.arange(width + 1), np.arange(height + 1))
+    vertices = np.empty((numVertices, 3), dtype="<f4")
+    vertices[:numCorners, 0] = cornerX.ravel() * SYNTHETIC_CELL_SIZE
+    vertices[:numCorners, 1] = cornerY.ravel() * SYNTHETIC_CELL_SIZE
+    vertices[:numCorners, 2] = heights
+
+    lineI, lineJ, step = [array.ravel() for array in np.meshgrid(np.arange(width), np.arange(height + 1), np.arange(1, segments), indexing="ij")]
+    order = np.lexsort((step, lineI, lineJ))
+    lineI, lineJ, step = lineI[order], lineJ[order], step[order]
+    start = heights[lineJ * (width + 1) + lineI]
+    end = heights[lineJ * (width + 1) + lineI + 1]
+    vertices[numCorners:, 0] = (lineI + step / float(segments)) * SYNTHETIC_CELL_SIZE
+    vertices[numCorners:, 1] = lineJ * SYNTHETIC_CELL_SIZE
+    vertices[numCorners:, 2] = start + (end - start) * step / float(segments)
+
+    # The point `s` of `segments` along each horizontal line, as a vertex index
+    lines = np.arange(width * (height + 1)).reshape(height + 1, width)
+    linePoints = np.empty((height + 1, width, segments + 1), dtype=np.int64)
+    linePoints[:, :, 0] = np.arange(width)[None, :] + (np.arange(height + 1) * (width + 1))[:, None]
+    linePoints[:, :, segments] = linePoints[:, :, 0] + 1
+    linePoints[:, :, 1:segments] = numCorners + lines[:, :, None] * (segments - 1) + np.arange(segments - 1)[None, None, :]
+
+    # Edge 0 can't be referenced (ledges use its sign), then horizontal segments, then vertical grid lines
+    numHorizontal = width * (height + 1) * segments
+    numVertical = (width + 1) * height
+    edges = np.zeros(1 + numHorizontal + numVertical, dtype=[("vert1", "<u2"), ("vert2", "<u2")])
+    edges["vert1"][1:1 + numHorizontal] = linePoints[:, :, :-1].ravel()
+    edges["vert2"][1:1 + numHorizontal] = linePoints[:, :, 1:].ravel()
+    verticalStart = np.arange(numVertical)
+    edges["vert1"][1 + numHorizontal:] = verticalStart
+    edges["vert2"][1 + numHorizontal:] = verticalStart + width + 1
+
+    # Each face walks its bottom line forwards, up its right side, its top line backwards and down its left side
+    faceI = np.arange(numFaces) % width
+    faceJ = np.arange(numFaces) // width
+    horizontal = lambda i, j: 1 + (j * width + i)[:, None] * segments + np.arange(segments)[None, :]
+    vertical = lambda i, j: 1 + numHorizontal + j * (width + 1) + i
+    lEdges = np.concatenate((
+        horizontal(faceI, faceJ),
+        vertical(faceI + 1, faceJ)[:, None],
+        -horizontal(faceI, faceJ + 1)[:, ::-1],
+        -vertical(faceI, faceJ)[:, None]
+    ), axis=1).astype("<i4").ravel()
+
+    faces = np.zeros(numFaces, dtype=SYNTHETIC_FACE_DTYPE)
+    faces["firstEdgeIndex"] = np.arange(numFaces) * edgesPerFace
+    faces["numEdges"] = edgesPerFace
+    faces["texInfoID"] = rng.integers(0, numTextures, numFaces)
+    faces["lightmapOffset"] = -1
+
+    return vertices, edges, lEdges, faces
+
+# The U and V axis (and offset) of each synthetic texInfo
+def syntheticTexInfoAxes(i):
+    return (1.0, 0.0, 0.1 * (i % 8), float(i)), (0.0, 1.0, 0.0, 0.5 * i)
+
+# One texInfo per texture, each projecting the texture with a slightly different scale and offset
+def syntheticTexInfos(game, numTextures):
+    records = []
+    for i in range(numTextures):
+        uAxis, vAxis = syntheticTexInfoAxes(i)
+        if isQ2Format(game):
+            records.append(struct.pack("ffffffffII32sI", *(uAxis + vAxis + (0, 0, syntheticTextureName(game, i).encode("ascii"), 0))))
+        else:
+            records.append(struct.pack("ffffffffII", *(uAxis + vAxis + (i, 0))))
+    return b"".join(records)
+
+""" Gives every face but one in SYNTHETIC_UNLIT_EVERY a lightmap of random luxels sized the way the engines
+    expect, filling in the faces' light styles and offsets. Returns the lighting lump """
+def syntheticLighting(game, vertices, edges, lEdges, faces, numTextures, rng):
+    axes = np.array([syntheticTexInfoAxes(i) for i in range(numTextures)], dtype=np.float64)
+    mins, sizes = lightmapExtents(vertices, edges, lEdges, faces, axes[:, 0], axes[:, 1])
+
+    bytesPerSample = lightmapBytesPerSample(game)
+    lengths = sizes[:, 0] * sizes[:, 1] * bytesPerSample
+    lit = np.arange(len(faces)) % SYNTHETIC_UNLIT_EVERY != SYNTHETIC_UNLIT_EVERY - 1
+    lengths[~lit] = 0
+
+    faces["lightStyles"] = NO_LIGHT_STYLE
+    faces["lightStyles"][lit, 0] = 0
+    faces["lightmapOffset"] = np.where(lit, np.cumsum(lengths) - lengths, -1)
+    return rng.integers(0, 256, int(lengths.sum()), dtype=np.uint8).tobytes()
+
+def packLumps(header, lumps):
+    offset = len(header) + 8 * len(lumps)
+    directory = []
+    for lump in lumps:
+        directory.append(struct.pack("II", offset, len(lump)))
+        offset += len(lump)
+    return header + b"".join(directory) + b"".join(lumps)
+
+""" Generates a BSP for `game`. Returns the BSP's bytes and a list of (name, bytes) for any textures
+    that live outside it (Quake 2-style games keep them in the PAK as WALs) """
+def syntheticBSP(game, numFaces=1024, edgesPerFace=4, numTextures=16, textureSize=64, seed=0):
+    rng = np.random.default_rng(seed)
+    vertices, edges, lEdges, faces = syntheticGeometry(numFaces, edgesPerFace, numTextures, rng)
+    lighting = syntheticLighting(game, vertices, edges, lEdges, faces, numTextures, rng)
+    texInfos = syntheticTexInfos(game, numTextures)
+    names = [syntheticTextureName(game, i) for i in range(numTextures)]
+
+    externals = []
+    if isQ2Format(game):
+        lumps = [b""] * 19
+        lumps[2] = vertices.tobytes()
+        lumps[5] = texInfos
+        lumps[6] = faces.tobytes()
+        lumps[7] = lighting
+        lumps[11] = edges.tobytes()
+        lumps[12] = lEdges.tobytes()
+        externals = [("textures/%s.wal"%(name), syntheticWAL(game, name, textureSize, textureSize, rng)) for name in names]
+        return packLumps(b"IBSP" + struct.pack("I", 38 if game is Game.Q2 else 41), lumps), externals
+
+    mipTextures = [syntheticMipTex(game, name, textureSize, textureSize, rng) for name in names]
+    offsets = np.cumsum([4 + 4 * numTextures] + [len(mipTex) for mipTex in mipTextures[:-1]]).tolist()
+    lumps = [b""] * 15
+    lumps[2] = struct.pack("I%iI"%(numTextures), numTextures, *offsets) + b"".join(mipTextures)
+    lumps[3] = vertices.tobytes()
+    lumps[6] = texInfos
+    lumps[7] = faces.tobytes()
+    lumps[8] = lighting
+    lumps[12] = edges.tobytes()
+    lumps[13] = lEdges.tobytes()
+    return packLumps(struct.pack("I", 30 if game is Game.HL1 else 29), lumps), externals
+
+# Stores `data` with Daikatana's compression using nothing but literal runs, which the reader must still walk
+def compressLiterals(data):
+    pieces = []
+    for start in range(0, len(data), 64):
+        piece = data[start:start + 64]
+        pieces.append(bytes([len(piece) - 1]) + piece)
+    pieces.append(b"\xff")
+    return b"".join(pieces)
+
+""" Packs a list of (name, bytes) into a PAK. Daikatana entries are stored compressed when `compress` is set """
+def syntheticPAK(game, entries, compress=False):
+    body = []
+    directory = []
+    offset = 12
+    for name, data in entries:
+        stored = compressLiterals(data) if compress and game is Game.DAIKATANA else data
+        if game is Game.DAIKATANA:
+            directory.append(struct.pack("56siiii", name.encode("ascii"), offset, len(data), len(stored), 1 if stored is not data else 0))
+        else:
+            directory.append(struct.pack("56sii", name.encode("ascii"), offset, len(data)))
+        body.append(stored)
+        offset += len(stored)
+
+    directory = b"".join(directory)
+    return b"PACK" + struct.pack("ii", offset, len(directory)) + b"".join(body) + directory
+
+""" Writes a PAK at `path` holding a synthetic map (as SYNTHETIC_MAP_NAME), its palette (as SYNTHETIC_PALETTE_NAME),
+    any external textures and `numEntries` filler files of `entrySize` bytes. Returns the number of entries written """
+def writeSyntheticPAK(path, game, numFaces=1024, edgesPerFace=4, numTextures=16, textureSize=64, numEntries=0, entrySize=1024, compress=False, seed=0):
+    data, externals = syntheticBSP(game, numFaces, edgesPerFace, numTextures, textureSize, seed)
+
+    rng = np.random.default_rng(seed + 1)
+    filler = [("sound/filler/%i/%i.wav"%(i // 256, i), rng.integers(0, 256, entrySize, dtype=np.uint8).tobytes()) for i in range(numEntries)]
+    entries = [(SYNTHETIC_MAP_NAME, data), (SYNTHETIC_PALETTE_NAME, syntheticPalette())] + externals + filler
+
+    with open(path, "wb") as f:
+        f.write(syntheticPAK(game, entries, compress))
+
+    return len(entries)
@@ -9,9 +9,10 @@ setup(name='bsp2obj',
       packages=['bsp2obj'],
       install_requires=[
           'pillow',
+          'numpy',
           'enum34'
       ],
       entry_points={
-          'console_scripts':['bsp2obj=bsp2obj.command_line:main']
+          'console_scripts':['bsp2obj=bsp2obj.command_line:main', 'bsp2obj-benchmark=bsp2obj.benchmark:main']
       },
       zip_safe=False)
\ No newline at end of file
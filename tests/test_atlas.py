@@ -0,0 +1,29 @@
+import numpy as np
+
+from bsp2obj.atlas import *
+from bsp2obj.image import *
+from bsp2obj.mesh import *
+
+def flatTexture(name, value):
+    return Texture(bytes([value]) * (16 * 16 * 3), 16, 16, name)
+
+def test_atlas_pages_never_replace_a_texture_named_like_one():
+    vertices = np.array([(0, 0, 0), (1, 0, 0), (0, 1, 0)], dtype=np.float32)
+    normals = np.array([(0, 0, 1)], dtype=np.float64)
+
+    # `wall` fits in a single repeat and goes into the atlas, while `atlas0` repeats far too often to be
+    # split up and keeps its own group
+    uvs = np.array([(0, 0), (1, 0), (0, 1), (0, 0), (1000, 0), (0, 1000)], dtype=np.float64)
+    groups = {
+        "wall": TextureGroup(np.array([[0, 1, 2]]), np.array([[0, 1, 2]]), np.array([0])),
+        "atlas0": TextureGroup(np.array([[0, 1, 2]]), np.array([[3, 4, 5]]), np.array([0])),
+    }
+    textures = {"wall": flatTexture("wall", 10), "atlas0": flatTexture("atlas0", 200)}
+
+    atlas, report = buildAtlas(Mesh(vertices, uvs, normals, groups, textures))
+
+    assert report.pages == 1 and report.excluded == 1
+    assert sorted(atlas.groups) == ["atlas0", "atlas0_"]
+    assert atlas.textures["atlas0"] is textures["atlas0"]
+    assert atlas.textures["atlas0_"].width >= 16
+    assert atlas.numTriangles() == 2
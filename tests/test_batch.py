@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+from bsp2obj.batch import *
+from bsp2obj.synthetic import *
+
+NAMES = ["maps/base1.bsp", "maps/dm/base1.bsp", "maps/dm/ctf/base1.bsp"]
+
+@pytest.fixture(scope="module")
+def paks(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("batch") / "synthetic.pak")
+    entries = [(SYNTHETIC_PALETTE_NAME, syntheticPalette())]
+    for seed, name in enumerate(NAMES):
+        data, externals = syntheticBSP(Game.Q1, 16 * (seed + 1), 4, 2, 16, seed)
+        entries.append((name, data))
+
+    with open(path, "wb") as f:
+        f.write(syntheticPAK(Game.Q1, entries))
+
+    paks = PAKCollection(Game.Q1, [path])
+    yield paks
+    paks.close()
+
+def test_shared_folder_depth():
+    assert sharedFolderDepth(["maps/e1m1.bsp", "MAPS/e1m2.bsp"]) == 1
+    assert sharedFolderDepth(["maps/e1m1.bsp", "maps/dm/dm1.bsp"]) == 1
+    assert sharedFolderDepth(["maps/dm/dm1.bsp", "maps/dm/dm2.bsp"]) == 2
+    assert sharedFolderDepth(["e1m1.bsp", "maps/dm/dm1.bsp"]) == 0
+    assert sharedFolderDepth([]) == 0
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_maps_of_the_same_name_keep_their_folders(tmp_path, paks, workers):
+    converter = BatchConverter(Game.Q1, paks, SYNTHETIC_PALETTE_NAME, str(tmp_path))
+    results = converter.convertAll(paks.namesMatching("maps/**/*.bsp"), workers)
+
+    assert all(result.error is None for result in results)
+    outputs = ["base1.obj", os.path.join("dm", "base1.obj"), os.path.join("dm", "ctf", "base1.obj")]
+    assert sorted(result.outputPath for result in results) == sorted(os.path.join(str(tmp_path), output[:-4]) for output in outputs)
+
+    # Each map was different, so each output has to be too
+    contents = set()
+    for output in outputs:
+        with open(os.path.join(str(tmp_path), output), "rb") as f:
+            contents.add(f.read())
+    assert len(contents) == len(outputs)
@@ -0,0 +1,132 @@
+import random
+
+import pytest
+
+from bsp2obj.pak import *
+
+# The decoder decompressChunks replaced, appending one byte at a time. Slow, but obviously right:
+# back-references that overlap what they're writing repeat naturally
+def referenceDecompress(data):
+    output = bytearray()
+    i = 0
+    while i < len(data):
+        x = data[i]
+        i += 1
+        if x < 64:
+            output += data[i:i+x+1]
+            i += x + 1
+        elif x < 128:
+            for p in range(x - 62):
+                output.append(0)
+        elif x < 192:
+            for p in range(x - 126):
+                output.append(data[i])
+            i += 1
+        elif x < 254:
+            offset = data[i] + 2
+            i += 1
+            for p in range(x - 190):
+                output.append(output[-offset])
+        elif x == 255:
+            break
+    return bytes(output)
+
+# Encoders for each opcode. Runs and copies are 2 bytes long at the least
+def literal(data):
+    return bytes([len(data) - 1]) + data
+
+def zeroes(count):
+    return bytes([count + 62])
+
+def repeat(byte, count):
+    return bytes([count + 126, byte])
+
+def copy(offset, count):
+    return bytes([count + 190, offset - 2])
+
+# A random but valid stream: back-references only ever reach into output that already exists
+def randomStream(rng, length):
+    pieces = []
+    position = 0
+    while position < length:
+        kind = rng.randrange(4)
+        if kind == 0:
+            count = rng.randint(1, 64)
+            pieces.append(literal(bytes(rng.randrange(256) for i in range(count))))
+        elif kind == 1:
+            count = rng.randint(2, 65)
+            pieces.append(zeroes(count))
+        elif kind == 2:
+            count = rng.randint(2, 65)
+            pieces.append(repeat(rng.randrange(256), count))
+        elif position >= 2:
+            count = rng.randint(2, 63)
+            pieces.append(copy(rng.randint(2, min(position, DECOMPRESSION_WINDOW)), count))
+        else:
+            continue
+        position += count
+    pieces.append(b"\xff")
+    return b"".join(pieces)
+
+def decodeAll(data, size):
+    return bytes(decompress(data, size))
+
+def decodeStreaming(data, chunkSize):
+    return b"".join(bytes(chunk) for chunk in decompressChunks(data, chunkSize=chunkSize))
+
+CASES = {
+    "literals": literal(b"hello") + literal(b" world") + b"\xff",
+    "zeroes and runs": literal(b"a") + zeroes(65) + repeat(0x41, 65) + zeroes(2) + b"\xff",
+    # Offset smaller than the length, so the copy reads bytes it has only just written
+    "overlapping copy": literal(b"ab") + copy(2, 63) + b"\xff",
+    "overlapping odd period": literal(b"xyz") + copy(3, 62) + copy(2, 5) + b"\xff",
+    "run then overlapping copy": repeat(7, 3) + literal(b"q") + copy(2, 40) + b"\xff",
+    # Copies reaching as far back as they can, across the window the streaming decoder keeps
+    "copy from the edge of the window": literal(bytes(range(64))) * 4 + literal(b"tail") + copy(DECOMPRESSION_WINDOW, 63) + copy(DECOMPRESSION_WINDOW, 63) + b"\xff",
+    "copies across many windows": literal(bytes(range(64))) * 5 + b"".join(literal(bytes([i] * 40)) + copy(DECOMPRESSION_WINDOW, 63) + copy(2, 20) for i in range(40)) + b"\xff",
+    "ends without terminator": literal(b"abc") + copy(3, 10),
+    "stops at terminator": literal(b"abc") + b"\xff" + literal(b"ignored"),
+    "no-op opcode": literal(b"abc") + b"\xfe" + literal(b"def") + b"\xff",
+    "empty": b"\xff"
+}
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_matches_reference_whole_buffer(name):
+    data = CASES[name]
+    expected = referenceDecompress(data)
+    for size in [0, len(expected), len(expected) + 100]:
+        assert decodeAll(data, size) == expected
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_matches_reference_streaming(name):
+    data = CASES[name]
+    expected = referenceDecompress(data)
+    for chunkSize in [1, 7, 64, DECOMPRESSION_WINDOW, 1000]:
+        assert decodeStreaming(data, chunkSize) == expected
+
+def test_streaming_yields_in_pieces():
+    data = CASES["copies across many windows"]
+    chunks = list(decompressChunks(data, chunkSize=64))
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 64 + DECOMPRESSION_WINDOW + 64 for chunk in chunks)
+
+def test_random_streams_match_reference():
+    rng = random.Random(1234)
+    for i in range(300):
+        data = randomStream(rng, rng.randint(1, 2000))
+        expected = referenceDecompress(data)
+        assert decodeAll(data, len(expected)) == expected
+        assert decodeAll(data, 0) == expected
+        assert decodeStreaming(data, rng.choice([1, 16, 100, DECOMPRESSION_WINDOW, 4096])) == expected
+
+def test_back_reference_before_start_raises():
+    with pytest.raises(ValueError):
+        decodeAll(literal(b"a") + copy(5, 3) + b"\xff", 0)
+
+def test_collection_decompress_data_returns_a_reader():
+    data = CASES["copies across many windows"]
+    expected = referenceDecompress(data)
+    with PAKCollection(Game.DAIKATANA, []) as paks:
+        for size in [0, len(expected)]:
+            with paks.decompressData(data, size) as reader:
+                assert bytes(reader.read()) == expected
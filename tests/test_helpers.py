@@ -0,0 +1,23 @@
+from bsp2obj.helpers import *
+
+def test_window_leaves_a_file_it_was_given_open(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(bytes(range(32)))
+
+    with open(path, "rb") as f:
+        with FileWindow(f, 4, 8) as window:
+            assert window.read() == bytes(range(4, 12))
+
+        assert not f.closed
+        f.seek(0)
+        assert f.read(2) == b"\x00\x01"
+
+def test_window_closes_a_file_it_opened(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(bytes(range(32)))
+
+    window = FileWindow.open(str(path), 16)
+    assert window.read() == bytes(range(16, 32))
+
+    window.close()
+    assert window.file.closed
@@ -0,0 +1,25 @@
+from bsp2obj.index import *
+
+def index(names):
+    directory = DirectoryIndex()
+    for name in names:
+        directory.add(name, None, None)
+    return directory
+
+NAMES = ["maps/e1m1.bsp", "maps/dm/dm1.bsp", "MAPS/Start.BSP", "top.bsp", "textures/e1u1/wall.wal", "textures/e1u2/floor.wal"]
+
+def test_glob_wildcards_stay_within_a_folder():
+    directory = index(NAMES)
+
+    assert directory.glob("maps/*.bsp") == ["MAPS/Start.BSP", "maps/e1m1.bsp"]
+    assert directory.glob("*.bsp") == ["top.bsp"]
+    assert directory.glob("maps/?1m1.bsp") == ["maps/e1m1.bsp"]
+    assert directory.glob("textures/*/f*") == ["textures/e1u2/floor.wal"]
+    assert directory.glob("missing/*") == []
+
+def test_glob_double_star_matches_any_number_of_folders():
+    directory = index(NAMES)
+
+    assert directory.glob("**/*.bsp") == ["MAPS/Start.BSP", "maps/dm/dm1.bsp", "maps/e1m1.bsp", "top.bsp"]
+    assert directory.glob("maps/**") == ["MAPS/Start.BSP", "maps/dm/dm1.bsp", "maps/e1m1.bsp"]
+    assert directory.glob("**/e1u1/*") == ["textures/e1u1/wall.wal"]
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from bsp2obj.bsp import *
+from bsp2obj.pak import *
+from bsp2obj.synthetic import *
+
+NUM_FACES = 256
+
+def buildLitMesh(tmp_path, game):
+    path = str(tmp_path / ("%s.pak"%(game.name.lower())))
+    writeSyntheticPAK(path, game, NUM_FACES, 4, 4, 16)
+    with PAKCollection(game, [path]) as paks:
+        with BSPMap.fromPAKs(paks, SYNTHETIC_MAP_NAME, SYNTHETIC_PALETTE_NAME) as bspMap:
+            assert bspMap.lightmapBytesPerSample() == lightmapBytesPerSample(game)
+            return bspMap.buildMesh(lightmaps=True)
+
+@pytest.mark.parametrize("game", SYNTHETIC_GAMES + [Game.HEXEN2])
+def test_lightmaps_are_built_for_every_game(tmp_path, game):
+    mesh = buildLitMesh(tmp_path, game)
+
+    assert mesh.lightmap is not None and mesh.lightmap.width > 0 and mesh.lightmap.height > 0
+    assert mesh.lightmapUVs.shape == mesh.uvs.shape
+    assert np.all((mesh.lightmapUVs >= 0) & (mesh.lightmapUVs <= 1))
+
+def test_hexen2_lighting_is_grayscale_like_quake(tmp_path):
+    # The same seed gives the same luxels, so a Hexen II map has to come out exactly like Quake's
+    quake = buildLitMesh(tmp_path, Game.Q1)
+    hexen2 = buildLitMesh(tmp_path, Game.HEXEN2)
+
+    assert lightmapBytesPerSample(Game.HEXEN2) == 1
+    assert (hexen2.lightmap.width, hexen2.lightmap.height) == (quake.lightmap.width, quake.lightmap.height)
+    assert hexen2.lightmap.pixels == quake.lightmap.pixels
+    assert np.array_equal(hexen2.lightmapUVs, quake.lightmapUVs)
@@ -0,0 +1,17 @@
+import os
+
+from bsp2obj.manifest import *
+
+def test_records_are_found_however_the_output_path_is_spelled(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "out").mkdir()
+    (tmp_path / "out" / "e1m1.obj").write_bytes(b"")
+
+    manifest = Manifest.load("out")
+    manifest.recordMap("out/e1m1", "source", "palette", "options", {}, [os.path.join("out", "e1m1.obj")])
+    manifest.save()
+
+    manifest = Manifest.load(str(tmp_path / "out"))
+    for outputFileName in ["out/e1m1", "./out/e1m1", "out/../out/e1m1", str(tmp_path / "out" / "e1m1")]:
+        assert manifest.isUpToDate(outputFileName, "source", "palette", "options", None)
+    assert not manifest.isUpToDate("out/e1m2", "source", "palette", "options", None)
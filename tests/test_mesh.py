@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from bsp2obj.mesh import *
+from bsp2obj.helpers import *
+from bsp2obj.image import *
+from bsp2obj.bsp import FACE_DTYPE, EDGE_DTYPE, TextureInfo
+
+# A single face fanned from a corner lying on the line between its neighbours, so its first triangle has no area
+def collinearFace():
+    vertices = np.array([(0, 0, 0), (1, 0, 0), (2, 0, 0), (2, 2, 0), (0, 2, 0)], dtype=np.float32)
+    edges = np.zeros(6, dtype=EDGE_DTYPE)
+    edges["vert1"][1:] = [0, 1, 2, 3, 4]
+    edges["vert2"][1:] = [1, 2, 3, 4, 0]
+    lEdges = np.array([-1, -2, -3, -4, -5], dtype=np.int32)
+    faces = np.zeros(1, dtype=FACE_DTYPE)
+    faces["numEdges"] = 5
+    texInfos = [TextureInfo("flat", Vector3(1, 0, 0), 0, Vector3(0, 1, 0), 0, 0, False)]
+    return vertices, edges, lEdges, faces, texInfos
+
+def test_triangulate_drops_degenerate_triangles():
+    vertices, edges, lEdges, faces, texInfos = collinearFace()
+    mesh = triangulate(vertices, edges, lEdges, faces, texInfos, lambda texInfoID: Texture(b"", 16, 16, "flat"))
+
+    # Five corners fan into three triangles, one of which is a sliver along the bottom edge
+    assert mesh.numTriangles() == 2
+    assert len(mesh.normals) == 2
+    assert np.allclose(np.linalg.norm(mesh.normals, axis=1), 1)
+
+def test_deduplicate_keeps_first_of_each_cell_in_order():
+    values = np.array([(0.5, 0.25), (0, 0), (0.5 + 1e-7, 0.25), (1, 1), (0, 1e-7)])
+    unique, remap = deduplicate(values, 1e-5)
+
+    assert np.array_equal(unique, values[[0, 1, 3]])
+    assert list(remap) == [0, 1, 0, 2, 1]
+
+def test_deduplicate_handles_keys_too_wide_to_pack():
+    # Three columns spanning 2^30 cells each can't be packed into one integer, so rows are keyed by their bytes
+    values = np.array([(0, 0, 0), (2**30, 2**30, 2**30), (0, 0, 0), (2**30, 0, 2**30)], dtype=np.float64)
+    unique, remap = deduplicate(values, 1)
+
+    assert np.array_equal(unique, values[[0, 1, 3]])
+    assert list(remap) == [0, 1, 0, 2]
+
+@pytest.mark.parametrize("tolerance", [0, -1e-5, float("nan")])
+def test_deduplicate_rejects_tolerances_that_are_not_positive(tolerance):
+    with pytest.raises(ValueError):
+        deduplicate(np.array([(0.1, 0.2), (0.3, 0.4), (0.1, 0.2)]), tolerance)
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from bsp2obj.service import *
+from bsp2obj.synthetic import *
+
+@pytest.fixture(scope="module")
+def paks(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("service") / "synthetic.pak")
+    writeSyntheticPAK(path, Game.Q1, 256, 4, 4, 16)
+    paks = PAKCollection(Game.Q1, [path])
+    yield paks
+    paks.close()
+
+# Sends a request over loopback and returns the response's status and body
+async def fetch(port, path, method="GET"):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(("%s %s HTTP/1.1\r\nHost: localhost\r\n\r\n"%(method, path)).encode("latin-1"))
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+
+    head, _, body = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), body
+
+def runService(paks, test):
+    service = ConversionService(Game.Q1, paks, SYNTHETIC_PALETTE_NAME, workers=2)
+
+    async def run():
+        server = await service.start("127.0.0.1", 0)
+        async with server:
+            return await test(service, server.sockets[0].getsockname()[1])
+
+    try:
+        return asyncio.run(run())
+    finally:
+        service.close()
+
+def test_identical_requests_share_a_conversion(paks):
+    async def test(service, port):
+        responses = await asyncio.gather(*[fetch(port, "/convert/" + SYNTHETIC_MAP_NAME) for i in range(6)])
+        assert all(status == 200 for status, body in responses)
+        assert len(set(body for status, body in responses)) == 1
+        assert responses[0][1][:4] == b"glTF"
+        assert service.conversions == 1
+        assert service.coalesced == 5
+
+        # Finished results come straight from the cache
+        status, body = await fetch(port, "/convert/" + SYNTHETIC_MAP_NAME)
+        assert status == 200 and body == responses[0][1]
+        assert service.conversions == 1
+        assert service.results.hits == 1
+
+        # Different options are a different conversion
+        status, body = await fetch(port, "/convert/" + SYNTHETIC_MAP_NAME + "?weld=0.001")
+        assert status == 200
+        assert service.conversions == 2
+
+        status, body = await fetch(port, "/stats")
+        stats = json.loads(body)
+        assert stats["requests"] == 8 and stats["failures"] == 0
+
+    runService(paks, test)
+
+def test_error_responses(paks):
+    async def test(service, port):
+        assert (await fetch(port, "/convert/" + SYNTHETIC_MAP_NAME + "?format=bogus"))[0] == 400
+        assert (await fetch(port, "/convert/" + SYNTHETIC_MAP_NAME + "?weld=abc"))[0] == 400
+        assert (await fetch(port, "/convert/" + SYNTHETIC_MAP_NAME + "?weld=0"))[0] == 400
+        assert (await fetch(port, "/convert/maps/missing.bsp"))[0] == 404
+        assert (await fetch(port, "/convert/" + SYNTHETIC_PALETTE_NAME))[0] == 404
+        assert (await fetch(port, "/unknown"))[0] == 404
+        assert (await fetch(port, "/convert/" + SYNTHETIC_MAP_NAME, "POST"))[0] == 405
+
+        # Longer than MAX_REQUEST_LINE, and longer than the stream's own 64 KiB line limit
+        assert (await fetch(port, "/convert/" + "a" * 10000 + ".bsp"))[0] == 400
+        assert (await fetch(port, "/convert/" + "a" * 100000 + ".bsp"))[0] == 400
+
+        # None of those reached a worker
+        assert service.conversions == 0 and service.failures == 0
+
+    runService(paks, test)
+
+def test_lists_maps(paks):
+    async def test(service, port):
+        status, body = await fetch(port, "/maps")
+        assert status == 200
+        assert json.loads(body) == [SYNTHETIC_MAP_NAME]
+
+    runService(paks, test)
@@ -0,0 +1,57 @@
+import json, struct
+
+import pytest
+
+from bsp2obj.bsp import *
+from bsp2obj.pak import *
+from bsp2obj.exporters import *
+from bsp2obj.synthetic import *
+
+NUM_FACES = 256
+NUM_TEXTURES = 8
+TEXTURE_SIZE = 16
+
+# Every game the synthetic maps cover, plus Daikatana's compressed entries
+GAMES = [(game, False) for game in SYNTHETIC_GAMES] + [(Game.DAIKATANA, True)]
+
+def loadSyntheticMap(tmp_path, game, compress):
+    path = str(tmp_path / "synthetic.pak")
+    writeSyntheticPAK(path, game, NUM_FACES, 4, NUM_TEXTURES, TEXTURE_SIZE, compress=compress)
+    paks = PAKCollection(game, [path])
+    return paks, BSPMap.fromPAKs(paks, SYNTHETIC_MAP_NAME, SYNTHETIC_PALETTE_NAME)
+
+@pytest.mark.parametrize("game, compress", GAMES)
+def test_synthetic_map_round_trips_through_obj(tmp_path, game, compress):
+    paks, bspMap = loadSyntheticMap(tmp_path, game, compress)
+    with paks, bspMap:
+        mesh = bspMap.buildMesh()
+        output = MemoryOutput()
+        names = OBJExporter().export(mesh, "synthetic", output)
+
+    # Each quad fans into two triangles, and every texture is used by some face
+    assert mesh.numTriangles() == NUM_FACES * 2
+    assert len(mesh.textures) == NUM_TEXTURES
+    assert all(texture.load().width == TEXTURE_SIZE for texture in mesh.textures.values())
+
+    lines = output.files["synthetic.obj"].decode("utf-8").splitlines()
+    assert sum(1 for line in lines if line.startswith("f ")) == NUM_FACES * 2
+    assert sum(1 for line in lines if line.startswith("usemtl ")) == NUM_TEXTURES
+    assert len([name for name in names if name.endswith(".png")]) == NUM_TEXTURES
+    assert all(len(output.files[name]) > 0 for name in names)
+
+@pytest.mark.parametrize("game, compress", GAMES)
+def test_synthetic_map_round_trips_through_glb(tmp_path, game, compress):
+    paks, bspMap = loadSyntheticMap(tmp_path, game, compress)
+    with paks, bspMap:
+        output = MemoryOutput()
+        GLBExporter().export(bspMap.buildMesh(), "synthetic", output)
+
+    data = output.files["synthetic.glb"]
+    magic, version, length, jsonLength = struct.unpack_from("<4sIII", data)
+    assert magic == b"glTF" and version == 2 and length == len(data)
+
+    document = json.loads(data[20:20 + jsonLength])
+    primitives = document["meshes"][0]["primitives"]
+    assert sum(document["accessors"][primitive["indices"]]["count"] for primitive in primitives) == NUM_FACES * 2 * 3
+    assert len(primitives) == NUM_TEXTURES
+    assert len(document["images"]) == NUM_TEXTURES